@@ -1,601 +1,620 @@
-from flask import Flask, request, render_template_string, jsonify
-import pandas as pd
-import difflib
-from sklearn.preprocessing import MinMaxScaler
-from sklearn import neighbors
-import os
-import re
-
-app = Flask(__name__)
-
-# HTML template embedded directly in the Python file
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Book Recommendation System</title>
-    <style>
-        :root {
-            --primary-color: #6d28d9;
-            --primary-dark: #5b21b6;
-            --secondary-color: #f8f9fa;
-            --text-color: #333;
-            --light-gray: #e9ecef;
-            --border-radius: 10px;
-            --box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-        }
-        
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        }
-        
-        body {
-            background-color: #f0f2f5;
-            color: var(--text-color);
-            display: flex;
-            flex-direction: column;
-            min-height: 100vh;
-        }
-        
-        header {
-            background-color: var(--primary-color);
-            color: white;
-            padding: 2rem 0;
-            text-align: center;
-            box-shadow: var(--box-shadow);
-        }
-        
-        .container {
-            max-width: 900px;
-            margin: 2rem auto;
-            padding: 0 1rem;
-            flex: 1;
-        }
-        
-        .search-card {
-            background-color: white;
-            padding: 2rem;
-            border-radius: var(--border-radius);
-            box-shadow: var(--box-shadow);
-            margin-bottom: 2rem;
-            position: relative;
-        }
-        
-        h1 {
-            font-size: 2.2rem;
-            margin-bottom: 0.5rem;
-        }
-        
-        h2 {
-            font-size: 1.6rem;
-            margin-bottom: 1.5rem;
-            color: #666;
-        }
-        
-        .search-form {
-            display: flex;
-            flex-direction: column;
-            gap: 1rem;
-            position: relative;
-        }
-        
-        @media (min-width: 768px) {
-            .search-form {
-                flex-direction: row;
-            }
-        }
-        
-        .search-form input {
-            flex: 1;
-            padding: 0.8rem 1rem;
-            border: 2px solid var(--light-gray);
-            border-radius: var(--border-radius);
-            font-size: 1rem;
-            transition: border-color 0.3s;
-        }
-        
-        .search-form input:focus {
-            border-color: var(--primary-color);
-            outline: none;
-        }
-        
-        .search-form button {
-            padding: 0.8rem 1.5rem;
-            background-color: var(--primary-color);
-            color: white;
-            border: none;
-            border-radius: var(--border-radius);
-            cursor: pointer;
-            font-size: 1rem;
-            font-weight: 500;
-            transition: background-color 0.3s;
-        }
-        
-        .search-form button:hover {
-            background-color: var(--primary-dark);
-        }
-        
-        .error {
-            color: #e74c3c;
-            margin-top: 1rem;
-            font-weight: 500;
-        }
-        
-        .match-info {
-            color: #666;
-            font-style: italic;
-            margin-bottom: 1rem;
-        }
-        
-        .recommendations {
-            background-color: white;
-            border-radius: var(--border-radius);
-            padding: 2rem;
-            box-shadow: var(--box-shadow);
-        }
-        
-        .recommendations h3 {
-            margin-bottom: 1.5rem;
-            padding-bottom: 0.5rem;
-            border-bottom: 2px solid var(--light-gray);
-            color: var(--primary-color);
-        }
-        
-        .book-list {
-            list-style-type: none;
-        }
-        
-        .book-item {
-            padding: 1rem;
-            margin-bottom: 0.8rem;
-            background-color: #f9f9f9;
-            border-radius: var(--border-radius);
-            border-left: 4px solid var(--primary-color);
-            transition: transform 0.2s, box-shadow 0.2s;
-        }
-        
-        .book-item:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-        }
-        
-        footer {
-            text-align: center;
-            padding: 1.5rem;
-            background-color: var(--primary-color);
-            color: white;
-            margin-top: auto;
-        }
-        
-        .empty-state {
-            text-align: center;
-            padding: 3rem 0;
-            color: #666;
-        }
-        
-        .empty-state p {
-            margin-top: 1rem;
-            font-size: 1.1rem;
-        }
-        
-        /* Autocomplete styles */
-        .autocomplete-container {
-            position: relative;
-            flex: 1;
-        }
-        
-        .autocomplete-results {
-            position: absolute;
-            z-index: 999;
-            top: 100%;
-            left: 0;
-            right: 0;
-            background: white;
-            border: 1px solid var(--light-gray);
-            border-radius: 0 0 var(--border-radius) var(--border-radius);
-            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-            max-height: 300px;
-            overflow-y: auto;
-            display: none;
-        }
-        
-        .autocomplete-results.active {
-            display: block;
-        }
-        
-        .autocomplete-item {
-            padding: 0.8rem 1rem;
-            cursor: pointer;
-            transition: background-color 0.2s;
-            border-bottom: 1px solid var(--light-gray);
-        }
-        
-        .autocomplete-item:last-child {
-            border-bottom: none;
-        }
-        
-        .autocomplete-item:hover {
-            background-color: #f5f5f5;
-        }
-        
-        .highlight {
-            font-weight: bold;
-            color: var(--primary-color);
-        }
-    </style>
-</head>
-<body>
-    <header>
-        <h1>Book Recommendation System</h1>
-        <p>Find your next favorite read based on machine learning</p>
-    </header>
-    
-    <div class="container">
-        <div class="search-card">
-            <h2>Discover New Books</h2>
-            <form class="search-form" method="POST" id="search-form">
-                <div class="autocomplete-container">
-                    <input 
-                        type="text" 
-                        name="book_name" 
-                        id="book-search" 
-                        placeholder="Enter a book title you enjoy..." 
-                        value="{{ book_name }}" 
-                        autocomplete="off"
-                        required
-                    >
-                    <div class="autocomplete-results" id="autocomplete-results"></div>
-                </div>
-                <button type="submit">Get Recommendations</button>
-            </form>
-            
-            {% if error %}
-                <p class="error">{{ error }}</p>
-            {% endif %}
-        </div>
-        
-        {% if recommendations %}
-            <div class="recommendations">
-                {% if matched_title and matched_title != book_name %}
-                    <p class="match-info">Based on: "{{ matched_title }}"</p>
-                {% endif %}
-                
-                <h3>Recommended Books For You</h3>
-                <ul class="book-list">
-                    {% for book in recommendations %}
-                        <li class="book-item">{{ book }}</li>
-                    {% endfor %}
-                </ul>
-            </div>
-        {% elif not error and request.method != 'POST' %}
-            <div class="empty-state">
-                <svg width="120" height="120" viewBox="0 0 24 24" fill="none" xmlns="http://www.w3.org/2000/svg">
-                    <path d="M4 19.5C4 18.837 4.26339 18.2011 4.73223 17.7322C5.20107 17.2634 5.83696 17 6.5 17H20" stroke="#6d28d9" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"/>
-                    <path d="M6.5 2H20V22H6.5C5.83696 22 5.20107 21.7366 4.73223 21.2678C4.26339 20.7989 4 20.163 4 19.5V4.5C4 3.83696 4.26339 3.20107 4.73223 2.73223C5.20107 2.26339 5.83696 2 6.5 2Z" stroke="#6d28d9" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"/>
-                </svg>
-                <p>Enter a book title to get personalized recommendations</p>
-            </div>
-        {% endif %}
-    </div>
-    
-    <footer>
-        <p>© 2025 Book Recommendation System | Powered by Machine Learning</p>
-    </footer>
-    
-    <script>
-        // Autocomplete functionality
-        document.addEventListener('DOMContentLoaded', function() {
-            const searchInput = document.getElementById('book-search');
-            const resultsContainer = document.getElementById('autocomplete-results');
-            const searchForm = document.getElementById('search-form');
-            
-            let selectedIndex = -1;
-            let searchResults = [];
-            
-            // Fetch book suggestions as user types
-            searchInput.addEventListener('input', debounce(async function() {
-                const query = searchInput.value.trim();
-                
-                if (query.length < 2) {
-                    resultsContainer.classList.remove('active');
-                    return;
-                }
-                
-                try {
-                    const response = await fetch(`/autocomplete?q=${encodeURIComponent(query)}`);
-                    searchResults = await response.json();
-                    
-                    if (searchResults.length > 0) {
-                        displayResults(searchResults, query);
-                        resultsContainer.classList.add('active');
-                    } else {
-                        resultsContainer.classList.remove('active');
-                    }
-                } catch (error) {
-                    console.error('Error fetching autocomplete results:', error);
-                }
-            }, 300));
-            
-            // Handle keyboard navigation
-            searchInput.addEventListener('keydown', function(e) {
-                if (!resultsContainer.classList.contains('active')) return;
-                
-                const items = resultsContainer.querySelectorAll('.autocomplete-item');
-                
-                // Down arrow
-                if (e.key === 'ArrowDown') {
-                    e.preventDefault();
-                    selectedIndex = Math.min(selectedIndex + 1, items.length - 1);
-                    highlightItem(items);
-                }
-                
-                // Up arrow
-                else if (e.key === 'ArrowUp') {
-                    e.preventDefault();
-                    selectedIndex = Math.max(selectedIndex - 1, -1);
-                    highlightItem(items);
-                }
-                
-                // Enter key
-                else if (e.key === 'Enter' && selectedIndex >= 0) {
-                    e.preventDefault();
-                    searchInput.value = searchResults[selectedIndex];
-                    resultsContainer.classList.remove('active');
-                    selectedIndex = -1;
-                    searchForm.submit();
-                }
-                
-                // Escape key
-                else if (e.key === 'Escape') {
-                    resultsContainer.classList.remove('active');
-                    selectedIndex = -1;
-                }
-            });
-            
-            // Hide results when clicking outside
-            document.addEventListener('click', function(e) {
-                if (!searchInput.contains(e.target) && !resultsContainer.contains(e.target)) {
-                    resultsContainer.classList.remove('active');
-                }
-            });
-            
-            // Display results with highlighted matching parts
-            function displayResults(results, query) {
-                resultsContainer.innerHTML = '';
-                
-                results.forEach((result, index) => {
-                    const item = document.createElement('div');
-                    item.className = 'autocomplete-item';
-                    
-                    // Highlight matching part
-                    const regex = new RegExp(`(${escapeRegExp(query)})`, 'gi');
-                    const highlightedText = result.replace(regex, '<span class="highlight">$1</span>');
-                    
-                    item.innerHTML = highlightedText;
-                    
-                    // Click handler
-                    item.addEventListener('click', function() {
-                        searchInput.value = result;
-                        resultsContainer.classList.remove('active');
-                        searchForm.submit();
-                    });
-                    
-                    // Mouseover handler
-                    item.addEventListener('mouseover', function() {
-                        selectedIndex = index;
-                        highlightItem(resultsContainer.querySelectorAll('.autocomplete-item'));
-                    });
-                    
-                    resultsContainer.appendChild(item);
-                });
-            }
-            
-            // Highlight selected item
-            function highlightItem(items) {
-                items.forEach((item, index) => {
-                    if (index === selectedIndex) {
-                        item.style.backgroundColor = '#f0f0f0';
-                    } else {
-                        item.style.backgroundColor = '';
-                    }
-                });
-                
-                if (selectedIndex >= 0) {
-                    const selectedItem = items[selectedIndex];
-                    selectedItem.scrollIntoView({ block: 'nearest' });
-                }
-            }
-            
-            // Debounce function to limit API calls
-            function debounce(func, delay) {
-                let timeout;
-                return function() {
-                    const context = this;
-                    const args = arguments;
-                    clearTimeout(timeout);
-                    timeout = setTimeout(() => func.apply(context, args), delay);
-                };
-            }
-            
-            // Escape special characters for regex
-            function escapeRegExp(string) {
-                return string.replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
-            }
-        });
-    </script>
-</body>
-</html>
-'''
-
-# Load data and prepare model
-def load_model():
-    # Check if file exists
-    csv_path = 'books1.csv'
-    if not os.path.exists(csv_path):
-        print(f"WARNING: {csv_path} not found!")
-        # Use a more common filename as fallback
-        alternative_paths = ['books.csv', 'books1.csv', 'books_data.csv']
-        for alt_path in alternative_paths:
-            if os.path.exists(alt_path):
-                csv_path = alt_path
-                print(f"Using alternative CSV file: {alt_path}")
-                break
-    
-    try:
-        print(f"Loading data from {csv_path}...")
-        df = pd.read_csv(csv_path, on_bad_lines='skip')
-        df2 = df.copy()
-        
-        # Ensure required columns exist
-        required_columns = ['title', 'average_rating', 'ratings_count', 'language_code']
-        missing_columns = [col for col in required_columns if col not in df2.columns]
-        if missing_columns:
-            raise ValueError(f"Missing required columns: {missing_columns}")
-        
-        # Convert ratings to float if needed
-        df2['average_rating'] = df2['average_rating'].astype(float)
-        
-        # Create rating categories
-        df2.loc[(df2['average_rating'] >= 0) & (df2['average_rating'] <= 1), 'rating_between'] = "between 0 and 1"
-        df2.loc[(df2['average_rating'] > 1) & (df2['average_rating'] <= 2), 'rating_between'] = "between 1 and 2"
-        df2.loc[(df2['average_rating'] > 2) & (df2['average_rating'] <= 3), 'rating_between'] = "between 2 and 3"
-        df2.loc[(df2['average_rating'] > 3) & (df2['average_rating'] <= 4), 'rating_between'] = "between 3 and 4"
-        df2.loc[(df2['average_rating'] > 4) & (df2['average_rating'] <= 5), 'rating_between'] = "between 4 and 5"
-        
-        # Create feature matrix
-        rating_df = pd.get_dummies(df2['rating_between'])
-        language_df = pd.get_dummies(df2['language_code'])
-        features = pd.concat([rating_df, 
-                            language_df, 
-                            df2['average_rating'], 
-                            df2['ratings_count']], axis=1)
-        
-        # Scale features
-        min_max_scaler = MinMaxScaler()
-        features = min_max_scaler.fit_transform(features)
-        
-        # Train model
-        model = neighbors.NearestNeighbors(n_neighbors=6, algorithm='ball_tree')
-        model.fit(features)
-        dist, idlist = model.kneighbors(features)
-        
-        print(f"Model loaded successfully! Dataset has {len(df2)} books")
-        return df2, idlist
-    except Exception as e:
-        print(f"Error loading model: {str(e)}")
-        # Return empty dataframes as fallback
-        return pd.DataFrame(), []
-
-# Find matching book titles
-def find_matching_books(query, max_results=10):
-    if df2 is None or df2.empty:
-        return []
-        
-    query = query.lower().strip()
-    
-    # Direct partial matching
-    direct_matches = df2[df2['title'].str.lower().str.contains(query, case=False, na=False)]
-    
-    # If we have enough direct matches, return those
-    if len(direct_matches) >= max_results:
-        return direct_matches['title'].head(max_results).tolist()
-    
-    # Otherwise, try fuzzy matching for the remaining slots
-    result_set = set(direct_matches['title'].tolist())
-    remaining_slots = max_results - len(result_set)
-    
-    if remaining_slots > 0:
-        # Get all titles not already in the result set
-        other_titles = [t for t in df2['title'].tolist() if t not in result_set]
-        
-        # Use difflib to find close matches
-        fuzzy_matches = difflib.get_close_matches(query, other_titles, n=remaining_slots, cutoff=0.4)
-        result_set.update(fuzzy_matches)
-    
-    return list(result_set)
-
-# Book recommendation function
-def book_recommender(book_name):
-    global df2, idlist
-    
-    # Check if model is loaded
-    if df2 is None or idlist is None or df2.empty:
-        return [], "Error: Book database not loaded properly"
-    
-    # Step 1: Try substring match (case-insensitive)
-    matches = df2[df2['title'].str.contains(book_name, case=False, na=False)]
-
-    if not matches.empty:
-        matched_title = matches.iloc[0]['title']
-    else:
-        # Step 2: Fallback to fuzzy match if no substring match found
-        all_titles = df2['title'].tolist()
-        closest_match = difflib.get_close_matches(book_name, all_titles, n=1, cutoff=0.5)
-        if not closest_match:
-            return [], "No similar book title found in our database"
-        matched_title = closest_match[0]
-
-    book_list_name = []
-    try:
-        book_index = df2[df2['title'] == matched_title].index[0]
-        
-        # Recommend books (skip first one as it's the same book)
-        for newid in idlist[book_index][1:6]:  # Get top 5 recommendations
-            book_list_name.append(df2.loc[newid].title)
-            
-        return book_list_name, matched_title
-    except IndexError:
-        return [], "Error finding the book in our database"
-
-# Autocomplete API endpoint
-@app.route('/autocomplete')
-def autocomplete():
-    query = request.args.get('q', '')
-    if len(query) < 2:
-        return jsonify([])
-    
-    matching_titles = find_matching_books(query)
-    return jsonify(matching_titles)
-
-@app.route('/', methods=['GET', 'POST'])
-def index():
-    matched_title = None
-    recommendations = None
-    error = None
-    
-    if request.method == 'POST':
-        book_name = request.form.get('book_name', '')
-        if book_name:
-            recommendations, result = book_recommender(book_name)
-            if not recommendations:
-                error = result  # This will be the error message
-            else:
-                matched_title = result  # This will be the matched title
-    
-    return render_template_string(HTML_TEMPLATE, 
-                                recommendations=recommendations, 
-                                book_name=request.form.get('book_name', '') if request.method == 'POST' else '',
-                                matched_title=matched_title,
-                                error=error)
-
-# Try to pre-load the model when the app starts
-try:
-    print("Loading book recommendation model...")
-    df2, idlist = load_model()
-except Exception as e:
-    print(f"Error pre-loading model: {str(e)}")
-    df2, idlist = None, None
-
-if __name__ == '__main__':
-    # Check if we loaded the model
-    if df2 is None or df2.empty:
-        print("WARNING: Book database not loaded! App will show errors when making recommendations.")
-    
-    # Run the Flask app
-    print("Starting Flask app... Access it at http://127.0.0.1:5000")
+from flask import Flask, request, render_template, jsonify, abort, g
+import cProfile
+import io
+import os
+import pstats
+import re
+import signal
+import time
+from model_store import load_or_build
+from features import feature_config
+from neighbor_index import NeighborIndex
+from model_holder import ModelHolder, build_snapshot
+from rerank import RerankConfig
+from facets import parse_filters
+from catalogue import upsert_books
+from http_cache import etag_for, hot_rows
+from static_assets import IMMUTABLE, StaticAssets, negotiate
+from metrics import CONTENT_TYPE, REGISTRY
+
+app = Flask(__name__, static_folder=None)
+
+# Neighbor queries are answered from the artifact's neighbor table when it
+# is wide enough, otherwise on demand and cached. The table is built offline
+# by precompute.py; PRECOMPUTE_NEIGHBORS=k only warns when it is missing.
+PRECOMPUTE_NEIGHBORS = int(os.environ.get('PRECOMPUTE_NEIGHBORS', '0'))
+NEIGHBOR_CACHE_SIZE = int(os.environ.get('NEIGHBOR_CACHE_SIZE', '4096'))
+KNN_BACKEND = os.environ.get('KNN_BACKEND', 'ball_tree')
+# Feature mode (compat or fast) and optional group weights, e.g. "ratings_count=2"
+FEATURES = feature_config(os.environ.get('FEATURE_MODE', 'compat'), os.environ.get('FEATURE_WEIGHTS'))
+DEFAULT_K = 5
+MAX_K = 100
+MAX_BATCH = 1000
+# Admin endpoints (catalogue updates) are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Recommendation and autocomplete responses carry an ETag for the model and
+# query and may be cached this many seconds; responses for the most rated
+# titles are serialized once per model
+CACHE_MAX_AGE = int(os.environ.get('CACHE_MAX_AGE', '3600'))
+RESPONSE_CACHE_TITLES = int(os.environ.get('RESPONSE_CACHE_TITLES', '1000'))
+# Requests sent with an X-Profile header print a cProfile summary (top
+# PROFILE_LINES functions) when PROFILE_REQUESTS=1; with ADMIN_TOKEN set the
+# request must also carry the admin token
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS') == '1'
+PROFILE_LINES = 25
+# Typo tolerance of fuzzy title matching: edits allowed per word and the
+# time one lookup may take before it returns the best titles found so far
+FUZZY_MAX_EDITS = int(os.environ.get('FUZZY_MAX_EDITS', '2'))
+FUZZY_BUDGET = float(os.environ.get('FUZZY_BUDGET_MS', '50')) / 1000
+# Recommendations re-rank RERANK_OVERFETCH x k neighbor candidates: editions
+# of one title are deduplicated, closeness is blended with popularity and
+# near-identical books are spread out (see rerank). RERANK=0 returns the k
+# nearest neighbors as they are.
+RERANK = RerankConfig(enabled=os.environ.get('RERANK', '1') == '1',
+                      popularity=float(os.environ.get('RERANK_POPULARITY', '0.2')),
+                      diversity=float(os.environ.get('RERANK_DIVERSITY', '0.3')),
+                      overfetch=int(os.environ.get('RERANK_OVERFETCH', '4')),
+                      budget=float(os.environ.get('RERANK_BUDGET_MS', '2')) / 1000)
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'bookrec_stage_seconds', "Time spent in each stage of title lookups, recommendations and model loads",
+    ['stage'])
+REQUEST_SECONDS = REGISTRY.histogram(
+    'bookrec_request_seconds', "Request handling time by endpoint", ['endpoint'])
+REQUESTS = REGISTRY.counter('bookrec_requests_total', "Requests by endpoint and status", ['endpoint', 'status'])
+TITLE_RESOLUTIONS = REGISTRY.counter(
+    'bookrec_title_resolutions_total', "Title lookups by the step that resolved them", ['method'])
+AUTOCOMPLETE = REGISTRY.counter(
+    'bookrec_autocomplete_total', "Autocomplete answers by source", ['source'])
+
+# Page templates live in templates/; CSS and JS are served from static/
+# under fingerprinted names (see static_assets)
+ASSETS = StaticAssets()
+app.jinja_env.globals['asset_url'] = ASSETS.url
+
+# Find the catalogue CSV
+def find_csv():
+    # Check if file exists
+    csv_path = 'books1.csv'
+    if not os.path.exists(csv_path):
+        print(f"WARNING: {csv_path} not found!")
+        # Use a more common filename as fallback
+        alternative_paths = ['books.csv', 'books1.csv', 'books_data.csv']
+        for alt_path in alternative_paths:
+            if os.path.exists(alt_path):
+                csv_path = alt_path
+                print(f"Using alternative CSV file: {alt_path}")
+                break
+    return csv_path
+
+# Load data and prepare model. Raises on failure so a failed reload keeps
+# serving the previous snapshot.
+def load_model():
+    csv_path = find_csv()
+    print(f"Loading data from {csv_path}...")
+    # Features and neighbor table come from the memory-mapped artifact,
+    # rebuilt automatically when the CSV checksum changes
+    with STAGE_SECONDS.time(stage='load_store'):
+        store = load_or_build(csv_path, config=FEATURES)
+    
+    neighbor_index = NeighborIndex(store, cache_size=NEIGHBOR_CACHE_SIZE, backend=KNN_BACKEND)
+    if store.neighbors is not None and not neighbor_index.trust_table:
+        print(f"Warning: the neighbor table was built with the approximate "
+              f"{store.manifest.get('knn_backend')} backend, not {KNN_BACKEND}; serving neighbors "
+              f"on demand; rebuild it with `python precompute.py --backend {KNN_BACKEND}`")
+    elif PRECOMPUTE_NEIGHBORS and not neighbor_index.precomputed(PRECOMPUTE_NEIGHBORS):
+        print(f"Warning: the model artifact has no {PRECOMPUTE_NEIGHBORS}-neighbor table, serving "
+              f"neighbors on demand; build it with `python precompute.py --k {PRECOMPUTE_NEIGHBORS}`")
+    
+    # Build the title search indexes once so autocomplete never scans the catalogue
+    with STAGE_SECONDS.time(stage='build_snapshot'):
+        snapshot = build_snapshot(store, neighbor_index, version=0, max_edits=FUZZY_MAX_EDITS,
+                                  fuzzy_budget=FUZZY_BUDGET, rerank=RERANK)
+    with STAGE_SECONDS.time(stage='warm_responses'):
+        warm_responses(snapshot)
+    
+    private, shared = store.memory_footprint()
+    print(f"Recommendation store: {len(store)} books, "
+          f"{sum(private.values()) / 2**20:.1f} MB private, "
+          f"{sum(shared.values()) / 2**20:.1f} MB memory-mapped (shared)")
+    print(f"Model loaded successfully! Dataset has {len(store)} books")
+    return snapshot
+
+# Find matching book titles
+def find_matching_books(query, max_results=10, m=None):
+    return match_titles(query, max_results, m)[0]
+
+# The same as (titles, exhausted), where exhausted means the fuzzy step ran
+# out of its time budget and the titles may not be the best ones
+def match_titles(query, max_results=10, m=None):
+    m = m or holder.current()
+    if m is None:
+        return [], False
+        
+    query = query.lower().strip()
+    
+    # Direct partial matching (literal substring, catalogue order) via the trigram index
+    with STAGE_SECONDS.time(stage='match_substring'):
+        direct_matches = m.title_index.substring_matches(query, limit=max_results)
+    
+    # If we have enough direct matches, return those
+    if len(direct_matches) >= max_results:
+        return direct_matches, False
+    
+    # Otherwise, try fuzzy matching for the remaining slots
+    result_set = list(dict.fromkeys(direct_matches))
+    remaining_slots = max_results - len(result_set)
+    exhausted = False
+    
+    if remaining_slots > 0:
+        # Score only titles that share trigrams with the query, skipping ones already found
+        with STAGE_SECONDS.time(stage='match_fuzzy'):
+            fuzzy_matches, exhausted = m.title_index.fuzzy_matches(query, n=remaining_slots, cutoff=0.4,
+                                                                   exclude=set(result_set))
+        result_set.extend(t for t in fuzzy_matches if t not in result_set)
+    
+    return result_set, exhausted
+
+# Resolve a user-supplied title to a row, returning (row, None) or (None, error)
+def resolve_title(book_name, m=None):
+    return lookup_title(book_name, m)[:2]
+
+# The same as (row, error, exhausted), where exhausted means the fuzzy step
+# ran out of its time budget and may have missed a closer title
+def lookup_title(book_name, m=None):
+    m = m or holder.current()
+    # Check if model is loaded
+    if m is None or len(m.store) == 0:
+        return None, "Error: Book database not loaded properly", False
+    
+    # Step 1: Exact or normalized title (duplicate editions resolve to the most rated one)
+    with STAGE_SECONDS.time(stage='resolve_exact'):
+        book_index = m.title_index.lookup(book_name)
+    if book_index is not None:
+        TITLE_RESOLUTIONS.inc(method='exact')
+        return book_index, None, False
+
+    # Step 2: Try substring match (case-insensitive, first in catalogue order)
+    with STAGE_SECONDS.time(stage='resolve_substring'):
+        matches = m.title_index.substring_rows(book_name.lower(), limit=1)
+    if matches:
+        TITLE_RESOLUTIONS.inc(method='substring')
+        # Same edition rule as exact lookups
+        return m.title_index.lookup(m.store.titles[matches[0]]), None, False
+
+    # Step 3: Fallback to fuzzy match if no substring match found
+    with STAGE_SECONDS.time(stage='resolve_fuzzy'):
+        closest_match, exhausted = m.title_index.fuzzy_matches(book_name, n=1, cutoff=0.5)
+    if not closest_match:
+        TITLE_RESOLUTIONS.inc(method='not_found')
+        return None, "No similar book title found in our database", exhausted
+    TITLE_RESOLUTIONS.inc(method='fuzzy')
+    return m.title_index.lookup(closest_match[0]), None, exhausted
+
+# Book recommendation function; `filters` is an optional FacetFilter
+def book_recommender(book_name, k=DEFAULT_K, m=None, filters=None):
+    m = m or holder.current()
+    book_index, error = resolve_title(book_name, m)
+    if book_index is None:
+        return [], error
+
+    # The k best of the closest other books, titles gathered in one take
+    rows = recommend_rows(m, book_index, k, filters)
+    if not len(rows):
+        return [], "No books match these filters"
+    with STAGE_SECONDS.time(stage='gather_titles'):
+        book_list_name = m.store.titles_for(rows)
+    return book_list_name, m.store.titles[book_index]
+
+# Rows of the k recommendations for a row: over-fetched neighbors (only
+# books matching `filters`, if given), re-ranked
+def recommend_rows(m, book_index, k, filters=None):
+    if filters:
+        with STAGE_SECONDS.time(stage='filtered_neighbors'):
+            rows = m.facets.neighbors(m.neighbor_index, book_index, filters, m.reranker.fetch_size(k))
+    else:
+        with STAGE_SECONDS.time(stage='neighbors'):
+            rows = m.neighbor_index.neighbors(book_index, m.reranker.fetch_size(k))
+    with STAGE_SECONDS.time(stage='rerank'):
+        return m.reranker.rerank(book_index, rows, k)
+
+# The same for many rows, with one batched neighbor query when unfiltered
+def recommend_rows_batch(m, book_indexes, k, filters=None):
+    if filters:
+        return [recommend_rows(m, row, k, filters) for row in book_indexes]
+    with STAGE_SECONDS.time(stage='neighbors'):
+        neighbor_lists = m.neighbor_index.neighbors_batch(book_indexes, m.reranker.fetch_size(k))
+    with STAGE_SECONDS.time(stage='rerank'):
+        return [m.reranker.rerank(row, rows, k) for row, rows in zip(book_indexes, neighbor_lists)]
+
+# /api/recommend payload for a resolved row
+def recommendation_payload(m, title, book_index, k, rows=None, filters=None):
+    if rows is None:
+        rows = recommend_rows(m, book_index, k, filters)
+    payload = {'query': title,
+               'matched_title': m.store.titles[book_index],
+               'k': k,
+               'recommendations': m.store.titles_for(rows)}
+    if filters:
+        payload['filters'] = filters.to_dict()
+    return payload
+
+# Serialize the default /api/recommend responses for the most rated titles
+# into the snapshot's response cache, with one batched neighbor query
+def warm_responses(m, n=RESPONSE_CACHE_TITLES, k=DEFAULT_K):
+    if n <= 0 or len(m.store) == 0:
+        return
+    rows = [m.title_index.lookup(m.store.titles[row]) for row in hot_rows(m.store, n)]
+    for book_index, neighbor_rows in zip(rows, recommend_rows_batch(m, rows, k)):
+        title = m.store.titles[book_index]
+        payload = recommendation_payload(m, title, book_index, k, rows=neighbor_rows)
+        m.responses.put(('recommend', title, k), app.json.dumps(payload))
+
+# Cache headers shared by full and 304 responses
+def cache_headers(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    return response
+
+# 304 if the client already holds this response, else None
+def not_modified(etag):
+    if request.if_none_match.contains_weak(etag):
+        return cache_headers(app.response_class(status=304), etag)
+    return None
+
+# JSON response from a serialized body, with cache headers
+def cached_json(body, etag):
+    return cache_headers(app.response_class(body, mimetype='application/json'), etag)
+
+# JSON response that must not be cached (a fuzzy lookup cut short by its budget)
+def uncached_json(payload):
+    response = app.response_class(app.json.dumps(payload), mimetype='application/json')
+    response.cache_control.no_store = True
+    return response
+
+# Autocomplete API endpoint
+@app.route('/autocomplete')
+def autocomplete():
+    m = holder.current()
+    query = request.args.get('q', '')
+    if len(query) < 2 or m is None:
+        return jsonify([])
+    etag = etag_for(m.tag, 'autocomplete', query)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+    
+    # Popular prefix completions first, fuzzy matching only when nothing starts with the query
+    with STAGE_SECONDS.time(stage='complete_prefix'):
+        matching_titles = m.completion_index.complete(query)
+    if matching_titles:
+        AUTOCOMPLETE.inc(source='prefix')
+    else:
+        matching_titles, exhausted = match_titles(query, m=m)
+        AUTOCOMPLETE.inc(source='fuzzy' if matching_titles else 'empty')
+        if exhausted:
+            return uncached_json(matching_titles)
+    return cached_json(app.json.dumps(matching_titles), etag)
+
+# JSON recommendations for any k (?title=...&k=...)
+@app.route('/api/recommend')
+def api_recommend():
+    m = holder.current()
+    title = request.args.get('title', '').strip()
+    if not title:
+        return jsonify({'error': "Missing 'title' parameter"}), 400
+    k, error = parse_k(request.args.get('k', DEFAULT_K))
+    if error:
+        return jsonify({'error': error}), 400
+    if m is None:
+        return jsonify({'error': "Error: Book database not loaded properly"}), 503
+    filters, error = parse_filter_args(request.args, m)
+    if error:
+        return jsonify({'error': error}), 400
+    # Filtered responses are never in the hot-title cache
+    if filters:
+        etag = etag_for(m.tag, 'recommend', title, k, *filters.key())
+    else:
+        etag = etag_for(m.tag, 'recommend', title, k)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+    body = None if filters else m.responses.get(('recommend', title, k))
+    if body is not None:
+        return cached_json(body, etag)
+    
+    book_index, error, exhausted = lookup_title(title, m)
+    if book_index is None:
+        status = 503 if len(m.store) == 0 else 404
+        return jsonify({'error': error}), status
+    payload = recommendation_payload(m, title, book_index, k, filters=filters)
+    if exhausted:
+        return uncached_json(payload)
+    return cached_json(app.json.dumps(payload), etag)
+
+# Parse the 'k' argument, returning (k, None) or (None, error)
+def parse_k(value):
+    try:
+        k = int(value)
+    except (TypeError, ValueError):
+        return None, "'k' must be an integer"
+    if not 1 <= k <= MAX_K:
+        return None, f"'k' must be between 1 and {MAX_K}"
+    return k, None
+
+# Parse the optional filter arguments (see facets.parse_filters), returning
+# (FacetFilter or None, None) or (None, error)
+def parse_filter_args(params, m):
+    try:
+        filters = parse_filters(params)
+    except ValueError as e:
+        return None, str(e)
+    if not filters:
+        return None, None
+    if not m.facets.available:
+        return None, "Filters are not available for this model"
+    return filters, None
+
+# Batch recommendations: {"k": 5, "items": ["Some title", {"title": "..."}, {"id": 42}]},
+# optionally with "filters": {"language": ["eng"], "min_rating": 4, ...} applied to every item.
+# Items are resolved in one pass and answered with a single neighbor lookup;
+# items that can't be resolved get an inline error instead of failing the batch.
+@app.route('/api/recommend/batch', methods=['POST'])
+def api_recommend_batch():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('items'), list):
+        return jsonify({'error': "Expected a JSON object with an 'items' list"}), 400
+    items = payload['items']
+    if len(items) > MAX_BATCH:
+        return jsonify({'error': f"At most {MAX_BATCH} items per batch"}), 400
+    k, error = parse_k(payload.get('k', DEFAULT_K))
+    if error:
+        return jsonify({'error': error}), 400
+    m = holder.current()
+    if m is None:
+        return jsonify({'error': "Book database not loaded"}), 503
+    filter_params = payload.get('filters') or {}
+    if not isinstance(filter_params, dict):
+        return jsonify({'error': "'filters' must be a JSON object"}), 400
+    filters, error = parse_filter_args(filter_params, m)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # Book ids are looked up together, titles one dict/index lookup each
+    rows = [None] * len(items)
+    errors = [None] * len(items)
+    id_positions, ids = [], []
+    for i, item in enumerate(items):
+        if isinstance(item, dict):
+            item = item.get('id', item.get('title'))
+        if isinstance(item, int) and not isinstance(item, bool):
+            id_positions.append(i)
+            ids.append(item)
+        elif isinstance(item, str) and item.strip():
+            rows[i], errors[i] = resolve_title(item.strip(), m)
+        else:
+            errors[i] = "Item must be a title string or a book id"
+    if ids:
+        for i, book_id, row in zip(id_positions, ids, m.store.rows_for_ids(ids)):
+            if row < 0:
+                errors[i] = f"Unknown book id {book_id}"
+            else:
+                rows[i] = int(row)
+    
+    resolved = [row for row in rows if row is not None]
+    neighbor_lists = iter(recommend_rows_batch(m, resolved, k, filters))
+    results = []
+    for item, row, error in zip(items, rows, errors):
+        if row is None:
+            results.append({'query': item, 'error': error})
+            continue
+        neighbor_rows = next(neighbor_lists)
+        results.append({'query': item,
+                        'matched_title': m.store.titles[row],
+                        'book_id': int(m.store.book_ids[row]),
+                        'recommendations': m.store.titles_for(neighbor_rows)})
+    response = {'k': k, 'results': results}
+    if filters:
+        response['filters'] = filters.to_dict()
+    return jsonify(response)
+
+# Neighbor cache counters
+@app.route('/api/stats')
+def api_stats():
+    m = holder.current()
+    if m is None:
+        return jsonify({'error': "Book database not loaded"}), 503
+    return jsonify({'books': len(m.store), 'version': m.version,
+                    'neighbor_cache': m.neighbor_index.cache.stats(),
+                    'response_cache': m.responses.stats()})
+
+# Reject admin requests unless ADMIN_TOKEN is set and sent as X-Admin-Token
+def admin_denied():
+    if not ADMIN_TOKEN:
+        return jsonify({'error': "Admin endpoints are disabled (set ADMIN_TOKEN)"}), 403
+    if request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': "Invalid admin token"}), 403
+    return None
+
+# Append or update books without a full rebuild: {"books": [{"bookID": ..., "title": ..., ...}]}.
+# Writers are serialized with reloads; readers keep serving the previous
+# snapshot until the holder swaps in the new one.
+@app.route('/admin/books', methods=['POST'])
+def admin_books():
+    denied = admin_denied()
+    if denied:
+        return denied
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('books'), list) or not payload['books']:
+        return jsonify({'error': "Expected a JSON object with a non-empty 'books' list"}), 400
+    
+    with holder.lock:
+        m = holder.current()
+        try:
+            store, neighbor_index, summary = upsert_books(
+                find_csv(), payload['books'],
+                store=m.store if m else None, neighbor_index=m.neighbor_index if m else None)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if neighbor_index is None:
+            neighbor_index = NeighborIndex(store, cache_size=NEIGHBOR_CACHE_SIZE, backend=KNN_BACKEND)
+        snapshot = build_snapshot(store, neighbor_index, version=0, max_edits=FUZZY_MAX_EDITS,
+                                  fuzzy_budget=FUZZY_BUDGET, rerank=RERANK)
+        warm_responses(snapshot)
+        summary['version'] = holder.swap(snapshot).version
+    holder.published()
+    return jsonify(summary)
+
+# Rebuild the model from the CSV/artifact on a background thread and swap it in
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    denied = admin_denied()
+    if denied:
+        return denied
+    started = holder.reload_async()
+    return jsonify({'started': started, 'model': holder.status()}), 202 if started else 409
+
+# Snapshot version and reload timings, for alerting on slow or failed rebuilds
+@app.route('/api/model')
+def api_model():
+    return jsonify(holder.status())
+
+# Readiness probe: healthy only once a model snapshot is loaded
+@app.route('/healthz/ready')
+def ready():
+    m = holder.current()
+    if m is None:
+        return jsonify({'ready': False, 'error': holder.last_error}), 503
+    return jsonify({'ready': True, 'version': m.version, 'books': len(m.store)})
+
+# Liveness probe: the process is up and serving requests
+@app.route('/healthz/live')
+def live():
+    return jsonify({'live': True})
+
+# Fingerprinted CSS/JS: cached forever, gzip/brotli picked from Accept-Encoding
+@app.route('/static/<path:filename>')
+def static_file(filename):
+    asset = ASSETS.get(filename)
+    if asset is None:
+        abort(404)
+    if request.if_none_match.contains_weak(asset.etag):
+        response = app.response_class(status=304)
+    else:
+        coding, body = negotiate(asset, request.headers.get('Accept-Encoding'))
+        response = app.response_class(body, mimetype=asset.content_type)
+        if coding != 'identity':
+            response.headers['Content-Encoding'] = coding
+    response.set_etag(asset.etag)
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.route('/', methods=['GET', 'POST'])
+def index():
+    matched_title = None
+    recommendations = None
+    error = None
+    
+    if request.method == 'POST':
+        book_name = request.form.get('book_name', '')
+        m = holder.current()
+        filters, error = parse_filter_args(request.form, m) if m else (None, None)
+        if book_name and not error:
+            recommendations, result = book_recommender(book_name, m=m, filters=filters)
+            if not recommendations:
+                error = result  # This will be the error message
+            else:
+                matched_title = result  # This will be the matched title
+    
+    with STAGE_SECONDS.time(stage='render'):
+        return render_template('recommendations.html' if recommendations else 'index.html', 
+                               recommendations=recommendations, 
+                               book_name=request.form.get('book_name', '') if request.method == 'POST' else '',
+                               filters=request.form if request.method == 'POST' else {},
+                               matched_title=matched_title,
+                               error=error)
+
+# Prometheus metrics of this process
+@app.route('/metrics')
+def metrics():
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+# Cache and model counters kept by the current snapshot, read at scrape time
+@REGISTRY.collector
+def snapshot_metrics():
+    m = holder.current()
+    if m is None:
+        return []
+    neighbor = m.neighbor_index.cache.stats()
+    responses = m.responses.stats()
+    status = holder.status()
+    return [
+        ('bookrec_neighbor_cache_total', 'counter', "Neighbor cache lookups by result (current snapshot)",
+         [({'result': 'hit'}, neighbor['hits']), ({'result': 'miss'}, neighbor['misses'])]),
+        ('bookrec_neighbor_cache_evictions_total', 'counter', "Neighbor cache evictions (current snapshot)",
+         [({}, neighbor['evictions'])]),
+        ('bookrec_response_cache_total', 'counter', "Hot-title response cache lookups by result (current snapshot)",
+         [({'result': 'hit'}, responses['hits']), ({'result': 'miss'}, responses['misses'])]),
+        ('bookrec_rerank_budget_exhausted_total', 'counter',
+         "Re-rankings cut short by RERANK_BUDGET_MS (current snapshot)",
+         [({}, m.reranker.budget_exhausted)]),
+        ('bookrec_fuzzy_budget_exhausted_total', 'counter',
+         "Fuzzy title lookups cut short by FUZZY_BUDGET_MS (current snapshot)",
+         [({}, m.title_index.budget_exhausted)]),
+        ('bookrec_model_version', 'gauge', "Version of the serving model snapshot", [({}, m.version)]),
+        ('bookrec_model_books', 'gauge', "Books in the serving model", [({}, len(m.store))]),
+        ('bookrec_model_reloads_total', 'counter', "Model reloads by outcome",
+         [({'outcome': 'ok'}, status['reloads'] - status['failures']),
+          ({'outcome': 'failed'}, status['failures'])]),
+    ]
+
+# Whether this request asked for a profile and may have one
+def profile_requested():
+    if not PROFILE_REQUESTS or 'X-Profile' not in request.headers:
+        return False
+    return not ADMIN_TOKEN or request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+@app.before_request
+def start_request():
+    g.request_start = time.perf_counter()
+    g.profiler = None
+    if profile_requested():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def finish_request(response):
+    seconds = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    if g.profiler is not None:
+        g.profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(g.profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        print(f"Profile of {request.method} {request.full_path} ({seconds * 1000:.2f} ms):\n{out.getvalue()}")
+        response.headers['X-Profile-Ms'] = f"{seconds * 1000:.2f}"
+    return response
+
+# Try to pre-load the model when the app starts
+holder = ModelHolder(load_model)
+print("Loading book recommendation model...")
+holder.reload()
+
+# SIGHUP triggers the same background reload as /admin/reload
+try:
+    signal.signal(signal.SIGHUP, lambda signum, frame: holder.reload_async())
+except (AttributeError, ValueError):
+    # No SIGHUP on Windows, and handlers can only be set from the main thread
+    pass
+
+if __name__ == '__main__':
+    # Check if we loaded the model
+    if holder.current() is None or len(holder.current().store) == 0:
+        print("WARNING: Book database not loaded! App will show errors when making recommendations.")
+    
+    # Run the Flask app
+    print("Starting Flask app... Access it at http://127.0.0.1:5000")
     app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,410 @@
+# Asyncio JSON API for the lookups typing users hit hardest: /autocomplete
+# and /api/recommend, plus the health probes.
+#
+#   python async_api.py                       # :8001, next to the Flask app
+#   python async_api.py --bind 0.0.0.0:8001 --fuzzy-workers 2 --fuzzy-queue 8
+#   uvicorn async_api:app --port 8001         # `app` is a plain ASGI callable
+#
+# Prefix completions and exact title lookups take microseconds and are
+# answered directly on the event loop. Fuzzy matching (milliseconds of
+# difflib scoring) runs in a few low-priority worker processes that admit
+# a bounded number of jobs; past that, autocomplete answers with no
+# suggestions and /api/recommend with 503 instead of queueing, so a burst
+# of typos can't hold up the prefix hits behind it. Recommendations whose
+# neighbors are in the table or the neighbor cache are re-ranked on the loop;
+# filtered searches and cold neighbor queries (tree or brute-force scans,
+# milliseconds to tens of milliseconds) run on a small thread pool. Identical
+# requests that arrive while one is being computed share its result instead
+# of computing it again.
+#
+# The model, title resolution and fuzzy matching are the ones in app.py;
+# importing this module loads the model the same way.
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import urllib.parse
+
+import app as web
+from http_cache import etag_for, etag_matches
+
+FUZZY_WORKERS = int(os.environ.get('FUZZY_WORKERS', '2'))
+FUZZY_QUEUE = int(os.environ.get('FUZZY_QUEUE', '8'))
+# Scheduling priority drop for the fuzzy worker processes
+FUZZY_NICE = 10
+# Threads for filtered and cold recommendation work. The scans run in numpy
+# and the kNN backends, which release the GIL, so threads share the loaded
+# snapshot and its neighbor cache without keeping the loop waiting.
+RECOMMEND_WORKERS = int(os.environ.get('RECOMMEND_WORKERS', '2'))
+
+
+class Overloaded(Exception):
+    pass
+
+
+# Runs concurrent calls with the same key once: the first caller starts the
+# computation and everyone arriving before it finishes awaits the same
+# future. Nothing is kept afterwards, so results never go stale.
+class Coalescer:
+    def __init__(self):
+        self.pending = {}
+        self.started = 0
+        self.joined = 0
+
+    async def run(self, key, compute):
+        future = self.pending.get(key)
+        if future is None:
+            self.started += 1
+            future = asyncio.ensure_future(compute())
+            self.pending[key] = future
+            future.add_done_callback(lambda done: self.pending.pop(key, None))
+        else:
+            self.joined += 1
+        # A disconnecting client cancels only its own wait, not the shared work
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {'started': self.started, 'joined': self.joined, 'in_flight': len(self.pending)}
+
+
+# Runs in the fuzzy worker processes. They are forked from this process
+# after the model is loaded, so they share its snapshot copy-on-write and
+# only the query and the matched titles cross the process boundary.
+def fuzzy_worker_init():
+    os.nice(FUZZY_NICE)
+    # Workers inherit the listening socket; exit with the parent even if it
+    # is killed without shutting the pool down, so the port is released
+    parent = os.getppid()
+
+    def watch_parent():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch_parent, daemon=True).start()
+
+
+def fuzzy_call(name, version, *args):
+    m = web.holder.current()
+    if m is None or m.version != version:
+        raise Overloaded()
+    return getattr(web, name)(*args, m=m)
+
+
+# Pool of niced worker processes that admits at most workers + queue jobs;
+# further submissions raise Overloaded right away instead of waiting behind
+# the backlog. Fuzzy matching is pure Python, so worker threads would hold
+# the GIL against the event loop; niced processes also leave the CPU to
+# the loop when both want it. The pool is re-forked when the model
+# snapshot changes. Without os.fork (Windows) a thread pool is used.
+class BoundedExecutor:
+    def __init__(self, workers=FUZZY_WORKERS, queue=FUZZY_QUEUE):
+        self.workers = workers
+        self.limit = workers + queue
+        self.pool = None
+        self.version = None
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def pool_for(self, version):
+        if self.pool is not None and (version == self.version or not hasattr(os, 'fork')):
+            return self.pool
+        if self.pool is not None:
+            # Jobs already running finish on the old snapshot
+            self.pool.shutdown(wait=False)
+            self.restarts += 1
+        if hasattr(os, 'fork'):
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('fork'),
+                initializer=fuzzy_worker_init)
+        else:
+            self.pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='fuzzy')
+        self.version = version
+        return self.pool
+
+    # Call app.<name>(*args, m=snapshot) on the pool
+    async def run(self, name, m, *args):
+        if self.active >= self.limit:
+            self.rejected += 1
+            raise Overloaded()
+        self.active += 1
+        try:
+            pool = self.pool_for(m.version)
+            if isinstance(pool, concurrent.futures.ThreadPoolExecutor):
+                call = functools.partial(getattr(web, name), *args, m=m)
+            else:
+                call = functools.partial(fuzzy_call, name, m.version, *args)
+            return await asyncio.get_running_loop().run_in_executor(pool, call)
+        except concurrent.futures.process.BrokenProcessPool:
+            self.pool = None
+            raise Overloaded()
+        finally:
+            self.active -= 1
+            self.completed += 1
+
+    def stats(self):
+        return {'active': self.active, 'limit': self.limit, 'completed': self.completed,
+                'rejected': self.rejected, 'restarts': self.restarts}
+
+
+coalescer = Coalescer()
+fuzzy = BoundedExecutor()
+recommend_pool = concurrent.futures.ThreadPoolExecutor(RECOMMEND_WORKERS, thread_name_prefix='recommend')
+offloaded = 0
+
+
+# Autocomplete suggestions: prefix completions inline, fuzzy matches on the
+# pool. Handlers return (status, payload) or (status, payload, etag); shed
+# responses and fuzzy lookups cut short by their budget carry no ETag and
+# are sent with Cache-Control: no-store.
+async def autocomplete(params, headers):
+    m = web.holder.current()
+    query = params.get('q', '')
+    if len(query) < 2 or m is None:
+        return 200, []
+    etag = etag_for(m.tag, 'autocomplete', query)
+    if etag_matches(headers.get('if-none-match'), etag):
+        return 304, None, etag
+    matching_titles = m.completion_index.complete(query)
+    if matching_titles:
+        return 200, matching_titles, etag
+    key = ('fuzzy', m.version, query.lower().strip())
+    try:
+        titles, exhausted = await coalescer.run(key, lambda: fuzzy.run('match_titles', m, query, 10))
+        return (200, titles) if exhausted else (200, titles, etag)
+    except Overloaded:
+        return 200, []
+
+
+# Same resolution as app.lookup_title, with only the fuzzy step off the loop
+async def lookup_title(title, m):
+    book_index = m.title_index.lookup(title)
+    if book_index is not None:
+        return book_index, None, False
+    return await fuzzy.run('lookup_title', m, title)
+
+
+# (status, payload, exhausted), see app.lookup_title. Only re-ranking of
+# neighbors already at hand runs on the loop.
+async def recommendations(m, title, k, filters=None):
+    global offloaded
+    book_index, error, exhausted = await lookup_title(title, m)
+    if book_index is None:
+        return 404, {'error': error}, exhausted
+    call = functools.partial(web.recommendation_payload, m, title, book_index, k, filters=filters)
+    if not filters and m.neighbor_index.cached(book_index, m.reranker.fetch_size(k)):
+        return 200, call(), exhausted
+    offloaded += 1
+    return 200, await asyncio.get_running_loop().run_in_executor(recommend_pool, call), exhausted
+
+
+# JSON recommendations, answering exactly like the Flask /api/recommend
+async def recommend(params, headers):
+    m = web.holder.current()
+    title = params.get('title', '').strip()
+    if not title:
+        return 400, {'error': "Missing 'title' parameter"}
+    k, error = web.parse_k(params.get('k', web.DEFAULT_K))
+    if error:
+        return 400, {'error': error}
+    if m is None or len(m.store) == 0:
+        return 503, {'error': "Error: Book database not loaded properly"}
+    filters, error = web.parse_filter_args(params, m)
+    if error:
+        return 400, {'error': error}
+    key = (title, k, *filters.key()) if filters else (title, k)
+    etag = etag_for(m.tag, 'recommend', *key)
+    if etag_matches(headers.get('if-none-match'), etag):
+        return 304, None, etag
+    body = None if filters else m.responses.get(('recommend', title, k))
+    if body is not None:
+        return 200, body, etag
+    try:
+        status, payload, exhausted = await coalescer.run(('recommend', m.version, *key),
+                                                         lambda: recommendations(m, title, k, filters))
+        return (status, payload, etag) if status == 200 and not exhausted else (status, payload)
+    except Overloaded:
+        return 503, {'error': "Too many fuzzy title lookups in progress, retry shortly"}
+
+
+async def ready(params, headers):
+    m = web.holder.current()
+    if m is None:
+        return 503, {'ready': False, 'error': web.holder.last_error}
+    return 200, {'ready': True, 'version': m.version, 'books': len(m.store)}
+
+
+async def live(params, headers):
+    return 200, {'live': True}
+
+
+async def stats(params, headers):
+    return 200, {'coalescer': coalescer.stats(), 'fuzzy_executor': fuzzy.stats(),
+                 'recommend_executor': {'workers': RECOMMEND_WORKERS, 'offloaded': offloaded}}
+
+
+ROUTES = {
+    '/autocomplete': autocomplete,
+    '/api/recommend': recommend,
+    '/api/async/stats': stats,
+    '/healthz/ready': ready,
+    '/healthz/live': live,
+}
+
+
+# ASGI entry point (HTTP only; GET and HEAD)
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_fuzzy_pool()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get(scope['path'])
+    etag = None
+    if handler is None:
+        status, payload = 404, {'error': "Not found"}
+    elif scope['method'] not in ('GET', 'HEAD'):
+        status, payload = 405, {'error': "Method not allowed"}
+    else:
+        query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                   for name, value in scope.get('headers', [])}
+        status, payload, *rest = await handler({name: values[-1] for name, values in query.items()},
+                                               headers)
+        etag = rest[0] if rest else None
+
+    # Cached bodies are already serialized; Flask's serializer keeps them
+    # byte-identical to the app.py responses
+    if status == 304:
+        body = b''
+    else:
+        body = (payload if isinstance(payload, str) else web.app.json.dumps(payload)).encode('utf-8')
+    response_headers = [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode())]
+    if etag is not None:
+        response_headers += [(b'etag', f'"{etag}"'.encode('latin-1')),
+                             (b'cache-control', f"public, max-age={web.CACHE_MAX_AGE}".encode())]
+    elif status == 200:
+        response_headers.append((b'cache-control', b'no-store'))
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body',
+                'body': body if scope['method'] != 'HEAD' else b''})
+
+
+REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           503: 'Service Unavailable'}
+
+
+# Minimal HTTP/1.1 front end for `app` so the API runs without an ASGI
+# server installed: keep-alive connections, one request at a time each
+async def handle_connection(reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode('latin-1').split()
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            header_map = dict(headers)
+            length = int(header_map.get(b'content-length', b'0'))
+            body = await reader.readexactly(length) if length else b''
+
+            path, _, query = target.partition('?')
+            scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': version[5:],
+                     'method': method, 'path': urllib.parse.unquote(path),
+                     'query_string': query.encode('latin-1'), 'headers': headers}
+            response = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(message):
+                response.append(message)
+
+            await app(scope, receive, send)
+            start, content = response[0], b''.join(m.get('body', b'') for m in response[1:])
+            keep_alive = version == 'HTTP/1.1' and header_map.get(b'connection', b'').lower() != b'close'
+            head = [f"HTTP/1.1 {start['status']} {REASONS.get(start['status'], '')}"]
+            head += [f"{name.decode()}: {value.decode()}" for name, value in start['headers']]
+            if not keep_alive:
+                head.append("connection: close")
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + content)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+# Fork the fuzzy workers before serving rather than on the first typo
+def start_fuzzy_pool():
+    m = web.holder.current()
+    if m is not None:
+        fuzzy.pool_for(m.version)
+
+
+async def serve(host, port):
+    start_fuzzy_pool()
+    server = await asyncio.start_server(handle_connection, host, port, backlog=1024)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, server.close)
+        except (NotImplementedError, RuntimeError):
+            pass
+    print(f"Async API on http://{host}:{port} "
+          f"({fuzzy.limit} fuzzy jobs admitted, {fuzzy.workers} worker processes)")
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        if fuzzy.pool is not None:
+            fuzzy.pool.shutdown(wait=False, cancel_futures=True)
+        recommend_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    global fuzzy
+    parser = argparse.ArgumentParser(description="Asyncio autocomplete/recommend API")
+    parser.add_argument('--bind', default=os.environ.get('ASYNC_BIND', '0.0.0.0:8001'))
+    parser.add_argument('--fuzzy-workers', type=int, default=FUZZY_WORKERS)
+    parser.add_argument('--fuzzy-queue', type=int, default=FUZZY_QUEUE,
+                        help="fuzzy jobs admitted beyond the busy workers before shedding")
+    args = parser.parse_args()
+
+    if web.holder.current() is None:
+        print("WARNING: Book database not loaded! /healthz/ready will report 503.")
+    fuzzy = BoundedExecutor(args.fuzzy_workers, args.fuzzy_queue)
+    host, _, port = args.bind.rpartition(':')
+    try:
+        asyncio.run(serve(host or '0.0.0.0', int(port)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
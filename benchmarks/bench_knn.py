@@ -0,0 +1,133 @@
+# Benchmark the kNN backends in knn_backends.py on the books1.csv feature
+# matrix and on synthetically upscaled catalogues.
+#
+#   python benchmarks/bench_knn.py
+#   python benchmarks/bench_knn.py --sizes base,100000 --backends brute,ivf --queries 500
+#   python benchmarks/bench_knn.py --verify        # every backend returns k valid rows
+#
+# For every (catalogue size, backend) pair it reports build time, single-query
+# latency percentiles, memory allocated while building (tracemalloc peak) and
+# recall@k against exact float64 brute-force results. Recall is tie-aware:
+# a returned book counts as a hit when it is at least as close as the exact
+# k-th neighbor, since the one-hot features produce many equal distances.
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from knn_backends import BACKENDS, make_backend  # noqa: E402
+from features import encode_columns  # noqa: E402
+from model_store import load_books  # noqa: E402
+
+
+# Grow a feature matrix to `rows` by resampling real rows and jittering the
+# two scaled numeric columns (average_rating, ratings_count)
+def upscale_features(features, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    picked = features[rng.integers(0, len(features), rows)].copy()
+    picked[:, -2:] += rng.normal(0, 0.01, size=(rows, 2))
+    np.clip(picked[:, -2:], 0, 1, out=picked[:, -2:])
+    return picked
+
+
+# Exact float64 distances from every query to the given candidate rows
+def exact_distances(features, queries, candidates):
+    diff = features[candidates] - queries[:, None, :]
+    return np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+
+
+# k-th exact neighbor distance for each query, computed in blocks
+def exact_kth_distance(features, queries, k, block=131072):
+    kth = np.empty(len(queries))
+    norms = np.einsum('ij,ij->i', features, features)
+    for i, q in enumerate(queries):
+        best = np.full(k, np.inf)
+        for start in range(0, len(features), block):
+            chunk = slice(start, start + block)
+            dist = norms[chunk] - 2 * features[chunk] @ q + q @ q
+            best = np.partition(np.concatenate([best, dist]), k - 1)[:k]
+        kth[i] = np.sqrt(max(np.max(best), 0))
+    return kth
+
+
+def run(features, backend_name, query_rows, k, kth):
+    # Warm up imports and lazy initialisation so they don't count as memory
+    make_backend(backend_name).fit(features[:64]).kneighbors(features[:1], 1)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    backend = make_backend(backend_name).fit(features)
+    build = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    found = []
+    for row in query_rows:
+        start = time.perf_counter()
+        idx = backend.kneighbors(features[row:row + 1], k)[1][0]
+        latencies.append(time.perf_counter() - start)
+        found.append(idx)
+
+    found = np.array(found)
+    dist = exact_distances(features, features[query_rows], np.where(found < 0, 0, found))
+    hits = (dist <= kth[:, None] + 1e-9) & (found >= 0)
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {'build_s': build, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'memory_mb': peak / 2**20, 'recall': hits.mean()}
+
+
+# Check that every backend returns k distinct, valid row ids per query, also
+# for an ivf index probing one list with k far beyond a list's size
+def verify(features, queries=100, k=400):
+    rng = np.random.default_rng(1)
+    query_rows = rng.choice(len(features), min(queries, len(features)), replace=False)
+    backends = [(name, make_backend(name)) for name in BACKENDS]
+    backends.append(('ivf n_probe=1', make_backend('ivf', n_probe=1)))
+    ok = True
+    for name, backend in backends:
+        idx = backend.fit(features).kneighbors(features[query_rows], k)[1]
+        valid = (idx.shape == (len(query_rows), min(k, len(features))) and idx.min() >= 0
+                 and idx.max() < len(features)
+                 and all(len(np.unique(row)) == len(row) for row in idx))
+        print(f"{name}: {'ok' if valid else 'INVALID'}")
+        ok = ok and valid
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the kNN backends")
+    parser.add_argument('--csv', default='books1.csv')
+    parser.add_argument('--sizes', default='base,100000,1000000',
+                        help="comma-separated row counts; 'base' is the CSV as-is")
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--verify', action='store_true',
+                        help="only check that the backends return valid row ids on --csv")
+    args = parser.parse_args()
+
+    base = np.ascontiguousarray(encode_columns(load_books(args.csv))[0], dtype=np.float64)
+    if args.verify:
+        sys.exit(0 if verify(base) else 1)
+    print(f"{'rows':>9} {'backend':>10} {'build s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'mem MB':>8} {'recall@' + str(args.k):>9}")
+    for size in args.sizes.split(','):
+        features = base if size == 'base' else upscale_features(base, int(size))
+        rng = np.random.default_rng(1)
+        query_rows = rng.choice(len(features), min(args.queries, len(features)), replace=False)
+        kth = exact_kth_distance(features, features[query_rows], args.k)
+        for name in args.backends.split(','):
+            r = run(features, name, query_rows, args.k, kth)
+            print(f"{len(features):>9} {name:>10} {r['build_s']:>8.2f} {r['p50_ms']:>8.3f} "
+                  f"{r['p95_ms']:>8.3f} {r['p99_ms']:>8.3f} {r['memory_mb']:>8.1f} "
+                  f"{r['recall']:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# Benchmark loading the catalogue and building the feature matrix: the
+# original inferred read_csv + copy + get_dummies path against the chunked,
+# typed loader (model_store.load_books) and features.py in compat and fast
+# mode, then app startup (load_or_build) cold, with only the table cache,
+# and fully warm.
+#
+#   python benchmarks/bench_load.py                  # 1M-row synthetic catalogue
+#   python benchmarks/bench_load.py --rows 200000 --chunksize 50000
+#   python benchmarks/bench_load.py --csv books1.csv --rows 0 --modes cold,table_cache,warm
+#   python benchmarks/bench_load.py --verify         # compat mode == legacy, bit for bit
+#
+# The synthetic CSV repeats books1.csv rows under fresh bookIDs, with one
+# malformed line per 2500 rows. Each mode runs in its own interpreter so
+# peak RSS (ru_maxrss) is measured for that mode alone.
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import model_store  # noqa: E402
+from features import FEATURE_MODES, encode_columns, feature_config  # noqa: E402
+
+MODES = ('legacy', 'compat', 'fast', 'cold', 'table_cache', 'warm')
+BENCH_ARTIFACTS = 'bench_artifact'
+
+
+# Append " (Vol. n)" to the title field of a CSV line without its bookID
+def vary_title(rest, copy):
+    if rest.startswith('"'):
+        end = rest.find('",', 1)
+        return rest if end < 0 else f"{rest[:end]} (Vol. {copy}){rest[end:]}"
+    title, sep, tail = rest.partition(',')
+    return f"{title} (Vol. {copy}){sep}{tail}"
+
+
+# Write `rows` data lines resampled from the source CSV under fresh bookIDs.
+# With vary_titles, every pass over the source after the first gets its own
+# title suffix, so title search sees distinct titles sharing real prefixes.
+def write_synthetic(source, path, rows, bad_every=2500, vary_titles=False):
+    with open(source, encoding='utf-8') as f:
+        header = f.readline()
+        lines = [line.rstrip('\r\n').split(',', 1)[1] for line in f if line.strip()]
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write(header)
+        for i in range(rows):
+            line = lines[i % len(lines)]
+            if vary_titles and i >= len(lines):
+                line = vary_title(line, i // len(lines))
+            out.write(f"{i + 1},{line}\n")
+            if bad_every and i % bad_every == bad_every - 1:
+                out.write(f"{rows + i},Broken, title,with,too,many,fields,,,,,,,,\n")
+
+
+# The original app.py pipeline: inferred read_csv, a full copy, five .loc
+# passes for the rating buckets, get_dummies and MinMaxScaler
+def legacy_features(csv_path):
+    import pandas as pd
+    from sklearn.preprocessing import MinMaxScaler
+
+    df = pd.read_csv(csv_path, on_bad_lines='skip')
+    df2 = df.copy()
+    df2['average_rating'] = df2['average_rating'].astype(float)
+    df2.loc[(df2['average_rating'] >= 0) & (df2['average_rating'] <= 1), 'rating_between'] = "between 0 and 1"
+    df2.loc[(df2['average_rating'] > 1) & (df2['average_rating'] <= 2), 'rating_between'] = "between 1 and 2"
+    df2.loc[(df2['average_rating'] > 2) & (df2['average_rating'] <= 3), 'rating_between'] = "between 2 and 3"
+    df2.loc[(df2['average_rating'] > 3) & (df2['average_rating'] <= 4), 'rating_between'] = "between 3 and 4"
+    df2.loc[(df2['average_rating'] > 4) & (df2['average_rating'] <= 5), 'rating_between'] = "between 4 and 5"
+    features = pd.concat([pd.get_dummies(df2['rating_between']),
+                          pd.get_dummies(df2['language_code']),
+                          df2['average_rating'],
+                          df2['ratings_count']], axis=1)
+    return MinMaxScaler().fit_transform(features)
+
+
+# Check that compat mode reproduces the legacy features and neighbor lists
+def verify(csv_path, n_neighbors=6):
+    legacy = legacy_features(csv_path)
+    compat = encode_columns(model_store.load_books(csv_path), feature_config('compat'))[0]
+    same_features = legacy.shape == compat.shape and np.array_equal(legacy, compat)
+    same_neighbors = np.array_equal(model_store.compute_neighbors(legacy, n_neighbors),
+                                    model_store.compute_neighbors(compat, n_neighbors))
+    print(f"features identical: {same_features}, {n_neighbors}-neighbor lists identical: {same_neighbors}")
+    return same_features and same_neighbors
+
+
+def run_mode(mode, csv_path, chunksize):
+    start = time.perf_counter()
+    if mode == 'legacy':
+        features = legacy_features(csv_path)
+        rows = len(features)
+    elif mode in FEATURE_MODES:
+        books = model_store.load_books(csv_path, chunksize=chunksize)
+        features = encode_columns(books, feature_config(mode))[0]
+        rows = len(books)
+    else:
+        store = model_store.load_or_build(csv_path, BENCH_ARTIFACTS)
+        features = store.features
+        rows = len(store)
+    seconds = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode},{rows},{features.shape[1]},{seconds:.2f},{peak_mb:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark catalogue loading")
+    parser.add_argument('--csv', default='books1.csv', help="source rows for the synthetic file")
+    parser.add_argument('--rows', type=int, default=1_000_000,
+                        help="synthetic catalogue size; 0 benchmarks --csv itself")
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--verify', action='store_true',
+                        help="only check compat mode against the legacy pipeline on --csv")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.verify:
+        sys.exit(0 if verify(args.csv) else 1)
+
+    if args.run:
+        run_mode(args.run, args.csv, args.chunksize)
+        return
+
+    path = f"synthetic_{args.rows}.csv" if args.rows else args.csv
+    if not os.path.exists(path):
+        print(f"Writing {path}...")
+        write_synthetic(args.csv, path, args.rows)
+    print(f"{'mode':>12} {'rows':>9} {'columns':>8} {'load s':>8} {'peak RSS MB':>12}")
+    for mode in args.modes.split(','):
+        # Startup modes: 'cold' starts from nothing, 'table_cache' keeps only
+        # the parsed-CSV cache (as after an artifact format change), 'warm'
+        # reuses everything the previous mode left behind
+        if mode == 'cold':
+            shutil.rmtree(BENCH_ARTIFACTS, ignore_errors=True)
+        elif mode == 'table_cache':
+            for entry in os.listdir(BENCH_ARTIFACTS):
+                if entry != model_store.TABLE_CACHE:
+                    remove = os.path.join(BENCH_ARTIFACTS, entry)
+                    (shutil.rmtree if os.path.isdir(remove) else os.remove)(remove)
+        out = subprocess.run([sys.executable, __file__, '--run', mode, '--csv', path,
+                              '--chunksize', str(args.chunksize)],
+                             capture_output=True, text=True, check=True).stdout
+        mode, rows, columns, seconds, peak = out.strip().splitlines()[-1].split(',')
+        print(f"{mode:>12} {rows:>9} {columns:>8} {seconds:>8} {peak:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+# Regression benchmarks for the title search and recommendation paths:
+# find_matching_books and book_recommender called directly, /autocomplete
+# and the / page through the Flask test client, and optionally the same
+# routes on a running server.
+#
+#   python benchmarks/bench_suite.py                              # books1.csv
+#   python benchmarks/bench_suite.py --scales 1,10,100            # also 10x and 100x catalogues
+#   python benchmarks/bench_suite.py --url http://127.0.0.1:8000  # plus a live server
+#   python benchmarks/bench_suite.py --compare HEAD~3             # HEAD~3 vs the working tree
+#   python benchmarks/bench_suite.py --output new.json --baseline old.json --threshold 15
+#
+# The workload (bench_data/workload.json) is generated once from books1.csv
+# with a fixed seed and replayed by every run, so runs of different commits
+# see the same queries:
+#   prefix  prefixes of titles, picked by popularity  (autocomplete)
+#   exact   full popular titles                        (recommend)
+#   typo    titles with one dropped, swapped or replaced letter (both)
+#   miss    words of different titles glued together: no substring match,
+#           so every one of them goes through difflib  (both)
+# Scaled catalogues repeat books1.csv under fresh bookIDs with a " (Vol. n)"
+# title suffix per copy (see bench_load.write_synthetic); 1000x is ~11M rows
+# and needs several GB of memory.
+#
+# Each (code, catalogue) pair runs in its own interpreter inside
+# bench_data/scale_<n>/, where app.py finds the catalogue as books1.csv, with
+# PYTHONPATH set to the code directory so that every module (app,
+# model_store, features, ...) comes from the code under test; the child
+# imports nothing else from this tree. --compare checks the other commit
+# out into a temporary git worktree. A regression is a --metric latency (default p95)
+# more than --threshold percent and --min-delta-ms above the baseline;
+# any regression makes the exit status 1.
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+DATA_DIR = 'bench_data'
+WORKLOAD_CLASSES = {'prefix': 400, 'exact': 200, 'typo': 200, 'miss': 100}
+# (target, request classes it is run with)
+TARGETS = (
+    ('find_matching_books', ('prefix', 'typo', 'miss')),
+    ('book_recommender', ('exact', 'typo', 'miss')),
+    ('client_autocomplete', ('prefix', 'typo', 'miss')),
+    ('client_index', ('exact', 'typo', 'miss')),
+)
+SERVER_TARGETS = (
+    ('server_autocomplete', ('prefix', 'typo', 'miss')),
+    ('server_index', ('exact', 'typo', 'miss')),
+)
+WARMUP = 20
+
+
+# One edit somewhere after the first three characters
+def typo(text, rng):
+    if len(text) < 6:
+        return text + 'x'
+    i = rng.randrange(3, len(text) - 1)
+    edit = rng.choice(('drop', 'swap', 'replace'))
+    if edit == 'drop':
+        return text[:i] + text[i + 1:]
+    if edit == 'swap':
+        return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+    return text[:i] + rng.choice('aeiourstn') + text[i + 1:]
+
+
+def make_workload(csv_path, seed=0):
+    from model_store import load_books
+
+    books = load_books(csv_path)
+    rng = random.Random(seed)
+    popularity = np.nan_to_num(np.asarray(books.ratings_count, dtype=np.float64))
+    weights = (np.log1p(popularity) + 1).tolist()
+    titles = [t for t in books.titles if isinstance(t, str) and len(t) >= 4]
+    weights = [w for t, w in zip(books.titles, weights) if isinstance(t, str) and len(t) >= 4]
+    lowered = [t.lower() for t in titles]
+    words = sorted({w for t in lowered for w in re.findall(r'[a-z]{4,}', t)})
+
+    def popular():
+        return rng.choices(titles, weights)[0]
+
+    workload = []
+    for _ in range(WORKLOAD_CLASSES['prefix']):
+        title = popular()
+        workload.append({'class': 'prefix', 'query': title[:rng.randint(2, min(len(title), 20))]})
+    for _ in range(WORKLOAD_CLASSES['exact']):
+        workload.append({'class': 'exact', 'query': popular()})
+    for _ in range(WORKLOAD_CLASSES['typo']):
+        workload.append({'class': 'typo', 'query': typo(popular()[:30], rng)})
+    misses = 0
+    while misses < WORKLOAD_CLASSES['miss']:
+        query = ' '.join(rng.sample(words, 2))
+        if not any(query in t for t in lowered):
+            workload.append({'class': 'miss', 'query': query})
+            misses += 1
+    rng.shuffle(workload)
+    return workload
+
+
+def load_workload(path, csv_path):
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(make_workload(csv_path), f, indent=0)
+    with open(path) as f:
+        return json.load(f)
+
+
+# Working directory holding the catalogue for a scale factor as books1.csv
+def catalogue_dir(source, scale):
+    from bench_load import write_synthetic
+
+    path = os.path.join(DATA_DIR, f"scale_{scale}")
+    csv_path = os.path.join(path, 'books1.csv')
+    if not os.path.exists(csv_path):
+        os.makedirs(path, exist_ok=True)
+        if scale == 1:
+            shutil.copyfile(source, csv_path)
+        else:
+            with open(source, encoding='utf-8') as f:
+                rows = sum(1 for line in f if line.strip()) - 1
+            print(f"Writing {scale}x catalogue ({rows * scale} rows)...")
+            write_synthetic(source, csv_path, rows * scale, bad_every=0, vary_titles=True)
+    return os.path.abspath(path)
+
+
+def summarize(latencies, seconds):
+    ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {'n': len(ms), 'rps': len(ms) / seconds if seconds else 0.0,
+            'p50': p50, 'p95': p95, 'p99': p99, 'max': float(ms.max())}
+
+
+def run_calls(call, queries):
+    for query in queries[:WARMUP]:
+        call(query)
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        t = time.perf_counter()
+        call(query)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def process_memory():
+    fields = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('VmRSS', 'VmHWM'):
+                    fields[name] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    peak = fields.get('VmHWM', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    return {'rss_mb': fields.get('VmRSS', peak), 'peak_rss_mb': peak}
+
+
+# In-process run: import app from code_dir inside the catalogue directory
+def run_in_process(code_dir, workload):
+    sys.path.insert(0, code_dir)
+    start = time.perf_counter()
+    import app
+    load_s = time.perf_counter() - start
+    for name in ('app', 'model_store', 'features', 'neighbor_index'):
+        module = sys.modules.get(name)
+        if module is not None and os.path.dirname(os.path.abspath(module.__file__)) != code_dir:
+            raise RuntimeError(f"{name} was imported from {module.__file__}, not {code_dir}")
+    loaded = process_memory()
+    client = app.app.test_client()
+
+    calls = {
+        'find_matching_books': app.find_matching_books,
+        'book_recommender': app.book_recommender,
+        'client_autocomplete': lambda q: client.get('/autocomplete', query_string={'q': q}),
+        'client_index': lambda q: client.post('/', data={'book_name': q}),
+    }
+    results = {}
+    for target, classes in TARGETS:
+        for cls in classes:
+            queries = [item['query'] for item in workload if item['class'] == cls]
+            results[f"{target}/{cls}"] = run_calls(calls[target], queries)
+    return {'load_s': load_s, 'memory': {'loaded': loaded, 'end': process_memory()},
+            'results': results}
+
+
+# Replay against a live server over keep-alive connections, `concurrency` at a time
+def run_server(url, workload, concurrency):
+    parts = urllib.parse.urlsplit(url)
+
+    def request(conn, target, query):
+        if target == 'server_autocomplete':
+            conn.request('GET', '/autocomplete?' + urllib.parse.urlencode({'q': query}))
+        else:
+            conn.request('POST', '/', body=urllib.parse.urlencode({'book_name': query}),
+                         headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        if response.will_close:
+            conn.close()
+
+    results = {}
+    for target, classes in SERVER_TARGETS:
+        for cls in classes:
+            queries = [item['query'] for item in workload if item['class'] == cls]
+            latencies = []
+            lock = threading.Lock()
+
+            def worker(chunk):
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+                for query in chunk[:WARMUP // concurrency]:
+                    request(conn, target, query)
+                own = []
+                for query in chunk:
+                    t = time.perf_counter()
+                    request(conn, target, query)
+                    own.append(time.perf_counter() - t)
+                conn.close()
+                with lock:
+                    latencies.extend(own)
+
+            threads = [threading.Thread(target=worker, args=(queries[i::concurrency],))
+                       for i in range(concurrency)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[f"{target}/{cls}"] = summarize(latencies, time.perf_counter() - start)
+    return results
+
+
+# Run one (code, catalogue) pair in a fresh interpreter
+def run_isolated(code_dir, workdir, workload_path):
+    code_dir = os.path.abspath(code_dir)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [code_dir] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]))
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', code_dir,
+                          '--workload', os.path.abspath(workload_path)],
+                         cwd=workdir, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"benchmark run failed in {workdir}:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def git_commit(code_dir):
+    out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=code_dir,
+                         capture_output=True, text=True)
+    dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=code_dir,
+                           capture_output=True, text=True).stdout.strip()
+    return out.stdout.strip() + ('+dirty' if dirty else '')
+
+
+def suite(code_dir, args, workload_path):
+    report = {'commit': git_commit(code_dir), 'scales': {}}
+    for scale in args.scales:
+        workdir = catalogue_dir(args.csv, scale)
+        print(f"Running {report['commit']} on {scale}x catalogue...")
+        report['scales'][str(scale)] = run_isolated(code_dir, workdir, workload_path)
+    return report
+
+
+def print_report(report):
+    print(f"\ncommit {report['commit']}")
+    for scale, run in report['scales'].items():
+        mem = run['memory']
+        print(f"{scale}x catalogue: loaded in {run['load_s']:.2f}s, "
+              f"RSS {mem['loaded']['rss_mb']:.0f} MB after load, peak {mem['end']['peak_rss_mb']:.0f} MB")
+        print(f"  {'target/class':<28} {'n':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, r in run['results'].items():
+            print(f"  {name:<28} {r['n']:>5} {r['rps']:>9.0f} {r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f}")
+
+
+# Rows of (scale, target/class, old, new, change %, regressed)
+def compare(old, new, metric, threshold, min_delta_ms):
+    rows = []
+    for scale, run in new['scales'].items():
+        baseline = old['scales'].get(scale)
+        if baseline is None:
+            continue
+        for name, result in run['results'].items():
+            before = baseline['results'].get(name)
+            if before is None:
+                continue
+            a, b = before[metric], result[metric]
+            change = (b - a) / a * 100 if a else 0.0
+            regressed = change > threshold and b - a > min_delta_ms
+            rows.append((scale, name, a, b, change, regressed))
+    return rows
+
+
+def print_comparison(old, new, rows, metric):
+    print(f"\n{metric} latency, {old['commit']} -> {new['commit']}")
+    print(f"  {'scale':>5} {'target/class':<28} {'before':>8} {'after':>8} {'change':>8}")
+    for scale, name, a, b, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"  {scale:>5} {name:<28} {a:>8.3f} {b:>8.3f} {change:>+7.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark title search and recommendation paths")
+    parser.add_argument('--csv', default='books1.csv', help="source catalogue and workload titles")
+    parser.add_argument('--scales', default='1', help="catalogue scale factors, e.g. 1,10,100,1000")
+    parser.add_argument('--workload', default=os.path.join(DATA_DIR, 'workload.json'))
+    parser.add_argument('--url', help="also replay the workload against this running server")
+    parser.add_argument('--concurrency', type=int, default=4, help="client threads for --url")
+    parser.add_argument('--compare', metavar='REF', help="also benchmark this commit and compare")
+    parser.add_argument('--baseline', help="compare against results saved with --output")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--metric', default='p95', choices=('p50', 'p95', 'p99'))
+    parser.add_argument('--threshold', type=float, default=20.0, help="allowed slowdown in percent")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help="ignore slowdowns smaller than this, in milliseconds")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        with open(args.workload) as f:
+            workload = json.load(f)
+        report = run_in_process(args.run, workload)
+        print(json.dumps(report))
+        return
+
+    # Only the parent imports from this tree (workload and catalogue generation)
+    sys.path.insert(0, REPO_DIR)
+    args.scales = [int(s) for s in args.scales.split(',')]
+    workload = load_workload(args.workload, args.csv)
+    report = suite(REPO_DIR, args, args.workload)
+    if args.url:
+        report['server'] = {'url': args.url,
+                            'results': run_server(args.url, workload, args.concurrency)}
+    print_report(report)
+    if args.url:
+        print(f"\nserver {args.url} ({args.concurrency} client threads)")
+        for name, r in report['server']['results'].items():
+            print(f"  {name:<28} {r['n']:>5} {r['rps']:>9.0f} {r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        worktree = tempfile.mkdtemp(prefix='bench-')
+        subprocess.run(['git', 'worktree', 'add', '--detach', worktree, args.compare],
+                       cwd=REPO_DIR, check=True, capture_output=True)
+        try:
+            baseline = suite(worktree, args, args.workload)
+        finally:
+            subprocess.run(['git', 'worktree', 'remove', '--force', worktree], cwd=REPO_DIR)
+        print_report(baseline)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline is None:
+        return
+
+    rows = compare(baseline, report, args.metric, args.threshold, args.min_delta_ms)
+    print_comparison(baseline, report, rows, args.metric)
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        print(f"\n{len(regressions)} regressions over {args.threshold:g}% in {args.metric}")
+        sys.exit(1)
+    print(f"\nNo {args.metric} regressions over {args.threshold:g}%")
+
+
+if __name__ == '__main__':
+    main()
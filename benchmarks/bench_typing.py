@@ -0,0 +1,141 @@
+# Burst typing load against a running server's /autocomplete: simulated
+# users type popular titles one keystroke at a time over keep-alive
+# connections, so many of them send the same prefixes at the same moment.
+# A share of users mistype, which sends their later keystrokes down the
+# fuzzy path. Latency percentiles are reported separately for the two.
+#
+#   python async_api.py &                         # or: python serve.py --bind 127.0.0.1:8001
+#   python benchmarks/bench_typing.py --url http://127.0.0.1:8001 --users 200
+#
+# Works against any server exposing /autocomplete (async_api.py, serve.py,
+# the Flask development server).
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import urllib.parse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from model_store import load_books  # noqa: E402
+
+
+# The most rated titles, which users are most likely to be typing at once
+def popular_titles(csv_path, count):
+    books = load_books(csv_path)
+    order = np.argsort(-np.nan_to_num(books.ratings_count), kind='stable')
+    titles = []
+    for row in order:
+        title = books.titles[row]
+        if title not in titles:
+            titles.append(title)
+        if len(titles) >= count:
+            break
+    return titles
+
+
+# Swap two neighbouring letters somewhere after the first three
+def mistype(text, rng):
+    if len(text) < 6:
+        return text
+    i = rng.randrange(3, len(text) - 2)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+# One GET; returns the status and whether the connection can be reused
+async def fetch(reader, writer, host, path):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+    version, status = (await reader.readline()).split()[:2]
+    keep_alive = version == b'HTTP/1.1'
+    length = None
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection':
+            keep_alive = value != 'close'
+    if length is None:
+        await reader.read()
+        keep_alive = False
+    else:
+        await reader.readexactly(length)
+    return int(status), keep_alive
+
+
+# Type `text` one keystroke at a time, reconnecting if the server closes
+async def user(host, port, text, typo, pause, samples, errors):
+    writer = None
+    try:
+        for end in range(2, min(len(text), 24) + 1):
+            path = '/autocomplete?q=' + urllib.parse.quote(text[:end])
+            start = time.perf_counter()
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            status, keep_alive = await fetch(reader, writer, host, path)
+            samples[typo].append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+            if not keep_alive:
+                writer.close()
+                writer = None
+            await asyncio.sleep(pause)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run(args):
+    url = urllib.parse.urlsplit(args.url)
+    rng = random.Random(0)
+    titles = popular_titles(args.csv, args.titles)
+    samples, errors = {False: [], True: []}, []
+    tasks = []
+    start = time.perf_counter()
+    for _ in range(args.users):
+        text = rng.choice(titles)
+        typo = rng.random() < args.typo_rate
+        if typo:
+            text = mistype(text, rng)
+        tasks.append(user(url.hostname, url.port or 80, text, typo,
+                          args.debounce / 1000 * rng.uniform(0.5, 1.5), samples, errors))
+        # Users start within the ramp window, so their keystrokes overlap
+        await asyncio.sleep(args.ramp / args.users)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    total = len(samples[False]) + len(samples[True])
+    print(f"{total} requests from {args.users} users in {elapsed:.1f}s "
+          f"({total / elapsed:.0f} req/s), {len(errors)} non-200 responses")
+    print(f"{'keystrokes':>10} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for label, typo in (('clean', False), ('typo', True), ('all', None)):
+        values = samples[False] + samples[True] if typo is None else samples[typo]
+        if not values:
+            continue
+        p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+        print(f"{label:>10} {len(values):>7} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} {max(values) * 1000:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Burst typing load on /autocomplete")
+    parser.add_argument('--url', default='http://127.0.0.1:8001')
+    parser.add_argument('--csv', default='books1.csv')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--titles', type=int, default=20, help="popular titles users pick from")
+    parser.add_argument('--typo-rate', type=float, default=0.2)
+    parser.add_argument('--debounce', type=float, default=60, help="ms between keystrokes")
+    parser.add_argument('--ramp', type=float, default=1.0, help="seconds over which users start")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Offline comparison of feature modes (see features.py): recommendation
+# quality proxies and on-demand query latency for the same sample of books.
+#
+#   python benchmarks/eval_features.py
+#   python benchmarks/eval_features.py --modes compat,rich --weights title=2 --queries 1000
+#
+# There are no relevance labels, so quality is measured with metadata the
+# compat features never see: how often a recommendation shares an author or
+# publisher with the query book, the title-token overlap, and how far apart
+# page count and publication year are. Same-language share and the rating
+# gap show what is traded away. Latency is a cold NeighborIndex.neighbors
+# call per query, as /api/recommend makes it.
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from features import FEATURE_MODES, encode_columns, feature_config, title_tokens  # noqa: E402
+from knn_backends import is_sparse  # noqa: E402
+from model_store import BookStore, load_books  # noqa: E402
+from neighbor_index import NeighborIndex  # noqa: E402
+
+
+def feature_bytes(features):
+    if is_sparse(features):
+        return features.data.nbytes + features.indices.nbytes + features.indptr.nbytes
+    return features.nbytes
+
+
+# Quality proxies for neighbor lists `found` (one row of book rows per query)
+def quality(books, query_rows, found):
+    authors = [set(a.split('/')) for a in books.rich['authors']]
+    publishers = books.rich['publishers']
+    tokens = [set(title_tokens(t)) for t in books.titles]
+    pages, year = books.rich['num_pages'], books.rich['year']
+    same_author, same_publisher, overlap, same_language = [], [], [], []
+    rating_gap, page_gap, year_gap = [], [], []
+    for row, neighbors in zip(query_rows, found):
+        for other in neighbors:
+            same_author.append(bool(authors[row] & authors[other]))
+            same_publisher.append(bool(publishers[row]) and publishers[row] == publishers[other])
+            union = tokens[row] | tokens[other]
+            overlap.append(len(tokens[row] & tokens[other]) / len(union) if union else 0)
+            same_language.append(books.language_codes[row] == books.language_codes[other])
+            rating_gap.append(abs(books.average_rating[row] - books.average_rating[other]))
+            page_gap.append(abs(pages[row] - pages[other]))
+            year_gap.append(abs(year[row] - year[other]))
+    return {'author': np.mean(same_author), 'publisher': np.mean(same_publisher),
+            'title_jaccard': np.mean(overlap), 'language': np.mean(same_language),
+            'rating_gap': np.mean(rating_gap), 'pages_gap': np.nanmedian(page_gap),
+            'year_gap': np.nanmedian(year_gap)}
+
+
+def evaluate(books, config, backend, query_rows, k):
+    start = time.perf_counter()
+    features, _ = encode_columns(books, config)
+    build = time.perf_counter() - start
+    store = BookStore(titles=books.titles, neighbors=None, ratings_count=books.ratings_count,
+                      features=features, book_ids=books.book_ids)
+    index = NeighborIndex(store, cache_size=0, backend=backend)
+    index.fitted_model()
+
+    found, latencies = [], []
+    for row in query_rows:
+        start = time.perf_counter()
+        found.append(index.neighbors(int(row), k))
+        latencies.append(time.perf_counter() - start)
+    result = quality(books, query_rows, found)
+    p50, p95 = np.percentile(np.array(latencies) * 1000, [50, 95])
+    result.update(build_s=build, mb=feature_bytes(features) / 2**20, p50_ms=p50, p95_ms=p95)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare feature modes offline")
+    parser.add_argument('--csv', default='books1.csv')
+    parser.add_argument('--modes', default='compat,rich')
+    parser.add_argument('--weights', default=None, help="weights applied to every mode")
+    parser.add_argument('--backend', default='ball_tree')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('-k', type=int, default=5)
+    args = parser.parse_args()
+
+    books = load_books(args.csv, rich=True)
+    rng = np.random.default_rng(0)
+    query_rows = rng.choice(len(books), min(args.queries, len(books)), replace=False)
+    print(f"{'mode':>8} {'author':>7} {'publ.':>7} {'title J':>8} {'lang':>6} {'rating':>7} "
+          f"{'pages':>6} {'year':>5} {'build s':>8} {'MB':>6} {'p50 ms':>7} {'p95 ms':>7}")
+    for mode in args.modes.split(','):
+        if mode not in FEATURE_MODES:
+            parser.error(f"unknown mode {mode!r}")
+        weights = args.weights if FEATURE_MODES[mode].get('rich') else None
+        r = evaluate(books, feature_config(mode, weights), args.backend, query_rows, args.k)
+        print(f"{mode:>8} {r['author']:>7.3f} {r['publisher']:>7.3f} {r['title_jaccard']:>8.3f} "
+              f"{r['language']:>6.3f} {r['rating_gap']:>7.3f} {r['pages_gap']:>6.0f} "
+              f"{r['year_gap']:>5.0f} {r['build_s']:>8.2f} {r['mb']:>6.1f} "
+              f"{r['p50_ms']:>7.2f} {r['p95_ms']:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# Streaming, typed reader for the catalogue CSV.
+#
+# The CSV is read in chunks of CHUNK_ROWS with explicit dtypes and only the
+# columns the model needs, so large catalogues never sit in memory as one
+# fully inferred DataFrame. Lines pandas can't split into the header's
+# fields and rows whose required values don't parse are rejected, counted
+# and sampled in a LoadReport instead of being dropped silently.
+import csv
+import hashlib
+import re
+import warnings
+
+import numpy as np
+
+CHUNK_ROWS = 100_000
+REJECT_SAMPLES = 5
+
+# Column dtypes; numeric columns are coerced separately so that one bad
+# value rejects its row instead of failing the whole chunk. Rows without a
+# title, average_rating or ratings_count are rejected; a missing bookID
+# becomes -1.
+BOOK_SCHEMA = {
+    'bookID': 'int64',
+    'title': 'str',
+    'average_rating': 'float64',
+    'ratings_count': 'float64',
+    'language_code': 'category',
+    'authors': 'str',
+    'publisher': 'category',
+    'num_pages': 'float64',
+    'publication_date': 'str',
+}
+MODEL_COLUMNS = ('bookID', 'title', 'average_rating', 'ratings_count', 'language_code')
+# Columns kept for recommendation filters (see facets); they may be missing or empty
+FACET_COLUMNS = ('num_pages', 'publication_date')
+# Columns kept for serving: authors tell apart works sharing a title (see
+# rerank), plus the filter columns
+SERVED_COLUMNS = ('authors',) + FACET_COLUMNS
+# Extra columns read for the 'rich' feature mode; they may be missing or empty
+RICH_COLUMNS = ('authors', 'publisher') + FACET_COLUMNS
+REQUIRED_COLUMNS = ('title', 'average_rating', 'ratings_count', 'language_code')
+
+BAD_LINE = re.compile(r'Skipping line (\d+): (.*)')
+
+
+# Counts and a few examples of everything the loader rejected
+class LoadReport:
+    def __init__(self):
+        self.rows = 0
+        self.rejected = 0
+        self.samples = []
+
+    def reject(self, reason, count=1, **where):
+        self.rejected += count
+        if len(self.samples) < REJECT_SAMPLES:
+            self.samples.append(dict(where, reason=reason))
+
+    def to_dict(self):
+        return {'rows': self.rows, 'rejected': self.rejected, 'samples': self.samples}
+
+
+# Stable id of each book's first author ("First Author/Second Author",
+# compared ignoring case and spacing), 0 when unknown. Ids are hashes, not
+# positions in a vocabulary, so catalogue updates can compute them for new
+# books on their own.
+def author_ids(authors):
+    import pandas as pd
+
+    # Distinct values are few compared to rows, so only those are normalized
+    codes, values = pd.factorize(pd.Series(authors, dtype=object), use_na_sentinel=False)
+    ids = np.zeros(len(values) + 1, dtype=np.int64)
+    for i, value in enumerate(values):
+        name = ' '.join(str(value).split('/', 1)[0].lower().split()) if isinstance(value, str) else ''
+        if name:
+            digest = hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest()
+            ids[i] = int.from_bytes(digest, 'little') >> 1
+    return ids[codes]
+
+
+# Raw header row of the CSV
+def read_header(csv_path):
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f), [])
+
+
+# Yield typed DataFrame chunks holding `columns`, recording rejected lines
+# and rows in `report`. Column names are matched ignoring whitespace (the
+# Goodreads export has '  num_pages').
+def read_book_chunks(csv_path, columns=MODEL_COLUMNS, chunksize=CHUNK_ROWS, report=None):
+    import pandas as pd
+
+    report = report if report is not None else LoadReport()
+    header = read_header(csv_path)
+    present = {name.strip(): name for name in header}
+    missing = [col for col in REQUIRED_COLUMNS if col not in present]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
+    wanted = [present[col] for col in columns if col in present]
+    numeric = [col for col in columns if col in present and BOOK_SCHEMA[col] in ('int64', 'float64')]
+    dtype = {present[col]: BOOK_SCHEMA[col] for col in columns
+             if col in present and col not in numeric}
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', pd.errors.ParserWarning)
+        # usecols would disable pandas' field-count check and let lines with
+        # an unquoted comma through with shifted columns, so every column is
+        # parsed and the unneeded ones are dropped per chunk
+        reader = pd.read_csv(csv_path, dtype=dtype, chunksize=chunksize,
+                             on_bad_lines='warn', encoding='utf-8')
+        for chunk in reader:
+            chunk = chunk[wanted]
+            # Bad lines are reported as warnings while the chunk is parsed
+            for warning in caught:
+                for line, reason in BAD_LINE.findall(str(warning.message)):
+                    report.reject(reason, line=int(line))
+            caught.clear()
+
+            chunk.columns = [name.strip() for name in wanted]
+            for col in numeric:
+                chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+            invalid = chunk[['title', 'average_rating', 'ratings_count']].isna()
+            bad = invalid.any(axis=1).to_numpy()
+            if bad.any():
+                # Data rows are numbered from 0 in file order, excluding bad lines
+                for index in chunk.index[bad][:REJECT_SAMPLES - len(report.samples)]:
+                    problems = invalid.columns[invalid.loc[index].to_numpy()]
+                    report.reject(f"invalid {', '.join(problems)}", count=0, row=int(index))
+                report.rejected += int(bad.sum())
+                chunk = chunk[~bad]
+                for col in chunk.columns:
+                    if isinstance(chunk[col].dtype, pd.CategoricalDtype):
+                        chunk[col] = chunk[col].cat.remove_unused_categories()
+            if 'bookID' in chunk.columns:
+                chunk['bookID'] = chunk['bookID'].fillna(-1).astype('int64')
+            report.rows += len(chunk)
+            yield chunk
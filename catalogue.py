@@ -0,0 +1,314 @@
+# Incremental catalogue updates: append or update books without a full
+# model rebuild.
+#
+#   python catalogue.py new_books.csv            # CSV with the catalogue header
+#   python catalogue.py new_books.json           # JSON list of book objects
+#
+# Books are matched on bookID; known ids are updated, everything else is
+# appended. New rows are encoded with the already-fitted FeatureEncoder,
+# inserted into the neighbor index's brute-force delta, and only the rows of
+# the precomputed neighbor table that the change can affect are recomputed.
+# A full rebuild only happens when a book needs a new one-hot column (e.g. a
+# new language_code) or falls outside the fitted scaler range.
+#
+# The CSV is assumed to hold one record per line (true for the Goodreads
+# export this app ships with); untouched lines are kept byte for byte.
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import re
+import time
+
+import numpy as np
+
+from book_loader import author_ids
+from model_store import (ARTIFACT_DIR, FACET_ARRAYS, BookStore, build_artifact, build_lock,
+                         current_artifact, file_checksum, load_artifact, load_or_build_locked,
+                         write_artifact)
+
+REQUIRED_FIELDS = ('title', 'average_rating', 'ratings_count', 'language_code')
+YEAR = re.compile(r'(\d{4})')
+
+
+# Raised when an update can't be applied incrementally
+class NeedsRebuild(Exception):
+    pass
+
+
+# Read the catalogue as (header, raw lines) where line i + 1 holds record i
+def read_lines(csv_path):
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        lines = f.read().splitlines(keepends=True)
+    header = next(csv.reader([lines[0]]))
+    return [h.strip() for h in header], lines
+
+
+def format_line(values):
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n').writerow(values)
+    return out.getvalue()
+
+
+# Check the fields the model needs and convert them, raising ValueError
+def validate_book(book, position):
+    for field in REQUIRED_FIELDS:
+        if str(book.get(field, '')).strip() == '':
+            raise ValueError(f"Book {position}: missing '{field}'")
+    try:
+        rating = float(book['average_rating'])
+        count = float(book['ratings_count'])
+    except (TypeError, ValueError):
+        raise ValueError(f"Book {position}: average_rating and ratings_count must be numbers")
+    if not (math.isfinite(rating) and math.isfinite(count)) or count < 0:
+        raise ValueError(f"Book {position}: invalid average_rating or ratings_count")
+    return dict(book, title=str(book['title']).strip(), average_rating=rating,
+                ratings_count=count, language_code=str(book['language_code']).strip())
+
+
+# Merge the incoming records with the CSV: updates inherit the fields they
+# don't set from the existing line, new books without a bookID get the next
+# free one. Returns (books, ids already in the CSV, new lines) without
+# touching the file.
+def merge_records(header, lines, records, next_id):
+    id_column = header.index('bookID') if 'bookID' in header else None
+    line_for_id = {}
+    if id_column is not None:
+        for i, line in enumerate(lines[1:], start=1):
+            values = next(csv.reader([line]), [])
+            if len(values) > id_column:
+                line_for_id.setdefault(values[id_column].strip(), i)
+
+    # Last record wins when the same bookID appears twice
+    deduped = {}
+    for position, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise ValueError(f"Book {position}: must be an object")
+        record = {str(k).strip(): v for k, v in record.items()}
+        if record.get('bookID') in (None, ''):
+            record['bookID'] = next_id
+            next_id += 1
+        book_id = record['bookID']
+        try:
+            if isinstance(book_id, bool) or not isinstance(book_id, (int, str)):
+                raise ValueError()
+            book_id = int(book_id)
+        except ValueError:
+            raise ValueError(f"Book {position}: 'bookID' must be an integer")
+        deduped[str(book_id)] = record
+
+    books = []
+    existing_ids = set()
+    new_lines = list(lines)
+    if not new_lines[-1].endswith('\n'):
+        new_lines[-1] += '\n'
+    for position, (book_id, record) in enumerate(deduped.items()):
+        line_no = line_for_id.get(book_id)
+        if line_no is not None:
+            existing_ids.add(int(book_id))
+            existing = next(csv.reader([lines[line_no]]))
+            merged = dict(zip(header, existing))
+            merged.update(record)
+        else:
+            merged = dict(record)
+        book = validate_book(merged, position)
+        book['bookID'] = int(book_id)
+        values = [book.get(h, '') for h in header]
+        values[header.index('average_rating')] = merged['average_rating']
+        values[header.index('ratings_count')] = merged['ratings_count']
+        if line_no is not None:
+            new_lines[line_no] = format_line(values)
+        else:
+            new_lines.append(format_line(values))
+        books.append(book)
+    return books, existing_ids, new_lines
+
+
+# Optional numeric field (num_pages) as a float, NaN when missing or invalid
+def optional_number(value):
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        return math.nan
+    return number if math.isfinite(number) else math.nan
+
+
+# Facet columns of a store with the updated rows overwritten and the new
+# rows appended; unseen language codes extend the language list
+def apply_facets(facets, books, rows, updated):
+    languages = list(facets['languages'])
+    positions = {language: i for i, language in enumerate(languages)}
+    values = {name: [] for name in FACET_ARRAYS}
+    for book in books:
+        language = book['language_code']
+        if language not in positions:
+            positions[language] = len(languages)
+            languages.append(language)
+        year = YEAR.search(str(book.get('publication_date', '')))
+        values['language_code'].append(positions[language])
+        values['average_rating'].append(book['average_rating'])
+        values['num_pages'].append(optional_number(book.get('num_pages', '')))
+        values['year'].append(float(year.group(1)) if year else math.nan)
+
+    new_facets = {'languages': languages}
+    for name in FACET_ARRAYS:
+        old = np.asarray(facets[name])
+        column = np.array(values[name], dtype=old.dtype)
+        merged = np.concatenate([old, column[~updated]])
+        merged[rows[updated]] = column[updated]
+        new_facets[name] = merged
+    return new_facets
+
+
+# Apply validated books to a store and its neighbor index, returning
+# (new_store, new_neighbor_index, summary). Raises NeedsRebuild when the
+# fitted encoder can't represent the books, or when a book that is in the
+# CSV is missing from the model (a line the model build skipped as malformed).
+def apply_books(store, neighbor_index, books, existing_ids=()):
+    if store.encoder is None:
+        raise NeedsRebuild("artifact has no fitted encoder")
+    encoded, reason = store.encoder.transform(books)
+    if reason is not None:
+        raise NeedsRebuild(reason)
+
+    ids = np.array([book['bookID'] for book in books], dtype=np.int64)
+    rows = store.rows_for_ids(ids)
+    updated = rows >= 0
+    for book_id, row in zip(ids, rows):
+        if row < 0 and int(book_id) in existing_ids:
+            raise NeedsRebuild(f"book {book_id} is in the CSV but not in the model")
+    n_old, n_added = len(store), int((~updated).sum())
+
+    # Copy-on-write: readers keep using the old arrays until the swap
+    features = np.vstack([np.asarray(store.features), encoded[~updated]])
+    features[rows[updated]] = encoded[updated]
+    titles = list(store.titles) + [b['title'] for b, u in zip(books, updated) if not u]
+    ratings_count = np.concatenate([np.asarray(store.ratings_count),
+                                    np.array([b['ratings_count'] for b in books], dtype=np.float32)[~updated]])
+    book_ids = np.concatenate([np.asarray(store.book_ids), ids[~updated]])
+    for book, row in zip(books, rows):
+        if row >= 0:
+            titles[row] = book['title']
+            ratings_count[row] = book['ratings_count']
+
+    facets = None if store.facets is None else apply_facets(store.facets, books, rows, updated)
+    authors = None
+    if store.author_ids is not None:
+        new_authors = author_ids([book.get('authors') for book in books])
+        authors = np.concatenate([np.asarray(store.author_ids), new_authors[~updated]])
+        authors[rows[updated]] = new_authors[updated]
+
+    changed = np.concatenate([rows[updated], np.arange(n_old, n_old + n_added)])
+    new_store = BookStore(titles=titles, neighbors=None, ratings_count=ratings_count,
+                          features=features, manifest=dict(store.manifest),
+                          book_ids=book_ids, encoder=store.encoder, facets=facets,
+                          author_ids=authors)
+    new_index = neighbor_index.with_store(new_store, changed)
+
+    patched = 0
+    if store.neighbors is not None:
+        new_store.neighbors, patched = patch_neighbor_table(store.neighbors, new_store, new_index,
+                                                            rows[updated], changed)
+    summary = {'added': n_added, 'updated': int(updated.sum()), 'patched_rows': patched}
+    return new_store, new_index, summary
+
+
+# Recompute only the neighbor-table rows a change can affect: the changed
+# rows themselves, rows that listed an updated book, and rows for which a
+# changed book is now at least as close as their current last neighbor
+def patch_neighbor_table(table, store, index, updated_rows, changed):
+    table = np.asarray(table)
+    n_old, width = table.shape
+    # float64 even for float32 features: the distance comparison below
+    # would otherwise lose close neighbors to cancellation
+    features = np.asarray(store.features, dtype=np.float64)
+    affected = np.zeros(len(store), dtype=bool)
+    affected[changed] = True
+    if len(updated_rows):
+        affected[:n_old] |= np.isin(table, updated_rows).any(axis=1)
+
+    old = features[:n_old]
+    diff = old - features[table[:, -1]]
+    kth = np.einsum('ij,ij->i', diff, diff)
+    moved = features[changed]
+    cross = (np.einsum('ij,ij->i', old, old)[:, None] - 2 * old @ moved.T
+             + np.einsum('ij,ij->i', moved, moved)[None, :])
+    affected[:n_old] |= (cross <= kth[:, None] + 1e-12).any(axis=1)
+
+    new_table = np.zeros((len(store), width), dtype=np.int32)
+    new_table[:n_old] = table
+    rows = np.flatnonzero(affected)
+    if len(rows):
+        new_table[rows] = index.query(features[rows], width)
+    return new_table, len(rows)
+
+
+# Upsert books into the catalogue CSV and the published artifact. Pass the
+# serving store/index to update them instead of reloading; they are ignored
+# if another process has published a newer artifact in the meantime.
+# Returns (store, neighbor_index or None after a full rebuild, summary).
+def upsert_books(csv_path, records, store=None, neighbor_index=None, artifact_dir=ARTIFACT_DIR):
+    from neighbor_index import NeighborIndex
+
+    start = time.perf_counter()
+    with build_lock(artifact_dir):
+        path = current_artifact(artifact_dir)
+        if store is None or path is None or store.manifest.get('path') != path:
+            store = load_or_build_locked(csv_path, artifact_dir)
+            neighbor_index = None
+        if neighbor_index is None:
+            neighbor_index = NeighborIndex(store)
+
+        header, lines = read_lines(csv_path)
+        next_id = int(np.max(store.book_ids)) + 1 if len(store) else 1
+        books, existing_ids, new_lines = merge_records(header, lines, records, next_id)
+
+        rebuild = None
+        try:
+            new_store, new_index, summary = apply_books(store, neighbor_index, books, existing_ids)
+        except NeedsRebuild as e:
+            rebuild = str(e)
+
+        # Publish the CSV first: if we die before the artifact is written the
+        # checksum no longer matches and the next start rebuilds from the CSV
+        tmp_path = f"{csv_path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            f.writelines(new_lines)
+        os.replace(tmp_path, csv_path)
+
+        if rebuild is not None:
+            print(f"Full rebuild required: {rebuild}")
+            width = 0 if store.neighbors is None else store.neighbors.shape[1]
+            new_store = load_artifact(build_artifact(csv_path, artifact_dir, n_neighbors=width,
+                                                     config=store.encoder and store.encoder.config))
+            new_index = None
+            summary = {'added': None, 'updated': None, 'patched_rows': None}
+        else:
+            checksum = file_checksum(csv_path)
+            path = write_artifact(new_store, csv_path, checksum, artifact_dir)
+            new_store.manifest.update(path=path, csv_sha256=checksum)
+
+    summary.update(rebuilt=rebuild, books=len(new_store),
+                   seconds=round(time.perf_counter() - start, 3))
+    return new_store, new_index, summary
+
+
+# Load book records from a CSV (catalogue header) or a JSON list
+def read_records(path):
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Append or update books without a full rebuild")
+    parser.add_argument('books', help="CSV (catalogue header) or JSON list of books")
+    parser.add_argument('--csv', default='books1.csv', help="catalogue CSV to update")
+    parser.add_argument('--artifacts', default=ARTIFACT_DIR, help="artifact directory")
+    args = parser.parse_args()
+    _, _, summary = upsert_books(args.csv, read_records(args.books), artifact_dir=args.artifacts)
+    print(json.dumps(summary))
@@ -0,0 +1,239 @@
+# Recommendation filters on language, average rating, page count and
+# publication year.
+#
+# At load time every language gets a bitmap of its books, and the rating,
+# page and year columns get one bitmap per value bin (packed, one bit per
+# book). A filter's bitmap is the AND of its language bitmaps (ORed) and of
+# the bins covering each range; the bins at the edges of a range are then
+# checked exactly against the column. Its popcount tells how rare the
+# filter is:
+#   - at most BRUTE_FORCE_ROWS books: their distances to the query book are
+#     computed directly and the closest are taken
+#   - otherwise the kNN index is asked for enough neighbors that about
+#     twice the number requested are expected to pass; if too few do (the
+#     filtered column is also a feature, so a query book's neighborhood can
+#     be nearly empty of matches) the fetch is quadrupled once, and after
+#     that the matching books are searched directly as above
+# Either way a filtered query returns as many books as asked for unless
+# fewer than that match the filter.
+import math
+
+import numpy as np
+
+# Bin edges of the range bitmaps: half stars, page counts in powers of two
+# (16 to 4096) and decades
+RATING_EDGES = np.arange(0.5, 5.0, 0.5)
+PAGE_EDGES = 2.0 ** np.arange(4, 13)
+YEAR_EDGES = np.arange(1900, 2030, 10)
+BRUTE_FORCE_ROWS = 20000
+EXPAND_ROUNDS = 2
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+# Query parameters of a filter: the language list, then (min, max) per range
+RANGE_PARAMS = {'rating': ('min_rating', 'max_rating'),
+                'pages': ('min_pages', 'max_pages'),
+                'year': ('min_year', 'max_year')}
+
+
+# One bit per book (numpy bit order), set where `mask` is true
+def pack(mask):
+    return np.packbits(mask)
+
+
+def popcount(bitmap):
+    return int(POPCOUNT[bitmap].sum(dtype=np.int64))
+
+
+# Rows of a packed bitmap whose bits are set
+def bitmap_rows(bitmap, n):
+    return np.flatnonzero(np.unpackbits(bitmap, count=n))
+
+
+def bits_set(bitmap, rows):
+    return (bitmap[rows >> 3] >> (7 - (rows & 7))) & 1 == 1
+
+
+# A parsed filter: language codes (any of them) and inclusive (min, max)
+# ranges, None for an open end
+class FacetFilter:
+    def __init__(self, languages=(), rating=None, pages=None, year=None):
+        self.languages = tuple(languages)
+        self.ranges = {name: value for name, value in
+                       (('rating', rating), ('pages', pages), ('year', year)) if value is not None}
+
+    def __bool__(self):
+        return bool(self.languages or self.ranges)
+
+    # Hashable identity, for ETags and request coalescing
+    def key(self):
+        return (self.languages,) + tuple((name, *self.ranges[name]) for name in sorted(self.ranges))
+
+    # Echoed in API responses
+    def to_dict(self):
+        out = {'language': list(self.languages)} if self.languages else {}
+        for name, (low, high) in self.ranges.items():
+            low_param, high_param = RANGE_PARAMS[name]
+            if low is not None:
+                out[low_param] = low
+            if high is not None:
+                out[high_param] = high
+        return out
+
+
+# FacetFilter from request parameters (query string, form or JSON object):
+# language=eng,en-US (or a JSON list), min_rating/max_rating,
+# min_pages/max_pages, min_year/max_year. Raises ValueError on bad values.
+def parse_filters(params):
+    languages = params.get('language') or ()
+    if isinstance(languages, str):
+        languages = [code.strip() for code in languages.split(',') if code.strip()]
+    if not isinstance(languages, (list, tuple)) or not all(isinstance(c, str) for c in languages):
+        raise ValueError("'language' must be a language code or a list of them")
+    languages = [code.strip() for code in languages]
+    if not all(languages):
+        raise ValueError("'language' codes must not be empty")
+
+    ranges = {}
+    for name, (low_param, high_param) in RANGE_PARAMS.items():
+        bounds = []
+        for param in (low_param, high_param):
+            value = params.get(param)
+            if value is None or value == '':
+                bounds.append(None)
+                continue
+            try:
+                if isinstance(value, bool):
+                    raise TypeError()
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"'{param}' must be a number")
+            if not math.isfinite(value):
+                raise ValueError(f"'{param}' must be a finite number")
+            bounds.append(value)
+        if bounds != [None, None]:
+            if None not in bounds and bounds[0] > bounds[1]:
+                raise ValueError(f"'{low_param}' is greater than '{high_param}'")
+            ranges[name] = tuple(bounds)
+    return FacetFilter(languages, **ranges)
+
+
+# Bin bitmaps of one numeric column; NaN (unknown) is in no bin
+class RangeBitmaps:
+    def __init__(self, values, edges):
+        self.values = values
+        self.edges = edges
+        bins = np.digitize(values, edges)
+        known = ~np.isnan(values)
+        self.bitmaps = [pack(known & (bins == b)) for b in range(len(edges) + 1)]
+
+    # Books that may lie in [low, high]: the union of the bins it overlaps
+    def bitmap(self, low, high):
+        first = 0 if low is None else int(np.digitize(low, self.edges))
+        last = len(self.edges) if high is None else int(np.digitize(high, self.edges))
+        out = np.zeros_like(self.bitmaps[0])
+        for b in range(first, last + 1):
+            out |= self.bitmaps[b]
+        return out
+
+    def contains(self, rows, low, high):
+        values = self.values[rows]
+        inside = ~np.isnan(values)
+        if low is not None:
+            inside &= values >= low
+        if high is not None:
+            inside &= values <= high
+        return inside
+
+
+# Filter bitmaps of a store, built once per model snapshot
+class FacetIndex:
+    def __init__(self, store):
+        self.store = store
+        self.n = len(store)
+        self.available = store.facets is not None
+        if not self.available:
+            return
+        facets = store.facets
+        self.language_positions = {code: i for i, code in enumerate(facets['languages'])}
+        codes = np.asarray(facets['language_code'])
+        self.language_bitmaps = {int(i): pack(codes == i) for i in np.unique(codes[codes >= 0])}
+        self.columns = {'rating': RangeBitmaps(np.asarray(facets['average_rating']), RATING_EDGES),
+                        'pages': RangeBitmaps(np.asarray(facets['num_pages']), PAGE_EDGES),
+                        'year': RangeBitmaps(np.asarray(facets['year']), YEAR_EDGES)}
+        self.everything = pack(np.ones(self.n, dtype=bool))
+        # Squared feature norms, for distances without copying feature rows
+        features = store.features
+        if hasattr(features, 'multiply'):
+            self.norms = np.asarray(features.multiply(features).sum(axis=1), dtype=np.float64).ravel()
+        else:
+            self.norms = np.einsum('ij,ij->i', features, features, dtype=np.float64)
+
+    # Language codes with their book counts, most common first
+    def languages(self):
+        counts = {code: popcount(self.language_bitmaps[i])
+                  for code, i in self.language_positions.items() if i in self.language_bitmaps}
+        return sorted(counts.items(), key=lambda item: -item[1])
+
+    # Packed bitmap of the books that may match (exact for languages, whole
+    # bins for ranges)
+    def bitmap(self, flt):
+        out = self.everything.copy()
+        if flt.languages:
+            languages = np.zeros_like(out)
+            for code in flt.languages:
+                position = self.language_positions.get(code)
+                if position in self.language_bitmaps:
+                    languages |= self.language_bitmaps[position]
+            out &= languages
+        for name, (low, high) in flt.ranges.items():
+            out &= self.columns[name].bitmap(low, high)
+        return out
+
+    # Rows among `rows` that match exactly, given the filter's bitmap
+    def matching(self, rows, flt, bitmap):
+        rows = rows[bits_set(bitmap, rows)]
+        for name, (low, high) in flt.ranges.items():
+            rows = rows[self.columns[name].contains(rows, low, high)]
+        return rows
+
+    # Squared distances from `row` to `rows` in feature space. For a large
+    # share of the catalogue one pass over all features beats gathering rows.
+    def squared_distances(self, row, rows):
+        features = self.store.features
+        query = features[row]
+        query = query.toarray().ravel() if hasattr(query, 'toarray') else np.asarray(query, dtype=np.float64)
+        if 4 * len(rows) > self.n:
+            dot = (features @ query)[rows]
+        else:
+            dot = features[rows] @ query
+        return np.maximum(self.norms[rows] - 2 * np.asarray(dot).ravel() + self.norms[row], 0)
+
+    # The `count` books matching the filter that are closest to `row`
+    # (excluding it), closest first
+    def neighbors(self, neighbor_index, row, flt, count):
+        bitmap = self.bitmap(flt)
+        candidates = popcount(bitmap)
+        if candidates <= BRUTE_FORCE_ROWS:
+            return self.closest(row, flt, bitmap, count)
+
+        fetch = min(self.n, max(2 * count, 2 * count * self.n // candidates))
+        query = self.store.features[row:row + 1]
+        for _ in range(EXPAND_ROUNDS):
+            rows = np.asarray(neighbor_index.query(query, fetch + 1)[0])
+            found = self.matching(rows[rows != row], flt, bitmap)
+            if len(found) >= count or fetch >= self.n:
+                return found[:count]
+            fetch = min(self.n, fetch * 4)
+        return self.closest(row, flt, bitmap, count)
+
+    # Exact search over every book in the filter's bitmap
+    def closest(self, row, flt, bitmap, count):
+        rows = self.matching(bitmap_rows(bitmap, self.n), flt, bitmap)
+        rows = rows[rows != row]
+        if len(rows) == 0:
+            return rows
+        distance = self.squared_distances(row, rows)
+        if len(rows) > count:
+            head = np.argpartition(distance, count - 1)[:count]
+            rows, distance = rows[head], distance[head]
+        return rows[np.lexsort((rows, distance))]
@@ -0,0 +1,308 @@
+# Feature pipeline: rating bucket and language one-hots plus the raw
+# average_rating and ratings_count, min-max scaled into one matrix.
+#
+# Books arrive as compact codes (a bucket index and a language index per
+# book, see model_store.BookColumns), so the one-hot columns are written
+# straight into the output matrix instead of going through string labels,
+# get_dummies and a dense float64 frame. The default 'compat' mode
+# reproduces the original pandas/scikit-learn pipeline bit for bit; 'fast'
+# stores float32 and per-group weights change how much each group counts.
+#
+# The optional 'rich' mode appends a hashed TF-IDF of the title tokens,
+# author and publisher one-hots and scaled page count and publication year.
+# The result is a scipy CSR matrix, built once and stored sparse.
+import re
+import zlib
+
+import numpy as np
+
+# Upper bounds of the rating buckets below 5; see rating_bucket
+RATING_EDGES = np.array([1.0, 2.0, 3.0, 4.0])
+FEATURE_GROUPS = ('rating_bucket', 'language', 'average_rating', 'ratings_count')
+RICH_GROUPS = ('title', 'authors', 'publisher', 'num_pages', 'year')
+# Title tokens are hashed into this many TF-IDF columns
+TITLE_BUCKETS = 1 << 14
+# Authors and publishers with fewer books than this get no column; a
+# column only one book has can never make two books closer
+MIN_GROUP_BOOKS = 2
+TOKEN = re.compile(r'\w+')
+
+
+# Rating bucket label for one average rating, None when outside 0-5
+def rating_bucket(rating):
+    if 0 <= rating <= 1:
+        return "between 0 and 1"
+    for low in range(1, 5):
+        if low < rating <= low + 1:
+            return f"between {low} and {low + 1}"
+    return None
+
+
+RATING_LABELS = [rating_bucket(code + 0.5) for code in range(len(RATING_EDGES) + 1)]
+
+
+# Bucket index per rating in one pass: [0, 1] -> 0, (1, 2] -> 1, ...,
+# (4, 5] -> 4, and -1 outside 0-5 (matching rating_bucket)
+def rating_codes(ratings):
+    ratings = np.asarray(ratings, dtype=np.float64)
+    codes = np.digitize(ratings, RATING_EDGES, right=True).astype(np.int8)
+    codes[~((ratings >= 0) & (ratings <= 5))] = -1
+    return codes
+
+
+# Output dtype and per-group weights. Weights multiply the scaled columns of
+# a group, so a weight of 2 on ratings_count makes its differences count
+# twice as much in the Euclidean distance; 0 drops the group.
+class FeatureConfig:
+    def __init__(self, dtype='float64', weights=None, rich=False):
+        self.dtype = np.dtype(dtype).name
+        if self.dtype not in ('float32', 'float64'):
+            raise ValueError(f"Unsupported feature dtype {dtype!r}")
+        self.rich = bool(rich)
+        groups = FEATURE_GROUPS + RICH_GROUPS if self.rich else FEATURE_GROUPS
+        unknown = set(weights or {}) - set(groups)
+        if unknown:
+            raise ValueError(f"Unknown feature groups {sorted(unknown)}, expected {groups}")
+        self.weights = {group: float((weights or {}).get(group, 1.0)) for group in groups}
+
+    def __eq__(self, other):
+        return isinstance(other, FeatureConfig) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"FeatureConfig({self.dtype!r}, {self.weights!r}, rich={self.rich})"
+
+    def to_dict(self):
+        return {'dtype': self.dtype, 'weights': self.weights, 'rich': self.rich}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data) if data else cls()
+
+
+FEATURE_MODES = {
+    'compat': {'dtype': 'float64'},
+    'fast': {'dtype': 'float32'},
+    'rich': {'dtype': 'float32', 'rich': True},
+}
+
+
+# FeatureConfig from a mode name and an optional 'group=weight,...' string
+def feature_config(mode='compat', weights=None):
+    if mode not in FEATURE_MODES:
+        raise ValueError(f"Unknown feature mode {mode!r}, expected one of {sorted(FEATURE_MODES)}")
+    parsed = {}
+    for item in (weights or '').split(','):
+        if item.strip():
+            group, _, value = item.partition('=')
+            parsed[group.strip()] = float(value)
+    return FeatureConfig(weights=parsed, **FEATURE_MODES[mode])
+
+
+# The fitted one-hot vocabulary and min-max scaler range of a feature
+# matrix, kept with the artifact so new books can be encoded the same way
+# without refitting
+class FeatureEncoder:
+    def __init__(self, rating_columns, language_columns, data_min, data_max, config=None):
+        self.rating_columns = list(rating_columns)
+        self.language_columns = list(language_columns)
+        self.data_min = np.asarray(data_min, dtype=np.float64)
+        self.data_max = np.asarray(data_max, dtype=np.float64)
+        self.config = config or FeatureConfig()
+
+    def to_dict(self):
+        return {'rating_columns': self.rating_columns,
+                'language_columns': self.language_columns,
+                'data_min': self.data_min.tolist(),
+                'data_max': self.data_max.tolist(),
+                'config': self.config.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['rating_columns'], data['language_columns'],
+                   data['data_min'], data['data_max'], FeatureConfig.from_dict(data.get('config')))
+
+    # Scale and weight of every output column. Scaling uses the same
+    # arithmetic as MinMaxScaler.transform so compat mode matches it exactly.
+    def column_scaling(self):
+        data_range = self.data_max - self.data_min
+        scale = 1.0 / np.where(data_range < 10 * np.finfo(np.float64).eps, 1.0, data_range)
+        offset = 0 - self.data_min * scale
+        weights = self.config.weights
+        n_rating, n_language = len(self.rating_columns), len(self.language_columns)
+        weight = np.array([weights['rating_bucket']] * n_rating + [weights['language']] * n_language
+                          + [weights['average_rating'], weights['ratings_count']])
+        return scale, offset, weight
+
+    # Build the feature matrix from per-book one-hot column positions (-1 for
+    # none) and the two numeric columns, directly in the configured dtype
+    def encode(self, rating_pos, language_pos, average_rating, ratings_count):
+        n_rating = len(self.rating_columns)
+        scale, offset, weight = self.column_scaling()
+        out = np.zeros((len(average_rating), len(scale)), dtype=self.config.dtype)
+
+        # A set one-hot bit scales to (1 * scale + offset): 1, or 0 for a
+        # column every book has. Unset bits scale to 0.
+        on_value = (1 * scale + offset) * weight
+        rows = np.arange(len(out))
+        has_rating = rating_pos >= 0
+        out[rows[has_rating], rating_pos[has_rating]] = on_value[rating_pos[has_rating]]
+        has_language = language_pos >= 0
+        columns = n_rating + language_pos[has_language]
+        out[rows[has_language], columns] = on_value[columns]
+
+        for column, values in ((-2, average_rating), (-1, ratings_count)):
+            out[:, column] = (np.asarray(values, dtype=np.float64) * scale[column]
+                              + offset[column]) * weight[column]
+        return out
+
+    # Scaled feature rows for book dicts (average_rating, ratings_count,
+    # language_code). Returns (features, None), or (None, reason) when a book
+    # needs a new one-hot column or falls outside the fitted scaler range and
+    # the model has to be rebuilt instead.
+    def transform(self, books):
+        if self.config.rich:
+            return None, "rich features are only built in full"
+        ratings = np.array([float(book['average_rating']) for book in books])
+        counts = np.array([float(book['ratings_count']) for book in books])
+        codes = rating_codes(ratings)
+        rating_index = {RATING_LABELS.index(label): i for i, label in enumerate(self.rating_columns)}
+        for code in set(codes[codes >= 0].tolist()) - set(rating_index):
+            return None, f"new rating bucket '{RATING_LABELS[code]}'"
+        language_index = {name: i for i, name in enumerate(self.language_columns)}
+        for book in books:
+            if book['language_code'] not in language_index:
+                return None, f"new language_code '{book['language_code']}'"
+
+        rating_pos = np.array([rating_index.get(code, -1) for code in codes.tolist()], dtype=np.int64)
+        language_pos = np.array([language_index[book['language_code']] for book in books],
+                                dtype=np.int64)
+        n_rating = len(self.rating_columns)
+        for values, column in ((ratings, -2), (counts, -1)):
+            if ((values < self.data_min[column]) | (values > self.data_max[column])).any():
+                return None, "value outside the fitted scaler range"
+        # So does a book without a one-hot bit that every fitted book has
+        for column in np.flatnonzero(self.data_min[:-2] > 0):
+            pos = rating_pos if column < n_rating else n_rating + language_pos
+            if (pos != column).any():
+                return None, "value outside the fitted scaler range"
+        return self.encode(rating_pos, language_pos, ratings, counts), None
+
+
+# Fit the encoder on compact book columns (see model_store.BookColumns) and
+# build the matrix: one-hot columns in sorted label order for the buckets
+# and languages that occur, then average_rating and ratings_count
+def encode_columns(books, config=None):
+    present_buckets = np.unique(books.rating_codes[books.rating_codes >= 0])
+    rating_columns = [RATING_LABELS[code] for code in present_buckets]
+    present_languages = np.unique(books.language_codes[books.language_codes >= 0])
+    language_columns = sorted(books.languages[code] for code in present_languages)
+
+    n_rating, n_language = len(rating_columns), len(language_columns)
+    rating_pos = np.full(len(RATING_LABELS) + 1, -1)
+    rating_pos[present_buckets] = np.arange(n_rating)
+    language_rank = {name: i for i, name in enumerate(language_columns)}
+    language_pos = np.array([language_rank.get(name, -1) for name in books.languages] + [-1])
+    # Code -1 indexes the trailing -1 entry of both lookups
+    rating_pos = rating_pos[books.rating_codes]
+    language_pos = language_pos[books.language_codes]
+
+    # Min/max per output column as MinMaxScaler would see them: a one-hot
+    # column is 0..1 unless every book has the bit
+    n = len(books)
+    rating_counts = np.bincount(rating_pos[rating_pos >= 0], minlength=n_rating)
+    language_counts = np.bincount(language_pos[language_pos >= 0], minlength=n_language)
+    data_min = np.concatenate([(rating_counts == n).astype(np.float64),
+                               (language_counts == n).astype(np.float64),
+                               [np.min(books.average_rating), np.min(books.ratings_count)]])
+    data_max = np.concatenate([np.ones(n_rating + n_language),
+                               [np.max(books.average_rating), np.max(books.ratings_count)]])
+
+    encoder = FeatureEncoder(rating_columns, language_columns, data_min, data_max, config)
+    features = encoder.encode(rating_pos, language_pos, books.average_rating, books.ratings_count)
+    if encoder.config.rich:
+        features = rich_features(books, features, encoder.config)
+    return features, encoder
+
+
+def title_tokens(title):
+    return TOKEN.findall(title.lower())
+
+
+# Token hash that is stable across processes, unlike hash()
+def token_bucket(token):
+    return zlib.crc32(token.encode('utf-8')) % TITLE_BUCKETS
+
+
+# Hashed TF-IDF of the title tokens: sublinear term frequency, smoothed idf
+# and unit-length rows, as a CSR matrix with TITLE_BUCKETS columns
+def title_tfidf(titles):
+    from scipy import sparse
+
+    rows, columns, counts = [], [], []
+    for row, title in enumerate(titles):
+        buckets, freq = np.unique([token_bucket(t) for t in title_tokens(title)], return_counts=True)
+        rows.extend([row] * len(buckets))
+        columns.extend(buckets.tolist())
+        counts.extend(freq.tolist())
+    tf = sparse.csr_matrix((1 + np.log(np.array(counts, dtype=np.float64)), (rows, columns)),
+                           shape=(len(titles), TITLE_BUCKETS))
+    df = np.bincount(tf.indices, minlength=TITLE_BUCKETS)
+    idf = np.log((1 + len(titles)) / (1 + df)) + 1
+    tfidf = tf.multiply(idf[None, :]).tocsr()
+    norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+    return sparse.diags(1 / np.where(norms > 0, norms, 1)) @ tfidf
+
+
+# Unit-length one-hot rows over the names in each value ('/'-separated for
+# authors), keeping only names shared by at least MIN_GROUP_BOOKS books
+def multi_hot(values, separator=None):
+    from scipy import sparse
+
+    names = [[n.strip() for n in v.split(separator)] if separator else [v.strip()] for v in values]
+    names = [[n for n in dict.fromkeys(row) if n] for row in names]
+    counts = {}
+    for row in names:
+        for name in row:
+            counts[name] = counts.get(name, 0) + 1
+    vocabulary = {name: i for i, name in enumerate(sorted(n for n, c in counts.items()
+                                                          if c >= MIN_GROUP_BOOKS))}
+    rows, columns, data = [], [], []
+    for row, row_names in enumerate(names):
+        kept = [vocabulary[n] for n in row_names if n in vocabulary]
+        if kept:
+            rows.extend([row] * len(kept))
+            columns.extend(kept)
+            data.extend([1 / np.sqrt(len(kept))] * len(kept))
+    return sparse.csr_matrix((data, (rows, columns)), shape=(len(values), len(vocabulary)))
+
+
+# Min-max scaled numeric column; unknown values take the median so they
+# don't look far from everything
+def scaled_column(values, log=False):
+    values = np.asarray(values, dtype=np.float64)
+    values = np.log1p(np.maximum(values, 0)) if log else values.copy()
+    known = np.isfinite(values)
+    if not known.any():
+        return np.zeros((len(values), 1))
+    values[~known] = np.median(values[known])
+    low, high = values.min(), values.max()
+    return ((values - low) / (high - low if high > low else 1.0))[:, None]
+
+
+# Append the rich groups to the base feature matrix, weighted, as one CSR
+# matrix in the configured dtype
+def rich_features(books, base, config):
+    from scipy import sparse
+
+    if books.rich is None:
+        raise ValueError("rich features need books loaded with rich=True")
+    weights = config.weights
+    blocks = [sparse.csr_matrix(base),
+              weights['title'] * title_tfidf(books.titles),
+              weights['authors'] * multi_hot(books.rich['authors'], '/'),
+              weights['publisher'] * multi_hot(books.rich['publishers']),
+              weights['num_pages'] * sparse.csr_matrix(scaled_column(books.rich['num_pages'], log=True)),
+              weights['year'] * sparse.csr_matrix(scaled_column(books.rich['year']))]
+    features = sparse.hstack(blocks, format='csr', dtype=config.dtype)
+    features.eliminate_zeros()
+    return features
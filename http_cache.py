@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+# Identity of a model for HTTP caching. Responses only depend on the
+# catalogue contents, the feature config, the kNN backend, the ranking
+# (`ranking`) and the fuzzy title matching settings (`matching`), so the tag is
+# derived from those rather than the per-process snapshot version: every
+# worker (and the async API) serving the same artifact hands out the same
+# ETags, and a CDN keeps its copies across restarts and reloads that don't
+# change the model.
+def model_tag(store, backend, ranking=None, matching=None):
+    checksum = store.manifest.get('csv_sha256')
+    if checksum is None:
+        # Not built from a published artifact; only valid in this process
+        checksum = f"{os.getpid()}-{id(store)}"
+    identity = {'csv': checksum, 'rows': len(store), 'backend': backend,
+                'features': store.manifest.get('features'), 'ranking': ranking,
+                'matching': matching}
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# Entity tag (unquoted) for a response of `route` to the given query values
+def etag_for(tag, route, *parts):
+    digest = hashlib.sha1(json.dumps([route, *parts]).encode()).hexdigest()[:16]
+    return f"{tag}-{digest}"
+
+
+# Whether an If-None-Match header value covers `etag`
+def etag_matches(header, etag):
+    if not header:
+        return False
+    for value in header.split(','):
+        value = value.strip()
+        if value.startswith('W/'):
+            value = value[2:]
+        if value == '*' or value.strip('"') == etag:
+            return True
+    return False
+
+
+# Indices of the `n` most rated books, one per distinct title
+def hot_rows(store, n):
+    popularity = np.nan_to_num(np.asarray(store.ratings_count, dtype=np.float64))
+    rows, seen = [], set()
+    for row in np.argsort(-popularity, kind='stable'):
+        title = store.titles[row]
+        if title in seen:
+            continue
+        seen.add(title)
+        rows.append(int(row))
+        if len(rows) >= n:
+            break
+    return rows
+
+
+# Serialized response bodies keyed by (route, query values), filled once
+# when a snapshot is built and only read afterwards. Belongs to a single
+# snapshot, so swapping in a new model drops it with everything else.
+class ResponseCache:
+    def __init__(self):
+        self.bodies = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def get(self, key):
+        body = self.bodies.get(key)
+        with self.lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return body
+
+    def put(self, key, body):
+        self.bodies[key] = body
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.bodies), 'hits': self.hits, 'misses': self.misses}
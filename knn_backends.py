@@ -0,0 +1,178 @@
+import numpy as np
+
+# Queries are processed in blocks so the distance matrix of the brute and
+# partitioned backends stays around QUERY_BLOCK x rows floats
+QUERY_BLOCK = 256
+
+
+# Exact search with one of scikit-learn's trees (ball_tree or kd_tree)
+class SklearnBackend:
+    def __init__(self, algorithm='ball_tree', leaf_size=30):
+        self.algorithm = algorithm
+        self.leaf_size = leaf_size
+        self.model = None
+
+    def fit(self, features):
+        from sklearn import neighbors
+
+        # Trees can't index sparse (rich) features; exact brute force over
+        # the CSR matrix is ~8x faster than scikit-learn's sparse fallback
+        if is_sparse(features):
+            self.model = BruteBackend().fit(features)
+            return self
+        self.model = neighbors.NearestNeighbors(algorithm=self.algorithm, leaf_size=self.leaf_size)
+        self.model.fit(features)
+        return self
+
+    def kneighbors(self, queries, k):
+        if isinstance(self.model, BruteBackend):
+            return self.model.kneighbors(queries, k)
+        return self.model.kneighbors(queries, n_neighbors=k)
+
+
+def is_sparse(features):
+    from scipy import sparse
+
+    return sparse.issparse(features)
+
+
+# Squared L2 norm of every row, for dense arrays and sparse matrices
+def row_norms(x):
+    if is_sparse(x):
+        return np.asarray(x.multiply(x).sum(axis=1)).ravel()
+    return np.einsum('ij,ij->i', x, x)
+
+
+# k smallest entries of every row of a distance block, sorted, stable on ties
+def smallest_k(dist, k):
+    k = min(k, dist.shape[1])
+    if k < dist.shape[1]:
+        part = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(dist.shape[1]), dist.shape).copy()
+    part_dist = np.take_along_axis(dist, part, axis=1)
+    order = np.lexsort((part, part_dist), axis=1)
+    return np.take_along_axis(part_dist, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+# Brute-force search as one matrix multiply: |q|^2 - 2 q.x + |x|^2.
+# Nearest books often differ by ~1e-6 in the scaled ratings_count, which is
+# lost to cancellation in float32, so float64 is the exact default and
+# float32 ('brute32') trades recall for half the memory traffic. Sparse
+# (rich) features stay sparse; only the distance block is dense.
+class BruteBackend:
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self.data = None
+        self.norms = None
+
+    def prepare(self, x):
+        if is_sparse(x):
+            return x.astype(self.dtype).tocsr()
+        return np.ascontiguousarray(x, dtype=self.dtype)
+
+    def fit(self, features):
+        self.data = self.prepare(features)
+        self.norms = row_norms(self.data)
+        return self
+
+    def kneighbors(self, queries, k):
+        queries = self.prepare(queries)
+        all_dist, all_idx = [], []
+        for start in range(0, queries.shape[0], QUERY_BLOCK):
+            block = queries[start:start + QUERY_BLOCK]
+            if is_sparse(self.data):
+                # sparse @ dense is far cheaper than sparse @ sparse here
+                dense = block.toarray() if is_sparse(block) else block
+                product = (self.data @ dense.T).T
+            else:
+                product = block @ self.data.T
+            dist = self.norms[None, :] - 2 * product
+            dist += row_norms(block)[:, None]
+            np.maximum(dist, 0, out=dist)
+            d, i = smallest_k(dist, k)
+            all_dist.append(np.sqrt(d))
+            all_idx.append(i)
+        return np.vstack(all_dist), np.vstack(all_idx)
+
+
+# Approximate inverted-file index: rows are partitioned around k-means
+# centroids and a query only scans the `n_probe` closest partitions, or as
+# many more of the next closest as it takes to hold k rows
+class PartitionedBackend:
+    def __init__(self, n_lists=None, n_probe=8, iterations=10, seed=0, dtype=np.float64):
+        self.dtype = dtype
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.seed = seed
+
+    def fit(self, features):
+        if is_sparse(features):
+            raise ValueError("The ivf backend needs dense features; use brute for rich features")
+        data = np.ascontiguousarray(features, dtype=self.dtype)
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(data))))
+        n_lists = min(n_lists, len(data))
+        rng = np.random.default_rng(self.seed)
+        centroids = data[rng.choice(len(data), n_lists, replace=False)].copy()
+
+        coarse = BruteBackend(self.dtype)
+        for _ in range(self.iterations):
+            assign = coarse.fit(centroids).kneighbors(data, 1)[1][:, 0]
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            counts = np.bincount(assign, minlength=n_lists)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        self.coarse = coarse.fit(centroids)
+        assign = self.coarse.kneighbors(data, 1)[1][:, 0]
+
+        # Rows grouped by partition: members of list j are order[bounds[j]:bounds[j + 1]]
+        self.order = np.argsort(assign, kind='stable').astype(np.int64)
+        self.bounds = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        self.data = data[self.order]
+        self.norms = np.einsum('ij,ij->i', self.data, self.data)
+        return self
+
+    def kneighbors(self, queries, k):
+        queries = np.ascontiguousarray(queries, dtype=self.dtype)
+        k = min(k, len(self.order))
+        sizes = np.diff(self.bounds)
+        n_probe = min(self.n_probe, len(sizes))
+        probes = self.coarse.kneighbors(queries, n_probe)[1]
+        all_dist = np.empty((len(queries), k), dtype=self.dtype)
+        all_idx = np.empty((len(queries), k), dtype=np.int64)
+        for q, lists in enumerate(probes):
+            if sizes[lists].sum() < k:
+                ranked = self.coarse.kneighbors(queries[q:q + 1], len(sizes))[1][0]
+                lists = ranked[:np.searchsorted(np.cumsum(sizes[ranked]), k) + 1]
+            members = np.concatenate([np.arange(self.bounds[j], self.bounds[j + 1]) for j in lists])
+            block = self.data[members]
+            dist = self.norms[members] - 2 * (block @ queries[q]) + queries[q] @ queries[q]
+            np.maximum(dist, 0, out=dist)
+            d, i = smallest_k(dist[None, :], k)
+            all_dist[q] = np.sqrt(d[0])
+            all_idx[q] = self.order[members[i[0]]]
+        return all_dist, all_idx
+
+
+# Backends that return the exact k nearest rows; the others (brute32, ivf)
+# are approximate
+EXACT_BACKENDS = ('ball_tree', 'kd_tree', 'brute')
+
+BACKENDS = {
+    'ball_tree': lambda **opts: SklearnBackend('ball_tree', **opts),
+    'kd_tree': lambda **opts: SklearnBackend('kd_tree', **opts),
+    'brute': BruteBackend,
+    'brute32': lambda **opts: BruteBackend(np.float32, **opts),
+    'ivf': PartitionedBackend,
+}
+
+
+# Instantiate a backend by name (see BACKENDS)
+def make_backend(name, **opts):
+    try:
+        factory = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown kNN backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return factory(**opts)
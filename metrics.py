@@ -0,0 +1,149 @@
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds: 50 microseconds (a prefix completion) up to a
+# minute (a cold model build on a large catalogue)
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Context manager observing its with-block's duration; a plain class costs
+# a fraction of a generator-based contextmanager on every timed stage
+class Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+# Monotonic counter with optional labels, e.g. counter.inc(method='fuzzy')
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+
+# Cumulative-bucket histogram in the Prometheus layout (_bucket, _sum, _count)
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per-bucket counts, then the overflow bucket, sum and count
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    # Time the body of a with-block
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        for key, counts in sorted(values.items()):
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (('le', format_value(bound)),), cumulative
+            yield f"{self.name}_sum", labels, counts[-2]
+            yield f"{self.name}_count", labels, counts[-1]
+
+
+# Metrics of this process plus collectors called at scrape time for values
+# kept elsewhere (cache counters, model version). A collector returns
+# (name, kind, help, [(labels dict, value), ...]) tuples.
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        self.collectors.append(collect)
+        return collect
+
+    # Prometheus text exposition format 0.0.4
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        for collect in self.collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(sorted(labels.items()))} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+REGISTRY = Registry()
@@ -0,0 +1,136 @@
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+from facets import FacetIndex
+from http_cache import ResponseCache, model_tag
+from rerank import Reranker
+from title_index import FUZZY_BUDGET, FUZZY_MAX_EDITS, TitleIndex, CompletionIndex
+
+# Everything a request needs, bundled so the whole model can be replaced by
+# swapping a single reference. Handlers read the current snapshot once and
+# use it for the rest of the request, so an update never mixes old and new
+# pieces mid-request. `tag` identifies the model for HTTP caching,
+# `responses` holds the pre-serialized responses for hot titles (see
+# http_cache), `reranker` orders neighbor candidates (see rerank) and
+# `facets` answers filtered recommendations (see facets).
+ModelSnapshot = collections.namedtuple(
+    'ModelSnapshot', ['store', 'title_index', 'completion_index', 'neighbor_index', 'version',
+                      'tag', 'responses', 'reranker', 'facets'])
+
+
+# Build the title and completion indexes for a store and bundle them;
+# `max_edits` and `fuzzy_budget` are the per-word typo limit and the time
+# limit of fuzzy title matching and `rerank` the RerankConfig for
+# recommendations
+def build_snapshot(store, neighbor_index, version, max_edits=FUZZY_MAX_EDITS,
+                   fuzzy_budget=FUZZY_BUDGET, rerank=None):
+    title_index = TitleIndex(store.titles, store.ratings_count, max_edits=max_edits,
+                             budget=fuzzy_budget)
+    completion_index = CompletionIndex(store.titles, store.ratings_count,
+                                       lowered=title_index.lowered)
+    reranker = Reranker(store, rerank)
+    return ModelSnapshot(store, title_index, completion_index, neighbor_index, version,
+                         model_tag(store, neighbor_index.backend_name, reranker.config.to_dict(),
+                                   {'max_edits': max_edits, 'budget': fuzzy_budget}),
+                         ResponseCache(), reranker, FacetIndex(store))
+
+
+# Build everything a snapshot creates lazily on first use (the fitted kNN
+# backend, the title and id lookup arrays), so a preforking parent can do it
+# once and share the result with its workers instead of each building a copy
+def warm_snapshot(snapshot):
+    snapshot.neighbor_index.fitted_model()
+    snapshot.store.titles_for(np.zeros(0, dtype=np.int64))
+    snapshot.store.rows_for_ids(np.zeros(0, dtype=np.int64))
+
+
+# Holds the current ModelSnapshot and replaces it atomically. Reloads run on
+# a background thread and only swap the reference once the new snapshot is
+# complete; requests that already picked up the old snapshot keep using it.
+# A failed reload leaves the current snapshot in place and is recorded in
+# status() so slow or failing rebuilds can be alerted on.
+class ModelHolder:
+    def __init__(self, loader):
+        self.loader = loader
+        self.snapshot = None
+        self.version = 0
+        # Serializes reloads and in-process catalogue updates
+        self.lock = threading.Lock()
+        self.reloading = False
+        self.reloads = 0
+        self.failures = 0
+        self.last_started = None
+        self.last_seconds = None
+        self.last_error = None
+        # Set by serve.py in worker processes: reload requests and published
+        # catalogue updates go to the parent, which reloads once and
+        # replaces every worker
+        self.delegate = None
+
+    def current(self):
+        return self.snapshot
+
+    # Publish a snapshot under the next version number. Callers hold self.lock.
+    def swap(self, snapshot):
+        self.version += 1
+        self.snapshot = snapshot._replace(version=self.version)
+        return self.snapshot
+
+    # Build a new snapshot with the loader and swap it in. Returns True on success.
+    def reload(self):
+        with self.lock:
+            self.reloading = True
+            self.last_started = time.time()
+            start = time.perf_counter()
+            try:
+                snapshot = self.loader()
+                self.swap(snapshot)
+                self.last_error = None
+                ok = True
+            except Exception as e:
+                print(f"Error reloading model: {str(e)}")
+                self.failures += 1
+                self.last_error = str(e)
+                ok = False
+            finally:
+                self.reloads += 1
+                self.last_seconds = time.perf_counter() - start
+                self.reloading = False
+        if ok:
+            print(f"Model snapshot v{self.version} loaded in {self.last_seconds:.2f}s")
+        return ok
+
+    # Start a reload on a background thread; False if one is already running
+    def reload_async(self):
+        if self.delegate is not None:
+            self.delegate()
+            return True
+        if self.reloading or self.lock.locked():
+            return False
+        threading.Thread(target=self.reload, name='model-reload', daemon=True).start()
+        return True
+
+    # Called after this process published a new artifact and swapped it in;
+    # lets the other workers of a prefork server pick it up too
+    def published(self):
+        if self.delegate is not None:
+            self.delegate()
+
+    def status(self):
+        snapshot = self.snapshot
+        return {
+            'version': self.version,
+            'books': len(snapshot.store) if snapshot else 0,
+            'artifact': os.path.basename(snapshot.store.manifest.get('path', '')) if snapshot else None,
+            'reloading': self.reloading,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'last_reload_started': self.last_started,
+            'last_reload_seconds': self.last_seconds,
+            'last_reload_error': self.last_error,
+            'pid': os.getpid(),
+        }
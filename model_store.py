@@ -0,0 +1,563 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from book_loader import (CHUNK_ROWS, MODEL_COLUMNS, RICH_COLUMNS, SERVED_COLUMNS, LoadReport,
+                         author_ids, read_book_chunks)
+from features import (FEATURE_MODES, FeatureConfig, FeatureEncoder, encode_columns,
+                      feature_config, rating_codes)
+from knn_backends import BACKENDS, is_sparse, make_backend
+
+# Bump whenever the on-disk layout or the feature pipeline changes so stale
+# artifacts are rebuilt instead of being loaded with the wrong meaning.
+ARTIFACT_VERSION = 9
+ARTIFACT_DIR = 'model_artifact'
+N_NEIGHBORS = 6
+# Columnar cache of the parsed CSV, kept inside the artifact directory and
+# reused by rebuilds until the CSV changes
+TABLE_CACHE = 'books'
+TABLE_VERSION = 3
+
+
+# SHA-256 of the source CSV, used to detect when the artifact is stale
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Size and mtime of a file, checked before falling back to the checksum
+def file_stamp(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+# Whether a CSV still matches the stamp and checksum recorded when a cache
+# was built from it. The file is only hashed (unless its `current` checksum
+# is passed in) when size or mtime differ, so an untouched CSV is never
+# re-read; a copied or touched one still matches.
+def source_unchanged(csv_path, stamp, checksum, current=None):
+    if stamp is not None and stamp == file_stamp(csv_path):
+        return True
+    return checksum == (current or file_checksum(csv_path))
+
+
+# The catalogue columns a store is built from, read chunk by chunk
+class BookColumns:
+    def __init__(self, titles, book_ids, average_rating, ratings_count,
+                 rating_codes, language_codes, languages, report, num_pages, year, author_ids,
+                 rich=None):
+        self.titles = titles
+        self.book_ids = book_ids
+        self.average_rating = average_rating
+        self.ratings_count = ratings_count
+        # Bucket index into features.RATING_LABELS (-1 outside 0-5) and language
+        # index into `languages` (-1 when missing), one small int per book
+        self.rating_codes = rating_codes
+        self.language_codes = language_codes
+        self.languages = languages
+        self.report = report
+        # Page count and publication year, NaN when unknown
+        self.num_pages = num_pages
+        self.year = year
+        # book_loader.author_ids of the first author, 0 when unknown
+        self.author_ids = author_ids
+        # Columns for the 'rich' feature mode when they were loaded:
+        # authors and publishers (strings), num_pages and year
+        self.rich = rich
+
+    def __len__(self):
+        return len(self.titles)
+
+
+# Stream the CSV and reduce every chunk to the compact per-book columns the
+# features are built from, so only one chunk is ever held as a DataFrame.
+# With rich=True the columns of the 'rich' feature mode are loaded as well.
+def load_books(csv_path, chunksize=CHUNK_ROWS, rich=False):
+    import pandas as pd
+
+    report = LoadReport()
+    titles, ids, ratings, counts, bucket_codes, language_codes = [], [], [], [], [], []
+    languages = {}
+    num_pages, years, authors = [], [], []
+    extra = {'authors': [], 'publishers': []}
+    columns = MODEL_COLUMNS + (RICH_COLUMNS if rich else SERVED_COLUMNS)
+    for chunk in read_book_chunks(csv_path, columns, chunksize=chunksize, report=report):
+        start = len(titles)
+        titles.extend(chunk['title'].tolist())
+        ids.append(chunk['bookID'].to_numpy(dtype=np.int64) if 'bookID' in chunk.columns
+                   else np.arange(start, start + len(chunk), dtype=np.int64))
+        rating = chunk['average_rating'].to_numpy(dtype=np.float64)
+        ratings.append(rating)
+        counts.append(chunk['ratings_count'].to_numpy(dtype=np.float64))
+
+        bucket_codes.append(rating_codes(rating))
+
+        # Map this chunk's categories onto the catalogue-wide vocabulary
+        language = chunk['language_code']
+        lookup = np.array([languages.setdefault(c, len(languages)) for c in language.cat.categories]
+                          + [-1], dtype=np.int32)
+        language_codes.append(lookup[language.cat.codes.to_numpy()])
+
+        num_pages.append(chunk['num_pages'].to_numpy(dtype=np.float64)
+                         if 'num_pages' in chunk.columns else np.full(len(chunk), np.nan))
+        year = (chunk['publication_date'].str.extract(r'(\d{4})', expand=False)
+                if 'publication_date' in chunk.columns else pd.Series(np.nan, index=chunk.index))
+        years.append(pd.to_numeric(year, errors='coerce').to_numpy(dtype=np.float64))
+        authors.append(author_ids(chunk['authors'] if 'authors' in chunk.columns
+                                  else [None] * len(chunk)))
+        if rich:
+            for name, column in (('authors', 'authors'), ('publishers', 'publisher')):
+                values = chunk[column] if column in chunk.columns else [None] * len(chunk)
+                extra[name].extend('' if pd.isna(v) else str(v) for v in values)
+
+    if report.rejected:
+        print(f"Rejected {report.rejected} lines of {csv_path}, e.g. {report.samples[:3]}")
+    num_pages, years = np.concatenate(num_pages), np.concatenate(years)
+    return BookColumns(titles, np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64),
+                       np.concatenate(ratings), np.concatenate(counts),
+                       np.concatenate(bucket_codes), np.concatenate(language_codes),
+                       list(languages), report, num_pages, years,
+                       np.concatenate(authors) if authors else np.zeros(0, dtype=np.int64),
+                       rich=dict(extra, num_pages=num_pages, year=years) if rich else None)
+
+
+# Save BookColumns as one .npy file per column plus meta.json recording the
+# source CSV's stamp and checksum. Written under a temporary name and
+# renamed into place.
+def write_table_cache(books, cache_dir, csv_path, checksum, stamp):
+    tmp_dir = f"{cache_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    title_buffer, title_offsets = pack_strings(books.titles)
+    columns = {'title_buffer': title_buffer, 'title_offsets': title_offsets,
+               'book_ids': books.book_ids, 'average_rating': books.average_rating,
+               'ratings_count': books.ratings_count, 'rating_codes': books.rating_codes,
+               'language_codes': books.language_codes, 'num_pages': books.num_pages,
+               'year': books.year, 'author_ids': books.author_ids}
+    if books.rich is not None:
+        for name in ('authors', 'publishers'):
+            columns[f'{name}_buffer'], columns[f'{name}_offsets'] = pack_strings(books.rich[name])
+    for name, column in columns.items():
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), np.ascontiguousarray(column))
+    meta = {'version': TABLE_VERSION, 'csv_path': os.path.abspath(csv_path),
+            'csv_sha256': checksum, 'csv_stamp': stamp, 'rich': books.rich is not None,
+            'languages': books.languages, 'load_report': books.report.to_dict()}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(tmp_dir, cache_dir)
+
+
+# BookColumns from the table cache, memory-mapped, or None when there is no
+# cache, it was built from a different CSV, or it lacks the rich columns
+def read_table_cache(cache_dir, csv_path, checksum=None, rich=False):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get('version') != TABLE_VERSION or (rich and not meta.get('rich')):
+        return None
+    if not source_unchanged(csv_path, meta.get('csv_stamp'), meta.get('csv_sha256'), checksum):
+        return None
+
+    def load(name):
+        return np.load(os.path.join(cache_dir, f'{name}.npy'), mmap_mode='r')
+
+    report = LoadReport()
+    report.rows, report.rejected, report.samples = (meta['load_report'][key]
+                                                    for key in ('rows', 'rejected', 'samples'))
+    num_pages, year = load('num_pages'), load('year')
+    extra = None
+    if rich:
+        extra = {name: unpack_strings(load(f'{name}_buffer'), load(f'{name}_offsets'))
+                 for name in ('authors', 'publishers')}
+        extra.update(num_pages=num_pages, year=year)
+    return BookColumns(unpack_strings(load('title_buffer'), load('title_offsets')),
+                       load('book_ids'), load('average_rating'), load('ratings_count'),
+                       load('rating_codes'), load('language_codes'), meta['languages'], report,
+                       num_pages, year, load('author_ids'), rich=extra)
+
+
+# load_books through the table cache in `cache_dir`: parse the CSV only when
+# the cache is missing or stale, and refresh the cache afterwards. Pass the
+# CSV's checksum if it is already known to avoid hashing it again.
+def load_books_cached(csv_path, cache_dir, checksum=None, rich=False):
+    start = time.perf_counter()
+    books = read_table_cache(cache_dir, csv_path, checksum, rich)
+    if books is not None:
+        print(f"Loaded {len(books)} books from {cache_dir} in {time.perf_counter() - start:.2f}s")
+        return books
+    stamp = file_stamp(csv_path)
+    checksum = checksum or file_checksum(csv_path)
+    books = load_books(csv_path, rich=rich)
+    write_table_cache(books, cache_dir, csv_path, checksum, stamp)
+    print(f"Parsed {len(books)} books from {csv_path} in {time.perf_counter() - start:.2f}s")
+    return books
+
+
+# Fit the kNN backend and query every book against it
+def compute_neighbors(features, n_neighbors=N_NEIGHBORS, backend='ball_tree'):
+    model = make_backend(backend).fit(features)
+    dist, idlist = model.kneighbors(features, min(n_neighbors, features.shape[0]))
+    return idlist
+
+
+# Pack strings into one UTF-8 buffer plus an offsets array so they can be
+# stored as flat files and memory-mapped
+def pack_strings(strings):
+    encoded = [s.encode('utf-8') if isinstance(s, str) else b'' for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_strings(buffer, offsets):
+    data = bytes(buffer)
+    bounds = offsets.tolist()
+    return [data[start:end].decode('utf-8') for start, end in zip(bounds, bounds[1:])]
+
+
+# Whether an array is (a view of) a memory map; scipy wraps the mapped
+# CSR arrays of rich features in views
+def is_mapped(array):
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+# Per-book columns recommendation filters test (see facets): the language
+# as an index into the `languages` list (-1 when missing), and the average
+# rating, page count and publication year (NaN when unknown)
+FACET_ARRAYS = ('language_code', 'average_rating', 'num_pages', 'year')
+
+
+def facet_columns(books):
+    return {'languages': list(books.languages),
+            'language_code': np.asarray(books.language_codes, dtype=np.int16),
+            'average_rating': np.asarray(books.average_rating, dtype=np.float32),
+            'num_pages': np.asarray(books.num_pages, dtype=np.float32),
+            'year': np.asarray(books.year, dtype=np.float32)}
+
+
+# Compact in-memory recommendation store: one title list, an int32 neighbor
+# matrix and only the columns that are actually served. Array members are
+# usually read-only memory maps of the artifact files.
+class BookStore:
+    def __init__(self, titles, neighbors, ratings_count, features=None, manifest=None,
+                 book_ids=None, encoder=None, facets=None, author_ids=None):
+        self.titles = titles
+        self.neighbors = neighbors
+        self.ratings_count = ratings_count
+        self.features = features
+        self.manifest = manifest or {}
+        self.book_ids = book_ids if book_ids is not None else np.arange(len(titles))
+        self.encoder = encoder
+        # facet_columns() layout, None for stores without filter columns
+        self.facets = facets
+        # First-author ids (see book_loader.author_ids), None if not stored
+        self.author_ids = author_ids
+        self.title_array = None
+        self.id_order = None
+
+    def __len__(self):
+        return len(self.titles)
+
+    # Titles for an array of row ids, gathered with a single take
+    def titles_for(self, rows):
+        if self.title_array is None:
+            self.title_array = np.array(self.titles, dtype=object)
+        return self.title_array.take(rows).tolist()
+
+    # Rows for an array of bookIDs (-1 where unknown), via one searchsorted
+    def rows_for_ids(self, ids):
+        if self.id_order is None:
+            self.id_order = np.argsort(self.book_ids, kind='stable')
+        ids = np.asarray(ids, dtype=np.int64)
+        sorted_ids = self.book_ids[self.id_order]
+        if len(sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[pos] == ids, self.id_order[pos], -1)
+
+    # Bytes held per component. Memory-mapped arrays are backed by the page
+    # cache and shared between workers; everything else is private.
+    def memory_footprint(self):
+        private, shared = {}, {}
+        arrays = {name: getattr(self, name)
+                  for name in ('neighbors', 'ratings_count', 'book_ids', 'author_ids')}
+        if self.facets is not None:
+            arrays.update({f'facet_{name}': self.facets[name] for name in FACET_ARRAYS})
+        if is_sparse(self.features):
+            arrays.update({f'features_{part}': getattr(self.features, part)
+                           for part in ('data', 'indices', 'indptr')})
+        else:
+            arrays['features'] = self.features
+        for name, array in arrays.items():
+            if array is None:
+                continue
+            target = shared if is_mapped(array) else private
+            target[name] = array.nbytes
+        private['titles'] = sys.getsizeof(self.titles) + sum(sys.getsizeof(t) for t in self.titles)
+        return private, shared
+
+
+# Run the full pipeline on a CSV and return an in-memory BookStore, reading
+# the CSV through the table cache in `cache_dir` when one is given.
+# With n_neighbors=0 the all-books neighbor table is skipped and neighbors
+# are queried on demand at serve time.
+def build_store(csv_path, n_neighbors=N_NEIGHBORS, backend='ball_tree', cache_dir=None,
+                checksum=None, config=None):
+    rich = config is not None and config.rich
+    if cache_dir:
+        books = load_books_cached(csv_path, cache_dir, checksum, rich)
+    else:
+        books = load_books(csv_path, rich=rich)
+    features, encoder = encode_columns(books, config)
+    idlist = compute_neighbors(features, n_neighbors, backend) if n_neighbors else None
+    return BookStore(titles=books.titles,
+                     neighbors=None if idlist is None else idlist.astype(np.int32),
+                     ratings_count=books.ratings_count.astype(np.float32),
+                     features=features,
+                     manifest={'n_neighbors': n_neighbors, 'knn_backend': backend,
+                               'load_report': books.report.to_dict()},
+                     book_ids=books.book_ids,
+                     encoder=encoder,
+                     facets=facet_columns(books),
+                     author_ids=books.author_ids)
+
+
+# Write a store as a new versioned artifact for the CSV with `checksum`.
+# The artifact directory is written under a temporary name, renamed into
+# place and only then published through the CURRENT pointer, so readers
+# never see a half-written artifact.
+def write_artifact(store, csv_path, checksum, artifact_dir=ARTIFACT_DIR, stamp=None):
+    os.makedirs(artifact_dir, exist_ok=True)
+    name = f"v{ARTIFACT_VERSION}-{checksum[:16]}-{int(time.time())}-{os.getpid()}"
+    tmp_dir = os.path.join(artifact_dir, f".{name}.tmp-{os.getpid()}")
+    os.makedirs(tmp_dir)
+
+    title_buffer, title_offsets = pack_strings(store.titles)
+    if is_sparse(store.features):
+        # Rich features: the three CSR arrays, each memory-mappable
+        for part in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(tmp_dir, f'features_{part}.npy'), getattr(store.features, part))
+    else:
+        np.save(os.path.join(tmp_dir, 'features.npy'), np.ascontiguousarray(store.features))
+    if store.neighbors is not None:
+        np.save(os.path.join(tmp_dir, 'neighbors.npy'),
+                np.ascontiguousarray(store.neighbors, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, 'title_buffer.npy'), title_buffer)
+    np.save(os.path.join(tmp_dir, 'title_offsets.npy'), title_offsets)
+    np.save(os.path.join(tmp_dir, 'ratings_count.npy'), np.asarray(store.ratings_count, dtype=np.float32))
+    np.save(os.path.join(tmp_dir, 'book_ids.npy'), np.asarray(store.book_ids, dtype=np.int64))
+    if store.author_ids is not None:
+        np.save(os.path.join(tmp_dir, 'author_ids.npy'), np.asarray(store.author_ids, dtype=np.int64))
+    if store.facets is not None:
+        for column in FACET_ARRAYS:
+            np.save(os.path.join(tmp_dir, f'facet_{column}.npy'), np.ascontiguousarray(store.facets[column]))
+    with open(os.path.join(tmp_dir, 'encoder.json'), 'w') as f:
+        json.dump(store.encoder.to_dict(), f)
+    manifest = {
+        'version': ARTIFACT_VERSION,
+        'csv_path': os.path.abspath(csv_path),
+        'csv_sha256': checksum,
+        'csv_stamp': stamp or file_stamp(csv_path),
+        'rows': len(store),
+        'feature_shape': list(store.features.shape),
+        'n_neighbors': 0 if store.neighbors is None else store.neighbors.shape[1],
+        'knn_backend': store.manifest.get('knn_backend', 'ball_tree'),
+        'features': store.encoder.config.to_dict(),
+        'load_report': store.manifest.get('load_report'),
+        'facet_languages': None if store.facets is None else store.facets['languages'],
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.rename(tmp_dir, os.path.join(artifact_dir, name))
+    pointer_tmp = os.path.join(artifact_dir, f".CURRENT.tmp-{os.getpid()}")
+    with open(pointer_tmp, 'w') as f:
+        f.write(name)
+    os.replace(pointer_tmp, os.path.join(artifact_dir, 'CURRENT'))
+
+    # Older artifacts are no longer referenced; processes that still have
+    # them mapped keep their pages until they exit
+    for entry in os.listdir(artifact_dir):
+        if entry not in (name, 'CURRENT', TABLE_CACHE) and not entry.startswith('.'):
+            shutil.rmtree(os.path.join(artifact_dir, entry), ignore_errors=True)
+    return os.path.join(artifact_dir, name)
+
+
+# Build a store from the CSV and publish it as the current artifact
+def build_artifact(csv_path, artifact_dir=ARTIFACT_DIR, n_neighbors=N_NEIGHBORS,
+                   backend='ball_tree', config=None):
+    start = time.perf_counter()
+    # Stamp before hashing so a CSV edited during the build looks stale
+    stamp = file_stamp(csv_path)
+    checksum = file_checksum(csv_path)
+    store = build_store(csv_path, n_neighbors, backend,
+                        cache_dir=os.path.join(artifact_dir, TABLE_CACHE), checksum=checksum,
+                        config=config)
+    path = write_artifact(store, csv_path, checksum, artifact_dir, stamp)
+    print(f"Built model artifact {os.path.basename(path)} ({len(store)} books) "
+          f"in {time.perf_counter() - start:.2f}s")
+    return path
+
+
+# Path of the published artifact, or None if nothing has been built yet
+def current_artifact(artifact_dir=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(artifact_dir, 'CURRENT')) as f:
+            path = os.path.join(artifact_dir, f.read().strip())
+    except FileNotFoundError:
+        return None
+    return path if os.path.isdir(path) else None
+
+
+def read_manifest(path):
+    with open(os.path.join(path, 'manifest.json')) as f:
+        return json.load(f)
+
+
+# Memory-map an artifact. Arrays are opened read-only so every worker
+# shares the same page-cache pages instead of holding a private copy.
+def load_artifact(path):
+    manifest = read_manifest(path)
+    manifest['path'] = path
+    if manifest.get('version') != ARTIFACT_VERSION:
+        raise ValueError(f"Artifact version {manifest.get('version')} != {ARTIFACT_VERSION}")
+
+    def load(name):
+        return np.load(os.path.join(path, name), mmap_mode='r')
+
+    has_table = os.path.exists(os.path.join(path, 'neighbors.npy'))
+    has_authors = os.path.exists(os.path.join(path, 'author_ids.npy'))
+    if os.path.exists(os.path.join(path, 'features_indptr.npy')):
+        from scipy import sparse
+
+        features = sparse.csr_matrix((load('features_data.npy'), load('features_indices.npy'),
+                                      load('features_indptr.npy')),
+                                     shape=tuple(manifest['feature_shape']), copy=False)
+    else:
+        features = load('features.npy')
+    with open(os.path.join(path, 'encoder.json')) as f:
+        encoder = json.load(f)
+    facets = None
+    if manifest.get('facet_languages') is not None:
+        facets = {name: load(f'facet_{name}.npy') for name in FACET_ARRAYS}
+        facets['languages'] = manifest['facet_languages']
+
+    return BookStore(titles=unpack_strings(load('title_buffer.npy'), load('title_offsets.npy')),
+                     neighbors=load('neighbors.npy') if has_table else None,
+                     ratings_count=load('ratings_count.npy'),
+                     book_ids=load('book_ids.npy'),
+                     encoder=FeatureEncoder.from_dict(encoder),
+                     features=features,
+                     manifest=manifest,
+                     facets=facets,
+                     author_ids=load('author_ids.npy') if has_authors else None)
+
+
+# Cross-process build lock (O_EXCL lock file) so workers starting together
+# don't all rebuild at once. A lock older than `stale_after` is assumed to
+# belong to a crashed build and is taken over.
+@contextlib.contextmanager
+def build_lock(artifact_dir, timeout=600, stale_after=600):
+    os.makedirs(artifact_dir, exist_ok=True)
+    lock_path = os.path.join(artifact_dir, '.build.lock')
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_after:
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"Timed out waiting for {lock_path}")
+            time.sleep(0.2)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(lock_path)
+
+
+# Why the published artifact can't be used for this CSV (and feature
+# config, when one is given), or None if it can
+def stale_reason(path, csv_path, config=None):
+    if path is None:
+        return "no artifact found"
+    manifest = read_manifest(path)
+    if manifest.get('version') != ARTIFACT_VERSION:
+        return f"artifact version {manifest.get('version')} is outdated"
+    if not source_unchanged(csv_path, manifest.get('csv_stamp'), manifest.get('csv_sha256')):
+        return f"{csv_path} changed since the artifact was built"
+    if config is not None and FeatureConfig.from_dict(manifest.get('features')) != config:
+        return f"artifact was built with different features than {config}"
+    return None
+
+
+# Load the published artifact, rebuilding it first when it is missing,
+# from an older format, or built from a CSV with a different checksum or
+# with other features than `config`. Without a config the artifact's own
+# feature config is kept. Rebuilds triggered here skip the neighbor table
+# unless n_neighbors is set.
+def load_or_build(csv_path, artifact_dir=ARTIFACT_DIR, n_neighbors=0, config=None):
+    path = current_artifact(artifact_dir)
+    if stale_reason(path, csv_path, config) is not None:
+        with build_lock(artifact_dir):
+            # Another process may have finished the rebuild while we waited
+            return load_or_build_locked(csv_path, artifact_dir, n_neighbors, config)
+    print(f"Using model artifact {os.path.basename(path)}")
+    return load_artifact(path)
+
+
+# load_or_build for callers that already hold build_lock(artifact_dir),
+# which is not reentrant
+def load_or_build_locked(csv_path, artifact_dir=ARTIFACT_DIR, n_neighbors=0, config=None):
+    path = current_artifact(artifact_dir)
+    reason = stale_reason(path, csv_path, config)
+    if reason is not None:
+        print(f"Rebuilding model artifact: {reason}")
+        if config is None and path is not None:
+            config = FeatureConfig.from_dict(read_manifest(path).get('features'))
+        path = build_artifact(csv_path, artifact_dir, n_neighbors, config=config)
+    print(f"Using model artifact {os.path.basename(path)}")
+    return load_artifact(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the book recommendation model artifact")
+    parser.add_argument('--csv', default='books1.csv', help="source catalogue CSV")
+    parser.add_argument('--out', default=ARTIFACT_DIR, help="artifact directory")
+    parser.add_argument('--neighbors', type=int, default=N_NEIGHBORS,
+                        help="width of the precomputed neighbor table (0 to skip it)")
+    parser.add_argument('--backend', default='ball_tree', choices=sorted(BACKENDS),
+                        help="kNN backend used for the neighbor table")
+    parser.add_argument('--features', default='compat', choices=sorted(FEATURE_MODES),
+                        help="feature mode: compat (float64, original results) or fast (float32)")
+    parser.add_argument('--weights', default=None,
+                        help="feature group weights, e.g. ratings_count=2,language=0.5")
+    args = parser.parse_args()
+    build_artifact(args.csv, args.out, args.neighbors, args.backend,
+                   feature_config(args.features, args.weights))
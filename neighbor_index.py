@@ -0,0 +1,179 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from knn_backends import BACKENDS, EXACT_BACKENDS, make_backend
+
+DEFAULT_CACHE_SIZE = 4096
+# Books inserted or changed since the backend was fitted are searched by
+# brute force; past this many the backend is refitted instead
+MAX_DELTA_ROWS = 1000
+
+
+# Thread-safe bounded LRU cache with hit/miss/eviction counters
+class LRUCache:
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    # Membership without touching the LRU order or the counters
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.data), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+# Drop the query row from a neighbor list and keep the first k. Identical
+# feature vectors can put another row ahead of the query itself, so the
+# row is removed wherever it appears instead of assuming position 0.
+def without_self(row, candidates, k):
+    candidates = np.asarray(candidates)
+    return candidates[candidates != row][:k]
+
+
+# Neighbor lookups for any k. Served from the precomputed table in the
+# store when it is wide enough, otherwise the kNN backend (see
+# knn_backends, fitted on first use) is queried on demand and the result
+# kept in an LRU cache keyed by (row, k). A table built by an approximate
+# backend (manifest knn_backend) is only used when that backend is the
+# configured one, so an ivf table is never served as exact neighbors.
+#
+# After incremental catalogue updates (see with_store) the fitted backend
+# still covers the first `base_size` rows as they were at fit time. Rows in
+# `delta_rows` (inserted, or changed since the fit) are searched by brute
+# force and merged in, and their stale copies in the backend are skipped.
+class NeighborIndex:
+    def __init__(self, store, cache_size=DEFAULT_CACHE_SIZE, backend='ball_tree',
+                 model=None, base_size=0, delta_rows=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown kNN backend {backend!r}, expected one of {sorted(BACKENDS)}")
+        self.store = store
+        self.cache = LRUCache(cache_size)
+        self.backend_name = backend
+        self.model = model
+        self.base_size = base_size
+        self.delta_rows = np.asarray(delta_rows if delta_rows is not None else [], dtype=np.int64)
+        self.delta_model = None
+        if len(self.delta_rows):
+            self.delta_model = make_backend('brute').fit(self.store.features[self.delta_rows])
+        self.fit_lock = threading.Lock()
+        table_backend = store.manifest.get('knn_backend', 'ball_tree')
+        self.trust_table = table_backend in EXACT_BACKENDS or table_backend == backend
+
+    def fitted_model(self):
+        if self.model is None:
+            with self.fit_lock:
+                if self.model is None:
+                    self.base_size = len(self.store)
+                    self.model = make_backend(self.backend_name).fit(self.store.features)
+        return self.model
+
+    # Neighbor row ids (closest first) for a block of feature vectors
+    def query(self, queries, k):
+        k = min(k, len(self.store))
+        model = self.fitted_model()
+        if self.delta_model is None:
+            return model.kneighbors(queries, k)[1]
+
+        # Over-fetch from the backend so skipping stale rows still leaves k
+        stale = self.delta_rows[self.delta_rows < self.base_size]
+        base_dist, base_idx = model.kneighbors(queries, min(k + len(stale), self.base_size))
+        base_dist = np.where(np.isin(base_idx, stale), np.inf, base_dist)
+        delta_dist, delta_idx = self.delta_model.kneighbors(queries, min(k, len(self.delta_rows)))
+
+        dist = np.hstack([base_dist, delta_dist])
+        idx = np.hstack([base_idx, self.delta_rows[delta_idx]])
+        order = np.lexsort((idx, dist), axis=1)[:, :k]
+        return np.take_along_axis(idx, order, axis=1)
+
+    # A new index over an updated store in which `changed_rows` were inserted
+    # or modified. The fitted backend is shared and the changed rows join the
+    # brute-force delta; once the delta grows too large the backend is refitted.
+    # The result cache starts empty since any cached list may be outdated.
+    def with_store(self, store, changed_rows):
+        if self.model is None:
+            return NeighborIndex(store, self.cache.maxsize, self.backend_name)
+        delta = np.union1d(self.delta_rows, np.asarray(changed_rows, dtype=np.int64))
+        if len(delta) > MAX_DELTA_ROWS:
+            index = NeighborIndex(store, self.cache.maxsize, self.backend_name)
+            index.fitted_model()
+            return index
+        return NeighborIndex(store, self.cache.maxsize, self.backend_name,
+                             model=self.model, base_size=self.base_size, delta_rows=delta)
+
+    # Whether the precomputed table can answer a k-neighbor query on its own
+    def precomputed(self, k):
+        table = self.store.neighbors
+        return self.trust_table and table is not None and table.shape[1] >= k + 1
+
+    # Whether neighbors(row, k) is answered without querying the backend
+    def cached(self, row, k):
+        return self.precomputed(k) or (row, k) in self.cache
+
+    # The k nearest other books for a row, closest first, as int32 row ids
+    def neighbors(self, row, k):
+        if self.precomputed(k):
+            return without_self(row, self.store.neighbors[row], k)
+
+        key = (row, k)
+        result = self.cache.get(key)
+        if result is None:
+            rows = self.query(self.store.features[row:row + 1], k + 1)[0]
+            result = without_self(row, rows, k).astype(np.int32)
+            result.setflags(write=False)
+            self.cache.put(key, result)
+        return result
+
+    # Neighbors for many rows at once: table rows and cache hits are served
+    # directly, all remaining rows go to the tree in a single kneighbors call
+    def neighbors_batch(self, rows, k):
+        rows = [int(row) for row in rows]
+        if self.precomputed(k):
+            table = self.store.neighbors[rows]
+            return [without_self(row, table[i], k) for i, row in enumerate(rows)]
+
+        results = [self.cache.get((row, k)) for row in rows]
+        missing = sorted({row for row, result in zip(rows, results) if result is None})
+        if missing:
+            found = self.query(self.store.features[missing], k + 1)
+            computed = {}
+            for row, candidates in zip(missing, found):
+                result = without_self(row, candidates, k).astype(np.int32)
+                result.setflags(write=False)
+                self.cache.put((row, k), result)
+                computed[row] = result
+            results = [computed[row] if result is None else result
+                       for row, result in zip(rows, results)]
+        return results
@@ -0,0 +1,174 @@
+# Offline neighbor table build: computes the top-k neighbors of every book
+# in the published artifact on all cores and adds them to the artifact as
+# its neighbors.npy, so the web processes only memory-map the table.
+#
+#   python precompute.py                           # every core, 50,000-row shards
+#   python precompute.py --k 40 --workers 16 --shard-rows 100000
+#
+# --k defaults to the neighbors the server fetches for the default k of 5:
+# RERANK_OVERFETCH x 5 (20), or 5 with RERANK=0.
+# The kNN backend is fitted once and the worker processes are forked from
+# it. Each worker queries one shard of rows and saves its block of the
+# table under <artifact>/.precompute-<backend>-k<k>/ before reporting back,
+# so an interrupted run picks up where it stopped: rerun the same command
+# and finished shards are skipped. When every shard is in, they are merged
+# into neighbors.npy and the manifest is updated; running servers pick the
+# table up on their next reload (SIGHUP or /admin/reload).
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+
+from knn_backends import BACKENDS
+from model_store import ARTIFACT_DIR, build_lock, current_artifact, load_artifact, load_or_build
+from neighbor_index import NeighborIndex
+from rerank import RerankConfig
+
+SHARD_ROWS = 50000
+DEFAULT_K = 5
+
+# The fitted index, set in the parent before the workers are forked (or by
+# init_worker where processes can't be forked)
+index = None
+
+
+def init_worker(path, backend):
+    global index
+    if index is None:
+        index = NeighborIndex(load_artifact(path), cache_size=0, backend=backend)
+        index.fitted_model()
+
+
+# Query rows [start, end) and save them as one shard of the table
+def compute_shard(shard_dir, k, shard):
+    start, end = shard
+    rows = index.query(index.store.features[start:end], k + 1).astype(np.int32)
+    path = shard_path(shard_dir, start, end)
+    tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+    np.save(tmp_path, rows)
+    os.replace(tmp_path, path)
+    return start, end
+
+
+def shard_path(shard_dir, start, end):
+    return os.path.join(shard_dir, f"rows-{start:010d}-{end:010d}.npy")
+
+
+# Shards of the row range still missing from shard_dir
+def pending_shards(shard_dir, n, shard_rows):
+    shards = [(start, min(start + shard_rows, n)) for start in range(0, n, shard_rows)]
+    return [(start, end) for start, end in shards if not os.path.exists(shard_path(shard_dir, start, end))]
+
+
+# Copy the shards into neighbors.npy and update the manifest. Fails if the
+# artifact was replaced (e.g. by a catalogue update) while shards were built.
+def merge_shards(path, shard_dir, n, k, shard_rows, backend, artifact_dir):
+    with build_lock(artifact_dir):
+        if current_artifact(artifact_dir) != path:
+            raise RuntimeError(f"{os.path.basename(path)} was replaced while the table was "
+                               f"computed; run precompute.py again for the new artifact")
+        tmp_path = os.path.join(path, f".neighbors.tmp-{os.getpid()}.npy")
+        table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int32, shape=(n, k + 1))
+        for start in range(0, n, shard_rows):
+            end = min(start + shard_rows, n)
+            table[start:end] = np.load(shard_path(shard_dir, start, end))
+        table.flush()
+        del table
+        os.replace(tmp_path, os.path.join(path, 'neighbors.npy'))
+
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        manifest.update(n_neighbors=k + 1, knn_backend=backend)
+        manifest_tmp = os.path.join(path, f".manifest.tmp-{os.getpid()}")
+        with open(manifest_tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_tmp, os.path.join(path, 'manifest.json'))
+    shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+def precompute(csv_path, k, workers=None, shard_rows=SHARD_ROWS, backend='ball_tree',
+               artifact_dir=ARTIFACT_DIR):
+    global index
+    start_time = time.perf_counter()
+    store = load_or_build(csv_path, artifact_dir)
+    path = store.manifest['path']
+    n = len(store)
+    k = min(k, n - 1)
+    shard_dir = os.path.join(path, f".precompute-{backend}-k{k}")
+    os.makedirs(shard_dir, exist_ok=True)
+    pending = pending_shards(shard_dir, n, shard_rows)
+    total_shards = -(-n // shard_rows)
+    if len(pending) < total_shards:
+        print(f"Resuming: {total_shards - len(pending)} of {total_shards} shards already computed")
+
+    if pending:
+        index = NeighborIndex(store, cache_size=0, backend=backend)
+        fit_start = time.perf_counter()
+        index.fitted_model()
+        print(f"Fitted {backend} on {n} books in {time.perf_counter() - fit_start:.1f}s")
+
+        workers = workers or os.cpu_count() or 1
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        pending_rows = sum(end - start for start, end in pending)
+        print(f"Computing {k} neighbors for {pending_rows} books in {len(pending)} shards "
+              f"on {workers} workers...")
+        query_start = time.perf_counter()
+        done_rows = 0
+        pool = context.Pool(workers, initializer=init_worker, initargs=(path, backend))
+        try:
+            shards = pool.imap_unordered(functools.partial(compute_shard, shard_dir, k), pending)
+            for done, (start, end) in enumerate(shards, start=1):
+                done_rows += end - start
+                rate = done_rows / (time.perf_counter() - query_start)
+                print(f"  {done}/{len(pending)} shards, {done_rows}/{pending_rows} books, "
+                      f"{rate:.0f} books/s, ETA {(pending_rows - done_rows) / rate:.0f}s", flush=True)
+            pool.close()
+        except BaseException:
+            # Shards being written are discarded; saved ones are complete
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        index = None
+
+    merge_shards(path, shard_dir, n, k, shard_rows, backend, artifact_dir)
+    print(f"Wrote a {n} x {k + 1} neighbor table to {os.path.basename(path)} "
+          f"in {time.perf_counter() - start_time:.1f}s")
+    return path
+
+
+# Neighbors the server looks up for DEFAULT_K recommendations, read from the
+# same environment variables as app.py
+def default_k():
+    config = RerankConfig(enabled=os.environ.get('RERANK', '1') == '1',
+                          overfetch=int(os.environ.get('RERANK_OVERFETCH', '4')))
+    return DEFAULT_K * config.overfetch if config.enabled else DEFAULT_K
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the neighbor table of the model artifact")
+    parser.add_argument('--csv', default='books1.csv', help="source catalogue CSV")
+    parser.add_argument('--out', default=ARTIFACT_DIR, help="artifact directory")
+    parser.add_argument('--k', type=int, default=default_k(),
+                        help="neighbors per book, not counting the book itself "
+                             "(default: RERANK_OVERFETCH x 5)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--shard-rows', type=int, default=SHARD_ROWS, help="books per shard")
+    parser.add_argument('--backend', default='ball_tree', choices=sorted(BACKENDS),
+                        help="kNN backend used for the table")
+    args = parser.parse_args()
+    try:
+        precompute(args.csv, args.k, args.workers, args.shard_rows, args.backend, args.out)
+    except KeyboardInterrupt:
+        print("Interrupted; finished shards are kept, run the same command to resume")
+        raise SystemExit(130)
+
+
+if __name__ == '__main__':
+    main()
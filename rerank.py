@@ -0,0 +1,159 @@
+# Re-ranking of kNN candidates. The neighbor index is asked for `overfetch`
+# times as many neighbors as requested; the candidates are then
+#   - deduplicated by work: editions by the same first author whose titles
+#     only differ in case, punctuation or a parenthesized series/edition
+#     note, and editions of the query book itself, are dropped (kept at the
+#     end if too few remain)
+#   - scored by relevance: closeness to the query in feature space, blended
+#     with popularity (log ratings_count) by the `popularity` weight
+#   - picked greedily by maximal marginal relevance: each pick maximizes
+#     (1 - diversity) * relevance - diversity * (similarity to the closest
+#     book already picked), so near-identical books don't fill the list
+# Distances come from dot products against the candidate block (sparse
+# features stay sparse), and MMR computes one row of similarities per pick,
+# so a call never materializes a candidates x candidates x features tensor.
+# Once a call has spent `budget` seconds, checked before MMR and after every
+# pick, the remaining slots are filled in relevance order.
+import re
+import time
+
+import numpy as np
+
+PARENTHESIZED = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+NON_WORD = re.compile(r'[\W_]+')
+
+
+# Dot products of the rows of a (sparse or dense) block with one of its rows
+def dot(block, row):
+    if hasattr(block, 'multiply'):
+        return (block @ row.T).toarray().ravel()
+    return block @ row
+
+
+# Key shared by editions of the same work: lowercase title without
+# parenthesized notes ("(Harry Potter  #1)", "(Penguin Classics)") and punctuation
+def work_key(title):
+    if not isinstance(title, str):
+        return ''
+    key = NON_WORD.sub(' ', PARENTHESIZED.sub(' ', title.lower())).strip()
+    return key or title.lower().strip()
+
+
+class RerankConfig:
+    def __init__(self, enabled=True, popularity=0.2, diversity=0.3, overfetch=4, budget=0.002):
+        self.enabled = bool(enabled)
+        self.popularity = float(popularity)
+        self.diversity = float(diversity)
+        if not (0 <= self.popularity <= 1 and 0 <= self.diversity <= 1):
+            raise ValueError("Re-ranking popularity and diversity weights must be between 0 and 1")
+        self.overfetch = max(1, int(overfetch))
+        self.budget = float(budget)
+
+    def __eq__(self, other):
+        return isinstance(other, RerankConfig) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return (f"RerankConfig(enabled={self.enabled}, popularity={self.popularity}, "
+                f"diversity={self.diversity}, overfetch={self.overfetch}, budget={self.budget})")
+
+    # What the ranking depends on, for the model's HTTP cache tag; the time
+    # budget only matters when it runs out, so it is left out
+    def to_dict(self):
+        if not self.enabled:
+            return {'enabled': False}
+        return {'enabled': True, 'popularity': self.popularity, 'diversity': self.diversity,
+                'overfetch': self.overfetch}
+
+
+# Per-store state for re-ranking: work ids (title key and first author) and
+# normalized popularity per row
+class Reranker:
+    def __init__(self, store, config=None):
+        self.store = store
+        self.config = config or RerankConfig()
+        # Calls that ran out of their time budget
+        self.budget_exhausted = 0
+        if not self.config.enabled:
+            return
+        works = {}
+        authors = store.author_ids if store.author_ids is not None else np.zeros(len(store), dtype=np.int64)
+        self.work_ids = np.array([works.setdefault((work_key(title), author), len(works))
+                                  for title, author in zip(store.titles, np.asarray(authors).tolist())],
+                                 dtype=np.int32)
+        popularity = np.log1p(np.nan_to_num(np.asarray(store.ratings_count, dtype=np.float64)).clip(0))
+        top = popularity.max() if len(popularity) else 0
+        self.popularity = (popularity / top if top > 0 else popularity).astype(np.float32)
+
+    # Neighbors to fetch for k recommendations
+    def fetch_size(self, k):
+        return k * self.config.overfetch if self.config.enabled else k
+
+    # Feature rows (sparse stays sparse) and their squared norms
+    def vectors(self, rows):
+        block = self.store.features[rows]
+        if hasattr(block, 'multiply'):
+            return block, np.asarray(block.multiply(block).sum(axis=1), dtype=np.float64).ravel()
+        block = np.asarray(block, dtype=np.float64)
+        return block, np.einsum('ij,ij->i', block, block)
+
+    # The k best of `candidates` (neighbor rows of `row`, closest first)
+    def rerank(self, row, candidates, k):
+        candidates = np.asarray(candidates)
+        if not self.config.enabled or len(candidates) == 0:
+            return candidates[:k]
+        config = self.config
+        start = time.perf_counter()
+
+        # First candidate of every work, other editions of the query dropped
+        works = self.work_ids[candidates]
+        _, first = np.unique(works, return_index=True)
+        keep = np.zeros(len(candidates), dtype=bool)
+        keep[first] = True
+        keep &= works != self.work_ids[row]
+        picked, spare = candidates[keep], candidates[~keep]
+        if len(picked) <= 1:
+            return np.concatenate([picked, spare])[:k]
+
+        vectors, norms = self.vectors(np.concatenate([[row], picked]))
+        vectors, norms, query, query_norm = vectors[1:], norms[1:], vectors[0], norms[0]
+        distance = np.sqrt(np.maximum(norms - 2 * dot(vectors, query) + query_norm, 0))
+        scale = distance.max() or 1.0
+        relevance = (1 - config.popularity) * (1 - distance / scale) + \
+            config.popularity * self.popularity[picked]
+
+        exhausted = time.perf_counter() - start > config.budget
+        if exhausted:
+            self.budget_exhausted += 1
+        if exhausted or config.diversity == 0:
+            order = np.argsort(-relevance, kind='stable')
+        else:
+            order = self.mmr(vectors, norms, relevance, scale, min(k, len(picked)), start)
+        result = picked[order[:k]]
+        if len(result) < k:
+            result = np.concatenate([result, spare[:k - len(result)]])
+        return result
+
+    # Greedy maximal marginal relevance over the candidate vectors; returns
+    # candidate positions, best first
+    def mmr(self, vectors, norms, relevance, scale, k, start):
+        config = self.config
+        closest = np.zeros(len(relevance))
+        available = np.ones(len(relevance), dtype=bool)
+        order = []
+        for pick in range(k):
+            score = (1 - config.diversity) * relevance - config.diversity * closest
+            score[~available] = -np.inf
+            best = int(np.argmax(score))
+            order.append(best)
+            available[best] = False
+            if pick == k - 1:
+                break
+            if time.perf_counter() - start > config.budget:
+                self.budget_exhausted += 1
+                break
+            # Similarity of every candidate to the new pick
+            distance = np.sqrt(np.maximum(norms - 2 * dot(vectors, vectors[best]) + norms[best], 0))
+            np.maximum(closest, 1 - np.minimum(distance / scale, 1), out=closest)
+        rest = np.flatnonzero(available)
+        rest = rest[np.argsort(-relevance[rest], kind='stable')]
+        return np.concatenate([np.array(order, dtype=np.int64), rest])
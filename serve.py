@@ -0,0 +1,190 @@
+# Production entry point: a preforking WSGI server.
+#
+#   python serve.py                          # WEB_WORKERS (default: one per core) on :8000
+#   python serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+#
+# The parent imports app.py, which loads the model, builds everything the
+# snapshot would otherwise build lazily (see warm_snapshot), moves all
+# objects into the GC's permanent generation with gc.freeze() and only then
+# forks the workers. The memory-mapped artifact arrays are shared through
+# the page cache; the parent's heap (kNN tree, title indexes) is shared
+# copy-on-write. Freezing keeps the cyclic GC from writing to those objects
+# in every worker, which would otherwise dirty and copy their pages; plain
+# refcount updates still touch the Python objects a request uses, so the
+# large tables are kept in numpy arrays rather than Python containers.
+#
+# Workers accept on the listening socket the parent opened. The parent
+# restarts workers that die, and on SIGHUP (or a reload/catalogue update
+# forwarded by a worker) reloads the model once and replaces all workers.
+# SIGTERM/SIGINT stop the workers after their in-flight requests.
+import argparse
+import gc
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+
+# WSGI server handling each request on a thread, at most `threads` at once;
+# further connections wait in the listen backlog. Request threads are
+# joined on server_close so a stopped worker finishes what it accepted.
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = False
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, handler, threads):
+        super().__init__(address, handler)
+        self.slots = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        try:
+            super().shutdown_request(request)
+        finally:
+            self.slots.release()
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve on the inherited socket until SIGTERM, then finish in-flight requests
+def run_worker(server, holder):
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    parent = os.getppid()
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    holder.delegate = lambda: os.kill(parent, signal.SIGHUP)
+    server.serve_forever()
+    server.server_close()
+    os._exit(0)
+
+
+class Supervisor:
+    def __init__(self, server, holder, workers, grace):
+        self.server = server
+        self.holder = holder
+        self.workers = workers
+        self.grace = grace
+        self.children = set()
+        self.stopping = False
+        self.reload_requested = False
+
+    def prepare(self):
+        from model_holder import warm_snapshot
+
+        snapshot = self.holder.current()
+        if snapshot is not None:
+            warm_snapshot(snapshot)
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.server, self.holder)
+            finally:
+                os._exit(1)
+        self.children.add(pid)
+        return pid
+
+    def stop(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + self.grace
+        while pids and time.time() < deadline:
+            pids = {pid for pid in pids if not self.reap(pid)}
+            time.sleep(0.05)
+        for pid in pids:
+            os.kill(pid, signal.SIGKILL)
+            self.reap(pid, block=True)
+
+    def reap(self, pid, block=False):
+        try:
+            done, _ = os.waitpid(pid, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            done = pid
+        if done:
+            self.children.discard(pid)
+        return bool(done)
+
+    # Reload in the parent, then start fresh workers before stopping the old
+    # ones so the socket is never left without an acceptor
+    def reload(self):
+        self.reload_requested = False
+        if not self.holder.reload():
+            print("Reload failed; workers keep the current model")
+            return
+        self.prepare()
+        old = set(self.children)
+        for _ in range(self.workers):
+            self.spawn()
+        self.stop(old)
+        print(f"Replaced {len(old)} workers with model snapshot v{self.holder.version}")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGHUP, self.request_reload)
+        self.prepare()
+        for _ in range(self.workers):
+            self.spawn()
+        print(f"Serving on http://{self.server.server_address[0]}:{self.server.server_address[1]} "
+              f"with {self.workers} workers (parent pid {os.getpid()})")
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload()
+            for pid in list(self.children):
+                if self.reap(pid) and not self.stopping:
+                    print(f"Worker {pid} exited, starting a new one")
+                    self.spawn()
+            time.sleep(0.2)
+        self.stop(set(self.children))
+        self.server.server_close()
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
+
+    def request_reload(self, signum, frame):
+        self.reload_requested = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preforking server for the book recommender")
+    parser.add_argument('--bind', default=os.environ.get('BIND', '0.0.0.0:8000'))
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', '4')),
+                        help="request threads per worker")
+    parser.add_argument('--grace', type=float, default=30,
+                        help="seconds workers get to finish requests when stopped")
+    args = parser.parse_args()
+
+    # Collections during the model load would only promote objects that are
+    # about to be frozen anyway
+    gc.disable()
+    import app
+
+    host, _, port = args.bind.rpartition(':')
+    server = ThreadingWSGIServer((host or '0.0.0.0', int(port)), QuietHandler, args.threads)
+    server.set_app(app.app)
+    gc.enable()
+
+    Supervisor(server, app.holder, args.workers, args.grace).run()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+// Autocomplete functionality
+document.addEventListener('DOMContentLoaded', function() {
+    const searchInput = document.getElementById('book-search');
+    const resultsContainer = document.getElementById('autocomplete-results');
+    const searchForm = document.getElementById('search-form');
+
+    let selectedIndex = -1;
+    let searchResults = [];
+
+    // Fetch book suggestions as user types
+    searchInput.addEventListener('input', debounce(async function() {
+        const query = searchInput.value.trim();
+
+        if (query.length < 2) {
+            resultsContainer.classList.remove('active');
+            return;
+        }
+
+        try {
+            const response = await fetch(`/autocomplete?q=${encodeURIComponent(query)}`);
+            searchResults = await response.json();
+
+            if (searchResults.length > 0) {
+                displayResults(searchResults, query);
+                resultsContainer.classList.add('active');
+            } else {
+                resultsContainer.classList.remove('active');
+            }
+        } catch (error) {
+            console.error('Error fetching autocomplete results:', error);
+        }
+    }, 300));
+
+    // Handle keyboard navigation
+    searchInput.addEventListener('keydown', function(e) {
+        if (!resultsContainer.classList.contains('active')) return;
+
+        const items = resultsContainer.querySelectorAll('.autocomplete-item');
+
+        // Down arrow
+        if (e.key === 'ArrowDown') {
+            e.preventDefault();
+            selectedIndex = Math.min(selectedIndex + 1, items.length - 1);
+            highlightItem(items);
+        }
+
+        // Up arrow
+        else if (e.key === 'ArrowUp') {
+            e.preventDefault();
+            selectedIndex = Math.max(selectedIndex - 1, -1);
+            highlightItem(items);
+        }
+
+        // Enter key
+        else if (e.key === 'Enter' && selectedIndex >= 0) {
+            e.preventDefault();
+            searchInput.value = searchResults[selectedIndex];
+            resultsContainer.classList.remove('active');
+            selectedIndex = -1;
+            searchForm.submit();
+        }
+
+        // Escape key
+        else if (e.key === 'Escape') {
+            resultsContainer.classList.remove('active');
+            selectedIndex = -1;
+        }
+    });
+
+    // Hide results when clicking outside
+    document.addEventListener('click', function(e) {
+        if (!searchInput.contains(e.target) && !resultsContainer.contains(e.target)) {
+            resultsContainer.classList.remove('active');
+        }
+    });
+
+    // Display results with highlighted matching parts
+    function displayResults(results, query) {
+        resultsContainer.innerHTML = '';
+
+        results.forEach((result, index) => {
+            const item = document.createElement('div');
+            item.className = 'autocomplete-item';
+
+            // Highlight matching part
+            const regex = new RegExp(`(${escapeRegExp(query)})`, 'gi');
+            const highlightedText = result.replace(regex, '<span class="highlight">$1</span>');
+
+            item.innerHTML = highlightedText;
+
+            // Click handler
+            item.addEventListener('click', function() {
+                searchInput.value = result;
+                resultsContainer.classList.remove('active');
+                searchForm.submit();
+            });
+
+            // Mouseover handler
+            item.addEventListener('mouseover', function() {
+                selectedIndex = index;
+                highlightItem(resultsContainer.querySelectorAll('.autocomplete-item'));
+            });
+
+            resultsContainer.appendChild(item);
+        });
+    }
+
+    // Highlight selected item
+    function highlightItem(items) {
+        items.forEach((item, index) => {
+            if (index === selectedIndex) {
+                item.style.backgroundColor = '#f0f0f0';
+            } else {
+                item.style.backgroundColor = '';
+            }
+        });
+
+        if (selectedIndex >= 0) {
+            const selectedItem = items[selectedIndex];
+            selectedItem.scrollIntoView({ block: 'nearest' });
+        }
+    }
+
+    // Debounce function to limit API calls
+    function debounce(func, delay) {
+        let timeout;
+        return function() {
+            const context = this;
+            const args = arguments;
+            clearTimeout(timeout);
+            timeout = setTimeout(() => func.apply(context, args), delay);
+        };
+    }
+
+    // Escape special characters for regex
+    function escapeRegExp(string) {
+        return string.replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
+    }
+});
@@ -0,0 +1,126 @@
+# Fingerprinted, pre-compressed static files.
+#
+# Every file under static/ is read once at startup and published under a
+# name carrying a hash of its contents (css/app.css -> css/app.1f3a9c0d2b7e.css),
+# so it can be cached forever: editing the file changes the name the
+# templates link to (asset_url). Text files are compressed once with gzip
+# and, when the optional brotli package is installed, brotli; requests get
+# the smallest variant their Accept-Encoding allows.
+#
+#   python static_assets.py --out dist/static     # files plus .gz/.br for a CDN or reverse proxy
+import argparse
+import collections
+import gzip
+import hashlib
+import mimetypes
+import os
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+FINGERPRINT_LENGTH = 12
+IMMUTABLE = 'public, max-age=31536000, immutable'
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+# `bodies` maps a content coding ('identity', 'gzip', 'br') to the bytes sent
+Asset = collections.namedtuple('Asset', ['name', 'content_type', 'etag', 'bodies'])
+
+
+def brotli_compress(data):
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+# Encodings worth storing for a file: only ones that actually shrink it
+def encode_variants(data, content_type):
+    bodies = {'identity': data}
+    if content_type.startswith(COMPRESSIBLE):
+        for coding, body in (('gzip', gzip.compress(data, compresslevel=9, mtime=0)),
+                             ('br', brotli_compress(data))):
+            if body is not None and len(body) < len(data):
+                bodies[coding] = body
+    return bodies
+
+
+def fingerprinted_name(name, data):
+    digest = hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}", digest
+
+
+# Content codings from an Accept-Encoding header that the client allows
+def accepted_codings(header):
+    accepted = {'identity'}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+# All files under a static directory, keyed by their fingerprinted name
+class StaticAssets:
+    def __init__(self, static_dir=STATIC_DIR):
+        self.static_dir = static_dir
+        self.urls = {}
+        self.files = {}
+        for root, _, names in os.walk(static_dir):
+            for filename in sorted(names):
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, static_dir).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                published, digest = fingerprinted_name(name, data)
+                content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                self.urls[name] = published
+                self.files[published] = Asset(published, content_type, digest,
+                                              encode_variants(data, content_type))
+
+    # URL of a static file by its source name, for templates
+    def url(self, name):
+        return f"/static/{self.urls[name]}"
+
+    def get(self, published):
+        return self.files.get(published)
+
+    # Write every fingerprinted file and its compressed variants under out_dir
+    def write(self, out_dir):
+        for asset in self.files.values():
+            path = os.path.join(out_dir, *asset.name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            for coding, body in asset.bodies.items():
+                suffix = {'identity': '', 'gzip': '.gz', 'br': '.br'}[coding]
+                with open(path + suffix, 'wb') as f:
+                    f.write(body)
+
+
+# Smallest stored variant the client accepts, as (coding, body)
+def negotiate(asset, accept_encoding):
+    accepted = accepted_codings(accept_encoding)
+    options = [(len(body), coding) for coding, body in asset.bodies.items() if coding in accepted]
+    _, coding = min(options)
+    return coding, asset.bodies[coding]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write fingerprinted, pre-compressed static files")
+    parser.add_argument('--static', default=STATIC_DIR)
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+
+    assets = StaticAssets(args.static)
+    assets.write(args.out)
+    for name, published in sorted(assets.urls.items()):
+        sizes = ', '.join(f"{coding} {len(body)}" for coding, body in assets.get(published).bodies.items())
+        print(f"{name} -> {published} ({sizes} bytes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+import bisect
+import difflib
+import heapq
+import re
+import sys
+import time
+import numpy as np
+
+# Fuzzy matching corrects each query word against the title vocabulary
+# (SymSpell-style deletion index), ranks the titles containing the
+# corrections and scores only the best FUZZY_CANDIDATES of them with
+# difflib. Queries whose words all fail to correct fall back to titles
+# sharing character trigrams with the query.
+FUZZY_CANDIDATES = 50
+# Default edit-distance limit per word. Short words get fewer edits (see
+# word_edits), so "cat" is never "corrected" to "hat".
+FUZZY_MAX_EDITS = 2
+# Default time budget per fuzzy lookup, in seconds. Past it the lookup
+# returns the best titles scored so far.
+FUZZY_BUDGET = 0.05
+# Only the first DELETE_PREFIX characters of a word go into the deletion
+# index; candidates are then checked against the full word
+DELETE_PREFIX = 7
+# Upper bound on the titles gathered from the postings of the rarest query
+# words; more common words only re-score those titles
+FUZZY_SCAN_ROWS = 20000
+
+WORD = re.compile(r'\w+')
+
+
+# Lookup key for a title: lowercase with runs of whitespace collapsed
+def normalize_title(text):
+    return ' '.join(text.lower().split())
+
+
+# Split a normalized string into its set of character trigrams
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Edits allowed when correcting a word: none up to 3 characters, one up to
+# 6, then max_edits
+def word_edits(word, max_edits):
+    return max(0, min(max_edits, (len(word) - 1) // 3))
+
+
+# The word and every string obtained by deleting up to `edits` characters
+def deletes(word, edits):
+    found = {word}
+    frontier = {word}
+    for _ in range(edits):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        found |= frontier
+    return found
+
+
+# Optimal string alignment distance (Levenshtein plus adjacent swaps),
+# abandoned as soon as it must exceed `limit`; returns limit + 1 then
+def edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+# difflib.get_close_matches over titles in the order given, stopping once
+# the deadline passes (after at least one title). Returns the best n
+# titles scored so far and whether the deadline cut the scan short.
+def close_matches(query, titles, n, cutoff, deadline):
+    matcher = difflib.SequenceMatcher()
+    matcher.set_seq2(query)
+    scored = []
+    for i, title in enumerate(titles):
+        matcher.set_seq1(title)
+        if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+            ratio = matcher.ratio()
+            if ratio >= cutoff:
+                scored.append((ratio, title))
+        if time.perf_counter() > deadline and i + 1 < len(titles):
+            return [title for _, title in heapq.nlargest(n, scored)], True
+    return [title for _, title in heapq.nlargest(n, scored)], False
+
+
+# Title index built once at startup. Keeps the lowercase titles next to the
+# originals plus a character-trigram inverted index (trigram -> sorted row ids)
+# so substring and fuzzy lookups only touch rows that can possibly match.
+# Exact and normalized titles resolve to a row through plain dicts. Titles
+# that appear more than once (different editions) resolve to the edition
+# with the highest `popularity`, earliest row on ties. Title words get their
+# own inverted index plus a deletion index for typo correction, built for
+# corrections of up to `max_edits` per word. `budget` is the default time
+# limit of a fuzzy lookup.
+class TitleIndex:
+    def __init__(self, titles, popularity=None, max_edits=FUZZY_MAX_EDITS, budget=FUZZY_BUDGET):
+        self.titles = titles
+        self.budget = budget
+        self.lowered = [t.lower() if isinstance(t, str) else '' for t in titles]
+
+        if popularity is None:
+            order = range(len(titles))
+        else:
+            popularity = np.nan_to_num(np.asarray(popularity, dtype=np.float64))
+            order = np.argsort(-popularity, kind='stable').tolist()
+        self.exact_rows = {}
+        self.normalized_rows = {}
+        for row in order:
+            title = self.titles[row]
+            if not isinstance(title, str):
+                continue
+            self.exact_rows.setdefault(title, row)
+            self.normalized_rows.setdefault(normalize_title(title), row)
+
+        postings = {}
+        gram_counts = np.zeros(len(self.lowered), dtype=np.int32)
+        for row, title in enumerate(self.lowered):
+            grams = trigrams(title)
+            gram_counts[row] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(row)
+
+        # Rows are appended in order, so every posting list is already sorted
+        self.postings = {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+        self.gram_counts = gram_counts
+        self.build_word_index(max_edits)
+        # Fuzzy lookups cut short by their time budget
+        self.budget_exhausted = 0
+
+    # Word -> id, id -> sorted row ids and inverse document frequency, and
+    # the deletion index: every deletion of up to word_edits characters from
+    # a word's first DELETE_PREFIX characters -> word ids. A misspelling is
+    # looked up through its own deletions, as in SymSpell.
+    def build_word_index(self, max_edits):
+        self.max_edits = max_edits
+        word_ids = {}
+        word_rows = []
+        for row, title in enumerate(self.lowered):
+            for word in set(WORD.findall(title)):
+                wid = word_ids.get(word)
+                if wid is None:
+                    wid = word_ids[word] = len(word_rows)
+                    word_rows.append([])
+                word_rows[wid].append(row)
+
+        self.word_ids = word_ids
+        self.words = list(word_ids)
+        self.word_rows = [np.array(rows, dtype=np.int32) for rows in word_rows]
+        counts = np.array([len(rows) for rows in word_rows], dtype=np.float64)
+        self.word_idf = np.log(max(len(self.lowered), 1) / np.maximum(counts, 1)) + 1
+
+        self.deletions = {}
+        for word, wid in word_ids.items():
+            edits = word_edits(word, max_edits)
+            if edits == 0:
+                continue
+            for key in deletes(word[:DELETE_PREFIX], edits):
+                self.deletions.setdefault(key, []).append(wid)
+
+    # Vocabulary words within the edit limit of a query word, as {word id: distance}
+    def corrections(self, word):
+        edits = word_edits(word, self.max_edits)
+        wid = self.word_ids.get(word)
+        if edits == 0:
+            return {} if wid is None else {wid: 0}
+
+        found = {} if wid is None else {wid: 0}
+        checked = set(found)
+        for key in deletes(word[:DELETE_PREFIX], edits):
+            for candidate in self.deletions.get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                distance = edit_distance(word, self.words[candidate], edits)
+                if distance <= edits:
+                    found[candidate] = distance
+        return found
+
+    # Rows containing corrections of the query words, best first. A title
+    # scores, for each query word, the idf of its best correction scaled
+    # down by the edits it took. Titles are gathered from the rarest query
+    # words' postings (at most FUZZY_SCAN_ROWS of them) and every other word
+    # only re-scores those, so common words never cost a catalogue-wide pass.
+    def word_candidate_rows(self, query, limit=FUZZY_CANDIDATES, deadline=None):
+        groups = []
+        for word in dict.fromkeys(WORD.findall(query.lower())):
+            found = self.corrections(word)
+            if found:
+                weighted = [(wid, self.word_idf[wid] * (1 - distance / (len(word) + 1)))
+                            for wid, distance in found.items()]
+                groups.append((sum(len(self.word_rows[wid]) for wid in found), weighted))
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+        if not groups:
+            return np.array([], dtype=np.int32)
+
+        groups.sort(key=lambda group: group[0])
+        gathered = []
+        total = 0
+        for size, weighted in groups:
+            if gathered and total + size > FUZZY_SCAN_ROWS:
+                break
+            gathered.extend(self.word_rows[wid] for wid, _ in weighted)
+            total += size
+        rows = np.unique(np.concatenate(gathered))[:FUZZY_SCAN_ROWS]
+
+        scores = np.zeros(len(rows))
+        for _, weighted in groups:
+            best = np.zeros(len(rows))
+            for wid, weight in weighted:
+                posting = self.word_rows[wid]
+                at = np.minimum(np.searchsorted(posting, rows), len(posting) - 1)
+                np.maximum(best, np.where(posting[at] == rows, weight, 0.0), out=best)
+            scores += best
+        if len(rows) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            rows, scores = rows[top], scores[top]
+        return rows[np.argsort(-scores, kind='stable')]
+
+    def __len__(self):
+        return len(self.titles)
+
+    # Row for an exact title, falling back to the normalized form; None if unknown
+    def lookup(self, title):
+        row = self.exact_rows.get(title)
+        if row is None:
+            row = self.normalized_rows.get(normalize_title(title))
+        return row
+
+    # Row ids (in catalogue order) whose lowercase title contains the query.
+    # The query must already be normalized with lower().
+    def substring_rows(self, query, limit=None):
+        grams = trigrams(query)
+        if not grams:
+            # Too short for a trigram lookup, verify every title directly
+            candidates = range(len(self.lowered))
+        else:
+            lists = []
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    return []
+                lists.append(posting)
+            lists.sort(key=len)
+            candidates = lists[0]
+            for posting in lists[1:]:
+                candidates = np.intersect1d(candidates, posting, assume_unique=True)
+                if len(candidates) == 0:
+                    return []
+
+        rows = []
+        for row in candidates:
+            if query in self.lowered[row]:
+                rows.append(int(row))
+                if limit is not None and len(rows) >= limit:
+                    break
+        return rows
+
+    # Titles whose lowercase form contains the query, in catalogue order
+    def substring_matches(self, query, limit=None):
+        return [self.titles[row] for row in self.substring_rows(query, limit)]
+
+    # Row ids sharing the most trigrams with the query, ranked by Dice overlap
+    def trigram_candidate_rows(self, query, limit=FUZZY_CANDIDATES):
+        grams = trigrams(query)
+        postings = [self.postings[g] for g in grams if g in self.postings]
+        if not postings:
+            return np.array([], dtype=np.int32)
+
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.titles))
+        hit_rows = np.flatnonzero(shared)
+        dice = 2.0 * shared[hit_rows] / (len(grams) + self.gram_counts[hit_rows])
+        if len(hit_rows) > limit:
+            top = np.argpartition(-dice, limit - 1)[:limit]
+            hit_rows, dice = hit_rows[top], dice[top]
+        return hit_rows[np.argsort(-dice, kind='stable')]
+
+    # difflib close matches, scored only against the word (or trigram)
+    # candidate pool, within `budget` seconds (the index's default if None).
+    # Titles listed in `exclude` are skipped, mirroring the old full scan.
+    # Returns (matches, exhausted); exhausted lookups may have missed better
+    # titles, so their results must not be cached.
+    def fuzzy_matches(self, query, n=3, cutoff=0.6, exclude=(), budget=None):
+        deadline = time.perf_counter() + (self.budget if budget is None else budget)
+        rows = self.word_candidate_rows(query, deadline=deadline)
+        if len(rows) == 0 and time.perf_counter() <= deadline:
+            rows = self.trigram_candidate_rows(query)
+
+        pool = []
+        for row in rows:
+            title = self.titles[row]
+            if title not in exclude and title not in pool:
+                pool.append(title)
+        matches, exhausted = close_matches(query, pool, n, cutoff, deadline)
+        # The candidate search stops at the deadline too, possibly short
+        exhausted = exhausted or time.perf_counter() > deadline
+        if exhausted:
+            self.budget_exhausted += 1
+        return matches, exhausted
+
+
+# Longest key kept per completion entry. Longer prefixes are truncated for
+# the bisect and then checked against the full lowercase title.
+COMPLETION_KEY_LENGTH = 32
+
+WORD_START = re.compile(r'(?<!\w)\w')
+
+
+# Smallest string above every string starting with `key` (its last
+# character incremented), or None when no such string exists
+def prefix_end(key):
+    while key and key[-1] == chr(sys.maxunicode):
+        key = key[:-1]
+    return key[:-1] + chr(ord(key[-1]) + 1) if key else None
+
+
+# Prefix-completion engine built once at startup. Every word start in a
+# lowercase title becomes an entry (title suffix from that word, row), so
+# "potter" completes to "Harry Potter ...". Entries are kept in one sorted
+# array that is searched with bisect; matches are ranked by popularity.
+# Pass `lowered` to share the lowercase titles already held by a TitleIndex.
+class CompletionIndex:
+    def __init__(self, titles, popularity, lowered=None):
+        self.titles = titles
+        self.lowered = lowered if lowered is not None else \
+            [t.lower() if isinstance(t, str) else '' for t in titles]
+
+        entries = []
+        for row, title in enumerate(self.lowered):
+            starts = [m.start() for m in WORD_START.finditer(title)]
+            if not starts or starts[0] != 0:
+                starts.insert(0, 0)
+            for start in starts:
+                entries.append((title[start:start + COMPLETION_KEY_LENGTH], row, start))
+        entries.sort()
+
+        self.keys = [key for key, _, _ in entries]
+        self.rows = np.array([row for _, row, _ in entries], dtype=np.int32)
+        self.offsets = np.array([start for _, _, start in entries], dtype=np.int32)
+        popularity = np.nan_to_num(np.asarray(popularity, dtype=np.float64))
+        self.popularity = popularity[self.rows] if len(self.rows) else popularity[:0]
+
+    # Top-k distinct titles with a word starting with the prefix, most popular first
+    def complete(self, prefix, k=10):
+        prefix = prefix.lower().strip()
+        if not prefix or not self.keys:
+            return []
+
+        key = prefix[:COMPLETION_KEY_LENGTH]
+        lo = bisect.bisect_left(self.keys, key)
+        end = prefix_end(key)
+        hi = len(self.keys) if end is None else bisect.bisect_left(self.keys, end, lo)
+        if lo == hi:
+            return []
+
+        popularity = self.popularity[lo:hi]
+        # Partial sort only the head of the range; widen if duplicates eat into it
+        take = min(hi - lo, k * 4)
+        while True:
+            if take < hi - lo:
+                head = np.argpartition(-popularity, take - 1)[:take]
+            else:
+                head = np.arange(hi - lo)
+            head = head[np.argsort(-popularity[head], kind='stable')]
+
+            results = []
+            seen = set()
+            for i in head:
+                row, start = self.rows[lo + i], self.offsets[lo + i]
+                if len(prefix) > COMPLETION_KEY_LENGTH and \
+                        not self.lowered[row].startswith(prefix, start):
+                    continue
+                title = self.titles[row]
+                if title in seen:
+                    continue
+                seen.add(title)
+                results.append(title)
+                if len(results) >= k:
+                    return results
+
+            if take >= hi - lo:
+                return results
+            take = min(hi - lo, take * 4)